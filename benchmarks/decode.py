@@ -0,0 +1,72 @@
+"""Apollo state decoding: CPU time and peak memory per page.
+
+Compares a whole decode with json, a whole decode with orjson (if installed),
+and psextract.apolloentries, which decodes only a deal page's grid, products and prices.
+Pages are recorded HTML files of deal pages; without any, synthetic ones are used.
+
+	python benchmarks/decode.py [page.html ...]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from modules import psextract
+import synthetic
+
+ROUNDS = 50
+
+
+def wholejson(text):
+	return json.loads(text)["props"]["apolloState"]
+
+
+def selective(text):
+	state = psextract.apolloentries(text, prefixes=["CategoryGrid:", "Product:"])
+	priceIDs = [entry["price"]["id"] for key, entry in state.items() if key.startswith("Product:")]
+	state.update(psextract.apolloentries(text, keys=priceIDs))
+	return state
+
+
+def measure(decode, texts):
+	"""Return milliseconds per page and peak KiB allocated while decoding one page."""
+	start = time.perf_counter()
+	for _ in range(ROUNDS):
+		for text in texts:
+			decode(text)
+	elapsed = (time.perf_counter() - start) / ROUNDS / len(texts) * 1000
+	peaks = []
+	for text in texts:
+		tracemalloc.start()
+		decode(text)
+		peaks.append(tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	return elapsed, max(peaks) / 1024
+
+
+def main():
+	if sys.argv[1:]:
+		pages = []
+		for path in sys.argv[1:]:
+			with open(path, encoding="utf-8") as f:
+				pages.append(f.read())
+	else:
+		pages = [synthetic.categorypage(pagenumber=n, pagesize=24, total=240) for n in range(1, 11)]
+	texts = [psextract.nextdata(page) for page in pages]
+	print("{} pages, {:.0f} KiB of __NEXT_DATA__ on average".format(
+		len(texts), sum(map(len, texts)) / len(texts) / 1024
+	))
+
+	decoders = [("json", wholejson), ("selective", selective)]
+	if psextract.loads is not json.loads:
+		decoders.insert(1, ("orjson", psextract.apollostate))
+	for name, decode in decoders:
+		elapsed, peak = measure(decode, texts)
+		print("{:<10} {:7.3f} ms/page  {:8.0f} KiB peak".format(name, elapsed, peak))
+
+
+if __name__ == "__main__":
+	main()
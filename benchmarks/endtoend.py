@@ -0,0 +1,118 @@
+"""End-to-end throughput against a local stand-in store (see server.py).
+
+Runs psfetcher's deal fetching, search and watchlist check as separate processes
+with a temporary database, and reports pages/s, rows/s, wall time and peak RSS of each.
+Page and row counts come from the run's metrics file (see --metrics).
+
+	python benchmarks/endtoend.py [--items 2400] [--latency 0.1] [--jitter 0.05] [--errors 0.01] ...
+"""
+import argparse
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHDIR))
+
+import server
+import synthetic
+
+PSFETCHER = os.path.join(os.path.dirname(BENCHDIR), "psfetcher.py")
+sampleReg = re.compile(r"^psfetcher_(\w+?)(?:_total)?\{(.*)\} (\S+)$")
+
+
+def metrics(filename):
+	"""Return a dict of summed metric values by name from a metrics file."""
+	values = {}
+	with open(filename) as prom:
+		for line in prom:
+			match = sampleReg.match(line.strip())
+			if match:
+				name, labels, value = match.groups()
+				values[name] = values.get(name, 0) + float(value)
+	return values
+
+
+def run(args, env):
+	"""Return wall time in seconds and peak RSS in KiB of a psfetcher run."""
+	start = time.perf_counter()
+	proc = subprocess.Popen(
+		[sys.executable, PSFETCHER] + args, env=env,
+		stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+	)
+	# wait4 reports the peak RSS of this run alone, its pool workers included
+	stderr = proc.stderr.read()
+	pid, status, usage = os.wait4(proc.pid, 0)
+	proc.returncode = os.waitstatus_to_exitcode(status)
+	wall = time.perf_counter() - start
+	if proc.returncode:
+		sys.stderr.write(stderr.decode(errors="replace"))
+		raise SystemExit("psfetcher {} failed".format(" ".join(args)))
+	return wall, usage.ru_maxrss
+
+
+def addwatchlist(dbfile, count, locale="en-us"):
+	"""Return None. Add synthetic titles to a database's watchlist."""
+	c = sqlite3.connect(dbfile)
+	c.executemany(
+		"insert into watchlist (title, titleID, locale) values (?, ?, ?)",
+		[("title {}".format(index), synthetic.titleID(index), locale) for index in range(count)]
+	)
+	c.commit()
+	c.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("--queries", type=int, default=5, help="number of search queries")
+	parser.add_argument("--search-pages", type=int, default=3, help="results pages per query")
+	parser.add_argument("--watch", type=int, default=50, help="number of watchlist titles")
+	parser.add_argument("--only", nargs="+", choices=["deals", "search", "watchlist"])
+	server.addoptions(parser)
+	args = parser.parse_args()
+	settings = {key: getattr(args, key) for key in server.SETTINGS}
+	store, url = server.serve(**settings)
+
+	workdir = tempfile.mkdtemp(prefix="psfetcher-bench.")
+	dbfile = os.path.join(workdir, "psfetcher.db")
+	promfile = os.path.join(workdir, "run.prom")
+	env = dict(os.environ, PSFETCHER_STORE_URL=url, PSFETCHER_DB=dbfile)
+
+	queries = ", ".join(synthetic.NAMES[index % len(synthetic.NAMES)] for index in range(args.queries))
+	scenarios = [
+		("deals", ["-s", "us", "-a", "-i", "-n"]),
+		("search", ["-s", "us", "-n", "--pages", str(args.search_pages), "-q", queries]),
+		("watchlist", ["-s", "us", "-n", "watchlist", "--check"]),
+	]
+	print("store: {deals} deals + {nested} nested, {items} items per deal, {pagesize} per page, "
+		"latency {latency}s ±{jitter}s, {errors:.0%} errors".format(**settings))
+	print("{:<10} | {:>7} | {:>7} | {:>8} | {:>7} | {:>6} | {:>9}".format(
+		"scenario", "pages", "rows", "pages/s", "rows/s", "wall s", "peak MiB"
+	))
+	for name, psargs in scenarios:
+		if args.only and name not in args.only:
+			continue
+		if name == "watchlist":
+			# the deals' prices would be reused by a check, so the database is emptied (and created, if needed) first
+			run(["-s", "us", "-n", "-q", "nothing"], env)
+			run(["flushall"], env)
+			addwatchlist(dbfile, args.watch)
+		wall, peak = run(["--metrics", promfile] + psargs, env)
+		values = metrics(promfile)
+		pages = values.get("pages", 0)
+		if name == "watchlist":
+			# a check fetches one product page per title
+			pages = values.get("requests", 0)
+		rows = values.get("rows_ingested", 0)
+		print("{:<10} | {:>7.0f} | {:>7.0f} | {:>8.1f} | {:>7.0f} | {:>6.2f} | {:>9.1f}".format(
+			name, pages, rows, pages / wall, rows / wall, wall, peak / 1024
+		))
+	store.shutdown()
+
+
+if __name__ == "__main__":
+	main()
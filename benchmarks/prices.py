@@ -0,0 +1,107 @@
+"""Price normalisation: correctness corpus and throughput.
+
+Checks psprice.minorunits against price formats of every store in 'lang.json',
+then compares its throughput with the per-item parsing it replaced.
+
+	python benchmarks/prices.py [number of prices]
+"""
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from modules import psprice
+from modules.globals import CONFIG
+
+# price strings as shown per country, mapped to minor units (hundredths)
+CORPUS = {
+	"us": {"$59.99": 5999, "$1,299.99": 129999, "$0.99": 99, "Free": None, "Included": None},
+	"ca": {"$79.99": 7999, "79,99 $": 7999, "$1,099.99": 109999},
+	"gb": {"£54.99": 5499, "£1,049.99": 104999},
+	"ie": {"€69.99": 6999, "€1,099.99": 109999},
+	"mt": {"€69.99": 6999},
+	"cy": {"€69.99": 6999},
+	"in": {"Rs 3,999": 399900, "Rs 3,999.00": 399900, "Rs 499": 49900},
+	"de": {"79,99 €": 7999, "1.099,99 €": 109999},
+	"at": {"79,99 €": 7999, "1.099,99 €": 109999},
+	"lu": {"79,99 €": 7999, "79,99\xa0€": 7999},
+	"fr": {"79,99 €": 7999, "1\u202f099,99 €": 109999, "1 099,99\xa0€": 109999},
+	"be": {"79,99 €": 7999, "€ 79,99": 7999},
+	"nl": {"€ 79,99": 7999, "€ 1.099,99": 109999},
+	"es": {"79,99 €": 7999, "1.099,99 €": 109999},
+	"pt": {"79,99 €": 7999},
+	"it": {"79,99 €": 7999, "1.099,99 €": 109999},
+	"fi": {"79,99 €": 7999},
+	"gr": {"79,99 €": 7999},
+	"sk": {"79,99 €": 7999},
+	"si": {"79,99 €": 7999},
+	"hr": {"79,99 €": 7999, "599,00 kn": 59900},
+	"dk": {"599,00 kr.": 59900, "DKK 599,00": 59900, "1.099,00 kr.": 109900},
+	"se": {"799 kr": 79900, "799,00 kr": 79900, "1 099,00 kr": 109900},
+	"no": {"899 kr": 89900, "899,00 kr": 89900, "NOK 1 099,00": 109900},
+	"is": {"9.999 kr": 999900, "ISK 9 999": 999900},
+	"pl": {"299,00 zł": 29900, "1 099,00 zł": 109900, "1.099,00 zł": 109900},
+	"cz": {"1 999 Kč": 199900, "1 999,00 Kč": 199900},
+	"hu": {"24 990 Ft": 2499000, "HUF\xa024\xa0990": 2499000},
+	"ro": {"349,99 RON": 34999, "349,99 lei": 34999},
+	"bg": {"139,00 лв": 13900, "BGN 139,00": 13900},
+	"ru": {"4 999 руб.": 499900, "4 999,00 RUB": 499900},
+}
+
+
+def oldroundprice(price):
+	"""The per-item parsing used before psprice, for comparison."""
+	try:
+		noCurrencyReg = re.compile(r"[0-9,.\s]+")
+		price = noCurrencyReg.search(price).group()
+		price = price.translate(str.maketrans({" ": None, ",": "."}))
+		decSepPosition = price.find(".") + 1
+		if len(price[decSepPosition:]) >= 3:
+			price = price.replace(".", "")
+		return round(float(price), 2)
+	except (KeyError, AttributeError, ValueError, TypeError):
+		return psprice.UNPRICED
+
+
+def checkcorpus():
+	with open(CONFIG) as conf:
+		countries = set(country for lang in json.load(conf).values() for country in lang["country"])
+	missing = countries - set(CORPUS)
+	assert not missing, "no corpus for: {}".format(", ".join(sorted(missing)))
+
+	failures = 0
+	for country, prices in sorted(CORPUS.items()):
+		for price, expected in prices.items():
+			units, = psprice.minorunits([price])
+			if units != expected:
+				failures += 1
+				print("{}: {!r} -> {}, expected {}".format(country, price, units, expected))
+	total = sum(len(prices) for prices in CORPUS.values())
+	print("corpus: {}/{} prices across {} stores".format(total - failures, total, len(CORPUS)))
+	return failures
+
+
+def throughput(count):
+	sample = [price for prices in CORPUS.values() for price in prices]
+	prices = (sample * (count // len(sample) + 1))[:count]
+
+	start = time.perf_counter()
+	[oldroundprice(price) for price in prices]
+	old = time.perf_counter() - start
+
+	start = time.perf_counter()
+	psprice.roundprices(prices)
+	new = time.perf_counter() - start
+
+	print("per-item parsing: {:>12,.0f} prices/s".format(count / old))
+	print("psprice batch:    {:>12,.0f} prices/s".format(count / new))
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	failures = checkcorpus()
+	throughput(count)
+	sys.exit(1 if failures else 0)
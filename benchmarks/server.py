@@ -0,0 +1,117 @@
+"""A local stand-in for PS Store serving synthetic pages (see synthetic.py).
+
+Serves /xx-yy/deals, category grid pages, search results and product pages,
+with a configurable latency, jitter and rate of 503 errors.
+
+	python benchmarks/server.py [--port 8000] [--items 480] [--latency 0.1] ...
+
+and point psfetcher at it with PSFETCHER_STORE_URL=http://127.0.0.1:8000
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import argparse
+import random
+import re
+import threading
+import time
+
+import synthetic
+
+SETTINGS = {
+	"deals": 3, "nested": 1, "items": 480, "pagesize": 24, "searchhits": 72,
+	"latency": 0.0, "jitter": 0.0, "errors": 0.0, "seed": 0,
+}
+
+categoryReg = re.compile(r"^/(\w\w-\w\w)/category/([\w-]+)/(\d*)$")
+searchReg = re.compile(r"^/(\w\w-\w\w)/search/([^/]+)(?:/(\d+))?$")
+productReg = re.compile(r"^/(\w\w-\w\w)/product/([\w-]+)$")
+dealsReg = re.compile(r"^/(\w\w-\w\w)/deals$")
+
+
+def page(path, settings):
+	"""Return a page's HTML for a path, or None if there's no such page."""
+	match = dealsReg.match(path)
+	if match:
+		return synthetic.dealspage(match.group(1), deals=settings["deals"], nested=settings["nested"])
+	match = categoryReg.match(path)
+	if match:
+		locale, dealID, pagenumber = match.groups()
+		if dealID.startswith("nested-"):
+			return synthetic.nestedpage(dealID, locale)
+		return synthetic.categorypage(
+			dealID, locale, pagenumber=int(pagenumber or 1), pagesize=settings["pagesize"],
+			total=settings["items"], seed=settings["seed"]
+		)
+	match = searchReg.match(path)
+	if match:
+		locale, query, pagenumber = match.groups()
+		return synthetic.searchpage(
+			unquote(query), locale, pagenumber=int(pagenumber or 1), pagesize=settings["pagesize"],
+			total=settings["searchhits"], seed=settings["seed"]
+		)
+	match = productReg.match(path)
+	if match:
+		return synthetic.productpage(match.group(2), match.group(1), seed=settings["seed"])
+	return None
+
+
+class StoreHandler(BaseHTTPRequestHandler):
+	settings = SETTINGS
+
+	def do_GET(self):
+		settings = self.settings
+		time.sleep(max(0.0, settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"])))
+		if random.random() < settings["errors"]:
+			self.send_error(503)
+			return
+		html = page(self.path, settings)
+		if html is None:
+			self.send_error(404)
+			return
+		body = html.encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def serve(port=0, **settings):
+	"""Return a running server and its base URL. The server runs in a daemon thread.
+
+	Parameters:
+	port (int): port to listen on, any free port if 0
+	settings: overrides of SETTINGS
+	"""
+	handler = type("Handler", (StoreHandler,), {"settings": dict(SETTINGS, **settings)})
+	server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def addoptions(parser):
+	"""Return None. Add stand-in store settings as options to an argparse parser."""
+	for key, default in SETTINGS.items():
+		parser.add_argument("--" + key, type=type(default), default=default)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="local stand-in PS Store")
+	parser.add_argument("--port", type=int, default=8000)
+	addoptions(parser)
+	args = vars(parser.parse_args())
+	port = args.pop("port")
+	server, url = serve(port=port, **args)
+	print("serving on {}".format(url))
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,173 @@
+"""Storage and export: inserts, mainselect filters and sorting, terminal output and every writer.
+
+Each size is a deal of N synthetic rows in one store (en-us), in a database holding
+another N/4 rows of the same deal in other stores. Timings are appended to a history
+file, and the ones slower than the previous run's by more than --threshold (and --min-delta) are flagged.
+
+	python benchmarks/storage.py [--sizes 1000 10000 100000 1000000] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHDIR))
+
+from modules import psconfig, pssql, pswrite
+from modules.globals import MINPRICE, MAXPRICE
+import psfetcher
+import synthetic
+
+HISTORY = os.path.join(BENCHDIR, "results", "storage.jsonl")
+DEAL = "all deals"
+LOCALE = ("en", "us")
+
+# name: mainselect's filters and sorting
+SELECTS = {
+	"select": {},
+	"select price": {"sortingList": ["price"]},
+	"select title discount reverse": {"sortingList": ["title", "discount"], "reverseResults": True},
+	"select game": {"contentTypes": ["game"]},
+	"select 10-30 price": {"minprice": 10, "maxprice": 30, "sortingList": ["price"]},
+	"select addon 10-30 discount": {
+		"contentTypes": ["addon"], "minprice": 10, "maxprice": 30, "sortingList": ["discount"]
+	},
+}
+
+
+def best(func, repeat):
+	"""Return the shortest of repeat runs of func in seconds."""
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		timings.append(time.perf_counter() - start)
+	return min(timings)
+
+
+def sizebench(size, repeat, workdir, allcontent):
+	"""Return a dict of timings in seconds for a deal of size rows."""
+	lang, country = LOCALE
+	locale = "{}-{}".format(lang, country)
+	dbfile = os.path.join(workdir, "{}.db".format(size))
+	pssql.maketables(dbfile=dbfile)
+	others = [store for store in synthetic.locales() if store != LOCALE]
+	pssql.insertitems(dbfile=dbfile, rows=list(synthetic.rows(size // 4, deal=DEAL, stores=others, seed=1)))
+	rows = list(synthetic.rows(size, deal=DEAL, stores=[LOCALE]))
+	dealID = rows[0][8]
+
+	timings = {}
+	start = time.perf_counter()
+	pssql.insertitems(dbfile=dbfile, rows=rows)
+	timings["insert"] = time.perf_counter() - start
+	del rows
+
+	for name, filters in SELECTS.items():
+		options = dict(minprice=MINPRICE, maxprice=MAXPRICE, sortingList=None, reverseResults=False, contentTypes=None)
+		options.update(filters)
+		timings[name] = best(lambda: pssql.mainselect(
+			dbfile=dbfile, deal=DEAL, dealID=dealID, locale=locale, lang=lang, country=country,
+			allcontent=allcontent, **options
+		), repeat)
+
+	itemlist, tlen, plen, filterMessage = pssql.mainselect(
+		dbfile=dbfile, deal=DEAL, dealID=dealID, locale=locale, lang=lang, country=country,
+		minprice=MINPRICE, maxprice=MAXPRICE, sortingList=["price"], allcontent=allcontent
+	)
+	for table in (False, True):
+		def printall():
+			with contextlib.redirect_stdout(io.StringIO()):
+				psfetcher.printitems(itemlist, tlen=tlen, plen=plen, table=table)
+		timings["print" + " table" * table] = best(printall, repeat)
+
+	filename = os.path.join(workdir, "output")
+	common = dict(itemlist=itemlist, lang=lang, country=country, filename=filename, filterMessage=filterMessage)
+	writers = {
+		"write txt": lambda: pswrite.writetext(tlen=tlen, plen=plen, **common),
+		"write txt table": lambda: pswrite.writetext(tlen=tlen, plen=plen, table=True, **common),
+		"write reddit": lambda: pswrite.writereddit(**common),
+		"write html": lambda: pswrite.writehtml(deal=DEAL, **common),
+		"write xlsx": lambda: pswrite.writexlsx(deal=DEAL, **common),
+	}
+	for name, writer in writers.items():
+		timings[name] = best(writer, repeat)
+	pssql.closeall()
+	os.remove(dbfile)
+	return timings
+
+
+def commit():
+	"""Return the current git commit's short hash, or None."""
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"], cwd=BENCHDIR,
+			capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def lastrun(history):
+	"""Return the results of the last run in a history file, or an empty dict."""
+	if not os.path.isfile(history):
+		return {}
+	results = {}
+	with open(history) as runs:
+		for line in runs:
+			if line.strip():
+				results = json.loads(line)["results"]
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+	parser.add_argument("--repeat", type=int, default=3, help="runs per timing; the best one is kept")
+	parser.add_argument("--history", default=HISTORY, help="file the results are appended to")
+	parser.add_argument("--threshold", type=float, default=0.2, help="slowdown flagged as a regression")
+	parser.add_argument("--min-delta", type=float, default=0.005, help="smallest slowdown in seconds flagged")
+	parser.add_argument("--strict", action="store_true", help="exit with 1 if there's a regression")
+	args = parser.parse_args()
+
+	allstores, allcontent = psconfig.getConf()
+	previous = lastrun(args.history)
+	results = {}
+	regressions = []
+	workdir = tempfile.mkdtemp(prefix="psfetcher-storage.")
+	for size in args.sizes:
+		timings = sizebench(size, args.repeat, workdir, allcontent)
+		results[str(size)] = timings
+		print("{} rows".format(size))
+		for name, seconds in timings.items():
+			before = previous.get(str(size), {}).get(name)
+			change = flag = ""
+			if before:
+				change = "{:+.0%}".format(seconds / before - 1)
+				if seconds > before * (1 + args.threshold) and seconds - before > args.min_delta:
+					flag = "REGRESSION"
+					regressions.append((size, name))
+			print("  {:<30} {:>10.4f} s {:>7} {}".format(name, seconds, change, flag))
+	shutil.rmtree(workdir)
+
+	os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+	with open(args.history, "a") as history:
+		history.write(json.dumps({
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit(),
+			"python": platform.python_version(), "results": results
+		}) + "\n")
+	if regressions:
+		print("{} regressions against the previous run".format(len(regressions)))
+		if args.strict:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
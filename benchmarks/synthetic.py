@@ -0,0 +1,196 @@
+"""Synthetic PS Store pages shaped like the ones psfetcher parses."""
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from modules import psprice
+from modules.globals import CONFIG
+from prices import CORPUS
+
+NAMES = [
+	"Horizon Zero Dawn", "The Last of Us Part II", "Sekiro: Shadows Die Twice", "Mafia: Definitive Edition",
+	"God of War", "Metal Gear Solid V", "Ghost of Tsushima", "Bloodborne", "Gran Turismo 7", "Ratchet & Clank",
+]
+CLASSES = ["Full Game", "Game Bundle", "Add-On Pack", "Season Pass", "Virtual Currency", "Premium Edition"]
+PLATFORMS = [["PS4"], ["PS5"], ["PS5", "PS4"], []]
+
+
+def titleID(index):
+	return "UP{:04d}-CUSA{:05d}_00-GAME{:010d}".format(index % 9000, index % 100000, index)
+
+
+def product(index, locale, rng):
+	"""Return a product's Apollo key, its entry, its price key and its price entry."""
+	tid = titleID(index)
+	key = "Product:{}:{}".format(tid, locale)
+	priceKey = "SkuPrice:{}:{}".format(tid, locale)
+	base = rng.randint(1, 120)
+	if rng.random() < 0.05:
+		price = "Free"
+	else:
+		price = "${}.{:02d}".format(base, rng.choice([0, 49, 99]))
+	entry = {
+		"__typename": "Product", "id": tid,
+		"name": "{} {}".format(NAMES[index % len(NAMES)], index),
+		"price": {"type": "id", "id": priceKey, "generated": False},
+		"platforms": {"type": "json", "json": PLATFORMS[index % len(PLATFORMS)]},
+		"localizedStoreDisplayClassification": CLASSES[index % len(CLASSES)],
+		"media": [{"type": "id", "id": "Media:{}:{}".format(tid, n)} for n in range(4)],
+	}
+	priceEntry = {
+		"__typename": "SkuPrice", "basePrice": "${}.99".format(base + 10),
+		"discountedPrice": price, "discountText": rng.choice(["-10%", "-25%", "-50%", "-75%", None]),
+		"serviceBranding": ["NONE"], "upsellText": None,
+	}
+	return key, entry, priceKey, priceEntry
+
+
+def filler(state, tid, rng):
+	"""Add Apollo cache entries psfetcher doesn't read: media, concepts, badges."""
+	for n in range(4):
+		state["Media:{}:{}".format(tid, n)] = {
+			"__typename": "Media", "role": rng.choice(["MASTER", "SCREENSHOT", "GAMEHUB_COVER_ART"]),
+			"type": "IMAGE", "url": "https://image.api.playstation.com/vulcan/img/{:x}.png".format(rng.getrandbits(64)),
+		}
+	state["Concept:{}".format(tid)] = {
+		"__typename": "Concept", "id": tid, "descriptions": [
+			{"type": "SHORT", "value": " ".join(rng.choice(NAMES) for _ in range(30))},
+		],
+		"contentRating": {"name": "PEGI_16", "descriptors": ["Violence", "Bad Language"]},
+	}
+
+
+def categoryID(index):
+	return "{:08x}-{:04x}-4000-8000-{:012x}".format(index * 2654435761 % 2**32, index, index)
+
+
+def dealspage(locale="en-us", deals=3, nested=1):
+	"""Return a store's deals page with deals and nested deals (placed within other deals)."""
+	items = []
+	for index in range(deals):
+		items.append("<li><a href=\"/{}/category/{}/1\"><img alt=\"[PROMO] Deal {}\"/></a></li>".format(
+			locale, categoryID(index), index
+		))
+	for index in range(deals, deals + nested):
+		items.append("<li><a href=\"/{}/category/{}/1\"><img alt=\"[PROMO] Deal {} - web\"/></a></li>".format(
+			locale, "nested-" + categoryID(index), index
+		))
+	return (
+		"<html><body><div id=\"main\"><div class=\"ems-sdk-collection\"><ul>{}</ul></div></div>"
+		"<div class=\"ems-sdk-strand__header\"><a href=\"/{}/category/{}/1\">All Deals</a></div>"
+		"</body></html>"
+	).format("".join(items), locale, categoryID(deals + nested))
+
+
+def nestedpage(nestedID, locale="en-us"):
+	"""Return a nested deal's page, linking to the deal's own category grid."""
+	return (
+		"<html><body><div class=\"ems-sdk-strand__header\"><a href=\"/{}/category/{}/1\">View all</a></div>"
+		"</body></html>"
+	).format(locale, nestedID.replace("nested-", ""))
+
+
+def productpage(tid, locale="en-us", seed=0):
+	"""Return a single title's product page."""
+	index = int(tid.split("GAME")[-1])
+	rng = random.Random("{}:{}".format(seed, tid))
+	key, entry, priceKey, priceEntry = product(index, locale, rng)
+	details = {"@type": "Product", "name": entry["name"], "category": entry["localizedStoreDisplayClassification"]}
+	scripts = ["<script>window.env = {{\"locale\":\"{}\"}};</script>".format(locale)]
+	scripts.append("<script type=\"application/ld+json\">{}</script>".format(json.dumps(details)))
+	cache = {"cache": {"Product:" + tid: {"platforms": entry["platforms"]["json"]}}}
+	scripts.append("<script type=\"application/json\">{}</script>".format(json.dumps(cache)))
+	cache = {"cache": {"GameCTA:PURCHASE:{}".format(tid): {"price": priceEntry}}}
+	scripts.append("<script type=\"application/json\">{}</script>".format(json.dumps(cache)))
+	return "<html><head>{}</head><body></body></html>".format("".join(scripts))
+
+
+def nextdatapage(state):
+	"""Return an HTML page with state as its __NEXT_DATA__ Apollo state."""
+	data = {"props": {"pageProps": {"locale": "en-us"}, "apolloState": state}, "page": "/[locale]/category/[id]"}
+	return (
+		"<!DOCTYPE html><html><head><title>PlayStation Store</title></head><body>"
+		"<div id=\"__next\"><div class=\"ems-sdk-grid\"></div></div>"
+		"<script id=\"__NEXT_DATA__\" type=\"application/json\">{}</script>"
+		"</body></html>"
+	).format(json.dumps(data, separators=(",", ":")))
+
+
+def categorypage(dealID="deal", locale="en-us", pagenumber=1, pagesize=24, total=240, seed=0):
+	"""Return a deal's (category grid) page."""
+	rng = random.Random("{}:{}:{}".format(seed, dealID, pagenumber))
+	offset = (pagenumber - 1) * pagesize
+	state = {"ROOT_QUERY": {"categoryGridRetrieve({\"id\":\"" + dealID + "\"})": {"id": dealID}}}
+	products = []
+	for index in range(offset, min(offset + pagesize, total)):
+		key, entry, priceKey, priceEntry = product(index, locale, rng)
+		state[key] = entry
+		state[priceKey] = priceEntry
+		filler(state, entry["id"], rng)
+		products.append({"type": "id", "id": key, "generated": False})
+	grid = "CategoryGrid:{}:{}:{}:{}".format(dealID, locale, offset, pagesize)
+	state[grid] = {
+		"__typename": "CategoryGrid", "id": dealID, "products": products,
+		"pageInfo": {"type": "json", "json": None},
+	}
+	page = nextdatapage(state)
+	# itercount reads the totals as they're laid out on the live site
+	totals = "\"totalCount\":{},\"offset\":{},\"size\":{}".format(total, offset, pagesize)
+	return page.replace("</body>", "<script>var pageInfo = {{{}}};</script></body>".format(totals))
+
+
+def searchpage(query="", locale="en-us", pagenumber=1, pagesize=24, total=100, seed=0):
+	"""Return a search results page with titles containing query."""
+	rng = random.Random("{}:{}:{}".format(seed, query, pagenumber))
+	state = {}
+	for index in range((pagenumber - 1) * pagesize, min(pagenumber * pagesize, total)):
+		key, entry, priceKey, priceEntry = product(index, locale, rng)
+		entry["name"] = "{} {}".format(query.title(), entry["name"])
+		state[key] = entry
+		state[priceKey] = priceEntry
+		filler(state, entry["id"], rng)
+	return nextdatapage(state)
+
+
+def locales():
+	"""Return a list of (lang, country) pairs of every store in 'lang.json'."""
+	with open(CONFIG) as config:
+		conf = json.load(config)
+	return [(lang, country) for lang in sorted(conf) for country in conf[lang]["country"]]
+
+
+def rows(count, deal="all deals", dealID=None, stores=None, seed=0):
+	"""Yield count rows for pssql.insertitems, spread over stores.
+
+	Titles' content types are the stores' own (see 'lang.json') and prices are
+	formatted the way each country shows them.
+
+	Parameters:
+	count (int): number of rows
+	deal (str): deal's name
+	dealID (str): deal's ID, categoryID(0) if None
+	stores (list): (lang, country) pairs, every store if None
+	seed (int): random seed
+	"""
+	with open(CONFIG) as config:
+		conf = json.load(config)
+	stores = stores or locales()
+	dealID = dealID or categoryID(0)
+	rng = random.Random(seed)
+	# one batch per store: prices of a store are normalised together, as they are when fetched
+	for storeIndex, (lang, country) in enumerate(stores):
+		start = count * storeIndex // len(stores)
+		end = count * (storeIndex + 1) // len(stores)
+		content = conf[lang]["content"]
+		types = [ctype for kind in ("game", "game", "addon", "currency") for ctype in content[kind][:3]]
+		prices = [price for price in CORPUS.get(country, CORPUS["us"])]
+		batch = [rng.choice(prices) for _ in range(end - start)]
+		for index, price, roundprice in zip(range(start, end), batch, psprice.roundprices(batch)):
+			yield (
+				titleID(index), "{} {}".format(rng.choice(NAMES), index), price, roundprice,
+				rng.choice(["-10%", "-25%", "-50%", "-75%", "None"]), rng.choice(types),
+				deal, index // 24 + 1, dealID, "{}-{}".format(lang, country), ", ".join(rng.choice(PLATFORMS)) or "PS*"
+			)
@@ -2,9 +2,73 @@ import os
 
 WORKDIR = os.path.dirname(os.path.realpath(__file__))
 WORKDIR = os.path.dirname(WORKDIR)
-DBFILE = os.path.join(WORKDIR, "db/psfetcher.db")
+# both can be overridden through the environment, e.g. to run against a local stand-in store (see benchmarks)
+DBFILE = os.environ.get("PSFETCHER_DB") or os.path.join(WORKDIR, "db/psfetcher.db")
+# raw deal pages kept with --archive, for the 'reparse' command; next to the database file
+ARCHIVEFILE = os.path.join(os.path.dirname(DBFILE), "archive.db")
+STORE_URL = os.environ.get("PSFETCHER_STORE_URL") or "https://store.playstation.com"
 CONFIG = os.path.join(WORKDIR, "conf/lang.json")
 PREFERENCES_CONFIG = os.path.join(WORKDIR, "conf/preferences.json")
+# in-memory storage backend for one-shot results (search, watchlist checks)
+MEMORYDB = ":memory:"
+# the database file's connections (see pssql.connect): synced to disk on WAL checkpoints rather than on every commit,
+# memory-mapped reads up to this many bytes, and a page cache of this many KiB per connection
+DB_SYNCHRONOUS = "normal"
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE = 16384
+# seconds a connection waits for another process' write to finish
+DB_TIMEOUT = 30
+# idle read-only connections kept per process and thread
+DB_READERS = 4
+
+# upper bound of processes used for concurrent search queries
+SEARCH_PROCESSES = 16
+# number of search results pages fetched with --deep
+SEARCH_DEEP_PAGES = 10
+
+# seconds for which a checked watchlist title's product page is reused
+PRODUCT_CACHE_TTL = 300
+# minutes for which deal prices are reused by watchlist checks (preferences: watchlistMaxAge)
+WATCHLIST_MAX_AGE = 60
+# minutes for which a store's list of deals and their page counts are reused (preferences: dealListMaxAge)
+DEAL_LIST_MAX_AGE = 60
+# minutes for which a deal's results are reused before it's fetched anew, 0 for no limit (preferences: dealMaxAge)
+DEAL_MAX_AGE = 1440
+# how an outdated deal is fetched anew (preferences: dealRefresh):
+# "wait" fetches it before showing results, "background" shows the outdated results and fetches it in another process
+DEAL_REFRESH = "wait"
+# days after a deal's latest fetch its results are kept for by 'maintain', 0 to keep them (preferences: dealRetention)
+DEAL_RETENTION = 30
+# megabytes the database may take before 'maintain' evicts least recently used deals, 0 for no limit (preferences: dbMaxSize)
+DB_MAX_SIZE = 0
+# decode only the deal grid, products and prices of a page's Apollo state instead of all of it:
+# uses less memory, but is slower than a whole decode when orjson is installed
+SELECTIVE_JSON = False
+
+# deal pages are downloaded by PIPELINE_THREADS threads, parsed by one process per CPU and stored by the main process;
+# at most PIPELINE_DEPTH pages wait between two stages
+PIPELINE_THREADS = 16
+PIPELINE_DEPTH = 32
+# initial width of titles printed with --stream, widened by longer ones as they arrive
+STREAM_TITLE_WIDTH = 40
+
+# PS Store requests failing to connect or answered with 429/5xx are retried, FETCH_RETRY_DELAY seconds later per attempt
+FETCH_RETRIES = 2
+FETCH_RETRY_DELAY = 1
 
 MINPRICE = 0
 MAXPRICE = 100000
+# stores' currencies by country code: symbols such as '$' and 'kr' are shared by several currencies,
+# so stores' prices are compared only if both their currency and its symbol match (see pssql.comparestores)
+CURRENCIES = {
+	"at": "EUR", "be": "EUR", "bg": "EUR", "ca": "CAD", "cy": "EUR", "cz": "CZK", "de": "EUR", "dk": "DKK",
+	"es": "EUR", "fi": "EUR", "fr": "EUR", "gb": "GBP", "gr": "EUR", "hr": "EUR", "hu": "HUF", "ie": "EUR",
+	"in": "INR", "is": "EUR", "it": "EUR", "lu": "EUR", "mt": "EUR", "nl": "EUR", "no": "NOK", "pl": "PLN",
+	"pt": "EUR", "ro": "RON", "ru": "RUB", "se": "SEK", "si": "EUR", "sk": "EUR", "us": "USD"
+}
+
+# seconds after which another run's fetch lease of a deal is considered stale;
+# a run renews its leases every LEASE_RENEW seconds while it's fetching, so only a crashed or hung run's lease expires
+LEASE_TTL = 1800
+LEASE_RENEW = 60
+LEASE_POLL = 1
@@ -0,0 +1,121 @@
+import sqlite3
+import time
+import zlib
+
+
+def compress(text):
+	"""Return a page's text compressed for the archive."""
+	return zlib.compress(text.encode("utf-8"))
+
+
+def decompress(blob):
+	"""Return a page's text from its compressed form (see compress)."""
+	return zlib.decompress(blob).decode("utf-8")
+
+
+def maketables(archivefile=None):
+	"""Return None. Create the archive's table.
+
+	The table, 'pages', stores the compressed __NEXT_DATA__ JSON text of each page of a deal's latest crawl.
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	"""
+	pagesdb = """
+	create table if not exists pages
+	(dealID blob, locale text, deal blob, pagenumber integer,
+	dealurl blob, pagesize integer, fetched real, page blob,
+	primary key (dealID, locale, deal, pagenumber))
+	"""
+	c = sqlite3.connect(archivefile)
+	c.cursor().execute(pagesdb)
+	c.commit()
+	c.close()
+
+
+def cleardeal(archivefile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Remove all archived pages of a deal, before it's crawled anew.
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	c = sqlite3.connect(archivefile)
+	statement = "delete from pages where dealID = ? and locale = ? and deal = ?"
+	c.cursor().execute(statement, (dealID, locale, deal))
+	c.commit()
+	c.close()
+
+
+def compact(archivefile=None):
+	"""Return None. Rebuild the archive to give space of removed pages back to the system.
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	"""
+	c = sqlite3.connect(archivefile)
+	c.cursor().execute("vacuum")
+	c.close()
+
+
+def archivepages(archivefile=None, pages=None, fetched=None):
+	"""Return None. Write compressed pages to the archive, replacing the same pages of a previous crawl.
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	pages (list): tuples of dealID, locale, deal, pagenumber, dealurl, pagesize and a compressed page
+	fetched (float): time the pages were fetched at, now by default
+	"""
+	statement = """
+	insert or replace into pages
+	(dealID, locale, deal, pagenumber, dealurl, pagesize, page, fetched)
+	values (?, ?, ?, ?, ?, ?, ?, ?)
+	"""
+	if fetched is None:
+		fetched = time.time()
+	c = sqlite3.connect(archivefile)
+	c.cursor().executemany(statement, [page + (fetched,) for page in pages])
+	c.commit()
+	c.close()
+
+
+def archiveddeals(archivefile=None):
+	"""Return a list of archived deals: tuples of deal's name, deal's ID, locale, number of pages
+	and the time its latest page was fetched at.
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	"""
+	statement = """
+	select deal, dealID, locale, count(pagenumber), max(fetched) from pages
+	group by deal, dealID, locale order by locale, deal
+	"""
+	c = sqlite3.connect(archivefile)
+	deals = c.execute(statement).fetchall()
+	c.close()
+	return deals
+
+
+def archivedpages(archivefile=None, deals=None):
+	"""Return a list of archived pages of deals, read over a single connection.
+
+	Each page is a tuple of dealID, locale, deal, pagenumber, dealurl, pagesize, the time it was fetched at
+	and the compressed page (see decompress).
+
+	Parameters:
+	archivefile (str): full path to an archive file
+	deals (list): tuples of deal's name, deal's ID and locale
+	"""
+	if not deals:
+		return []
+	statement = """
+	select dealID, locale, deal, pagenumber, dealurl, pagesize, fetched, page from pages
+	where (deal, dealID, locale) in (values {})
+	order by locale, deal, pagenumber
+	""".format(", ".join(["(?, ?, ?)"] * len(deals)))
+	c = sqlite3.connect("file:{}?mode=ro".format(archivefile), uri=True)
+	pages = c.execute(statement, [value for deal in deals for value in deal]).fetchall()
+	c.close()
+	return pages
@@ -1,7 +1,8 @@
 import json
 import os
 
-from modules.globals import CONFIG, PREFERENCES_CONFIG, MINPRICE, MAXPRICE
+from modules.globals import CONFIG, PREFERENCES_CONFIG, MINPRICE, MAXPRICE, WATCHLIST_MAX_AGE, DEAL_LIST_MAX_AGE
+from modules.globals import DEAL_MAX_AGE, DEAL_REFRESH, DEAL_RETENTION, DB_MAX_SIZE
 
 
 def getConf():
@@ -46,6 +47,14 @@ def getPrefConf():
 	prefconf["maxprice"] = MAXPRICE
 	prefconf["language"] = prefconf["country"] = None
 	prefconf["content"] = prefconf["sorting"] = []
+	prefconf["watchlistMaxAge"] = WATCHLIST_MAX_AGE
+	prefconf["dealListMaxAge"] = DEAL_LIST_MAX_AGE
+	prefconf["dealMaxAge"] = DEAL_MAX_AGE
+	prefconf["dealRefresh"] = DEAL_REFRESH
+	prefconf["dealRetention"] = DEAL_RETENTION
+	prefconf["dbMaxSize"] = DB_MAX_SIZE
+	prefconf["metricsFile"] = None
+	prefconf["archivePages"] = False
 	keys = [
 		"saveTXT", "saveHTML", "saveRDT", "saveXLSX",
 		"sortReverse", "getAllDeals", "ignorePreviousFetch",
@@ -77,7 +86,15 @@ def checkPreferences():
 		"save results as a text file": prefconf["saveTXT"],
 		"save results as an HTML document": prefconf["saveHTML"],
 		"save results as a reddit comment": prefconf["saveRDT"],
-		"save results as an XLSX spreadsheet": prefconf["saveXLSX"]
+		"save results as an XLSX spreadsheet": prefconf["saveXLSX"],
+		"reuse deal prices in watchlist checks for (minutes)": prefconf.get("watchlistMaxAge", WATCHLIST_MAX_AGE),
+		"reuse the list of deals for (minutes)": prefconf.get("dealListMaxAge", DEAL_LIST_MAX_AGE),
+		"reuse deals' results for (minutes)": prefconf.get("dealMaxAge", DEAL_MAX_AGE),
+		"fetch outdated deals anew": prefconf.get("dealRefresh", DEAL_REFRESH),
+		"keep deals' results for (days)": prefconf.get("dealRetention", DEAL_RETENTION),
+		"evict least recently used deals above (MB)": prefconf.get("dbMaxSize", DB_MAX_SIZE),
+		"write run metrics to": prefconf.get("metricsFile"),
+		"keep fetched deal pages for reparsing": prefconf.get("archivePages", False)
 	}
 
 	for setting, value in prefs.items():
@@ -0,0 +1,103 @@
+import bs4
+import json
+import re
+
+try:
+	import orjson
+	loads = orjson.loads
+except ImportError:
+	loads = json.loads
+
+decoder = json.JSONDecoder()
+# a quoted Apollo state key followed by a colon
+keyReg = re.compile(r'"([^"\\]*)"\s*:\s*')
+
+
+def productinfo(html=None, titleID=None):
+	"""Return title's name, category, platforms and price JSON from a product page.
+
+	Each needed JSON blob is decoded once and its entries are found by key, not by script position.
+	Raise IndexError if the page has no price or platform entry for titleID.
+
+	Parameters:
+	html (str): product page's HTML
+	titleID (str): title's ID from PS Store
+	"""
+	productKey = "Product:{}".format(titleID)
+	soup = bs4.BeautifulSoup(html, "lxml", parse_only=bs4.SoupStrainer("script"))
+	cache = {}
+	details = {}
+	for script in soup.find_all("script"):
+		text = script.string
+		if not text:
+			continue
+		if script.get("type") == "application/ld+json":
+			if "category" in text:
+				details = json.loads(text)
+		# only Apollo cache blobs with the title's price or platforms are decoded
+		elif ("GameCTA" in text and titleID in text) or productKey in text:
+			cache.update(json.loads(text).get("cache", {}))
+
+	ctaKeys = [key for key in cache if key.startswith("GameCTA") and titleID in key]
+	if not ctaKeys:
+		raise IndexError("no price entry for {}".format(titleID))
+	priceJson = cache[ctaKeys[0]]["price"]
+	product = cache.get(productKey)
+	if not product:
+		raise IndexError("no {} entry".format(productKey))
+	platforms = product["platforms"]
+	return details.get("name"), details.get("category"), platforms, priceJson
+
+
+def nextdata(html):
+	"""Return the JSON text of a page's __NEXT_DATA__ script, found without parsing the page's HTML.
+
+	Raise IndexError if the page has no __NEXT_DATA__ script.
+
+	Parameters:
+	html (str): page's HTML
+	"""
+	start = html.find("id=\"__NEXT_DATA__\"")
+	if start == -1:
+		raise IndexError("no __NEXT_DATA__ script")
+	start = html.index(">", start) + 1
+	return html[start:html.index("</script>", start)]
+
+
+def apollostate(text):
+	"""Return the whole Apollo state of a __NEXT_DATA__ JSON text (see nextdata).
+
+	Decoded with orjson if it's installed.
+
+	Parameters:
+	text (str): __NEXT_DATA__ JSON text
+	"""
+	return loads(text)["props"]["apolloState"]
+
+
+def apolloentries(text, prefixes=(), keys=()):
+	"""Return a dict of Apollo state entries whose keys start with prefixes or equal keys.
+
+	Only the matching entries are decoded; the rest of the state is skipped over with string searches.
+
+	Parameters:
+	text (str): __NEXT_DATA__ JSON text (see nextdata)
+	prefixes (list): key prefixes, e.g. "Product:"
+	keys (list): exact keys
+	"""
+	entries = {}
+	searches = [("\"" + prefix, None) for prefix in prefixes]
+	searches += [("\"{}\"".format(key), key) for key in keys]
+	for needle, key in searches:
+		start = text.find(needle)
+		while start != -1:
+			# a match is a key only if it's followed by a colon, otherwise it's a value
+			match = keyReg.match(text, start)
+			if match and match.group(1) not in entries:
+				entries[match.group(1)], end = decoder.raw_decode(text, match.end())
+				if key:
+					break
+			else:
+				end = start + 1
+			start = text.find(needle, end)
+	return entries
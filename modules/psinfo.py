@@ -29,6 +29,25 @@ def printExamples():
 
 	initiate deal fetching, show only games starting from 10 EUR but under 25:
 	  psfetcher -s it -l it --type game -f 10 -u 25
+
+	fetch every deal anew and show only titles added, changed or removed since the previous fetch:
+	  psfetcher -s us -a -i --changes
+
+	show every deal right away, fetching the ones older than 'dealMaxAge' anew in the background:
+	  psfetcher -s us -a --refresh background
+
+	remove deals older than 2 weeks and the least recently shown ones above 200 MB, then compact the database:
+	  psfetcher maintain --max-age 14 --max-size 200
+
+	show titles of every deal as their pages are fetched and save them to text files at the same time:
+	  psfetcher -s us -a -i --stream -t
+
+	fetch every deal in 3 stores and compare their prices:
+	  psfetcher -s de at lu -l de -a
+
+	fetch every deal and keep its pages, then rebuild the results from them after a site change is fixed:
+	  psfetcher -s us -a --archive
+	  psfetcher reparse
 	-------------------------------------------------------------------------------------------------------------
 
 	SEARCH:
@@ -44,6 +63,12 @@ def printExamples():
 
 	initiate a search, don't print the results but save them to an XLSX spreadsheet:
 	 psfetcher -s pl -l pl -q god of war -nx
+
+	initiate a search through up to 10 results pages:
+	 psfetcher -s us -q call of duty --deep
+
+	search titles of fetched deals, and PS Store only for queries without results:
+	 psfetcher -s us -q god war, spider man --local
 	-------------------------------------------------------------------------------------------------------------
 
 	WATCHLIST:
@@ -57,6 +82,9 @@ def printExamples():
 	check prices, sort results by title (locked to the current store):
 	 psfetcher --sort title -s us watchlist --check
 
+	check prices in all stores:
+	 psfetcher -s us watchlist --check --all-stores
+
 	show all titles in the watchlist (all stores):
 	 psfetcher -s us watchlist --show
 
@@ -0,0 +1,109 @@
+import os
+import tempfile
+
+from modules import pstrace
+
+PREFIX = "psfetcher_"
+
+# help texts of exported metrics; counters get a '_total' suffix
+METRICS = {
+	"requests": ("counter", "PS Store requests by HTTP status ('error' if no response)"),
+	"retries": ("counter", "PS Store requests retried"),
+	"pages": ("counter", "pages parsed by deal and locale"),
+	"rows_ingested": ("counter", "rows written to the database by deal and locale"),
+	"watchlist_failures": ("counter", "watchlist titles that couldn't be checked by locale"),
+	"cache_requests": ("counter", "cache lookups by cache and result"),
+	"cache_hit_ratio": ("gauge", "ratio of cache hits to lookups by cache"),
+	"pages_per_second": ("gauge", "pages parsed per second by deal and locale"),
+	"duration_seconds": ("gauge", "time spent fetching a deal, query or watchlist by locale"),
+	"run_duration_seconds": ("gauge", "duration of the run"),
+	"run_success": ("gauge", "1 if the run finished without an error, 0 otherwise"),
+	"run_timestamp_seconds": ("gauge", "time the run finished at"),
+	"db_size_bytes": ("gauge", "size of the database file, with its write-ahead log"),
+}
+
+
+def escape(value):
+	"""Return a label value escaped for the Prometheus text format."""
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def derived():
+	"""Return None. Set gauges computed from counters: cache hit ratios and pages per second."""
+	lookups = {}
+	for (name, labels), value in pstrace.counts.items():
+		if name == "cache_requests":
+			labels = dict(labels)
+			hits, total = lookups.get(labels["cache"], (0, 0))
+			if labels["result"] == "hit":
+				hits += value
+			lookups[labels["cache"]] = (hits, total + value)
+	for cache, (hits, total) in lookups.items():
+		if total:
+			pstrace.gauge("cache_hit_ratio", hits / total, cache=cache)
+
+	for (name, labels), value in list(pstrace.gauges.items()):
+		if name != "duration_seconds" or not value:
+			continue
+		pages = pstrace.counts.get(("pages", labels), 0)
+		if pages:
+			pstrace.gauge("pages_per_second", pages / value, **dict(labels))
+
+
+def render(**labels):
+	"""Return recorded counters and gauges in the Prometheus text format.
+
+	Parameters:
+	labels: labels added to every sample, e.g. operation="deals"
+	"""
+	samples = {}
+	for (name, sampleLabels), value in pstrace.counts.items():
+		samples.setdefault(name, []).append((sampleLabels, value))
+	for (name, sampleLabels), value in pstrace.gauges.items():
+		samples.setdefault(name, []).append((sampleLabels, value))
+
+	lines = []
+	for name in sorted(samples):
+		metricType, helpText = METRICS.get(name, ("gauge", name.replace("_", " ")))
+		fullName = PREFIX + name
+		if metricType == "counter":
+			fullName += "_total"
+		lines.append("# HELP {} {}".format(fullName, helpText))
+		lines.append("# TYPE {} {}".format(fullName, metricType))
+		for sampleLabels, value in sorted(samples[name], key=lambda sample: sample[0]):
+			sampleLabels = dict(sampleLabels, **labels)
+			labelText = ",".join(
+				"{}=\"{}\"".format(key, escape(sampleLabels[key])) for key in sorted(sampleLabels)
+			)
+			lines.append("{}{{{}}} {}".format(fullName, labelText, value))
+	return "\n".join(lines) + "\n"
+
+
+def writetextfile(filename=None, dbfile=None, **labels):
+	"""Return filename. Write recorded metrics for node_exporter's textfile collector.
+
+	The file is written next to its final name and renamed over it,
+	so a collector never reads a half-written file.
+
+	Parameters:
+	filename (str): full path to a '.prom' file
+	dbfile (str): full path to a database file whose size is exported
+	labels: labels added to every sample (see render)
+	"""
+	if dbfile and os.path.isfile(dbfile):
+		size = os.path.getsize(dbfile)
+		if os.path.isfile(dbfile + "-wal"):
+			size += os.path.getsize(dbfile + "-wal")
+		pstrace.gauge("db_size_bytes", size)
+	derived()
+	directory = os.path.dirname(os.path.abspath(filename))
+	fd, tmpname = tempfile.mkstemp(dir=directory, prefix=".psfetcher.", suffix=".tmp")
+	try:
+		with os.fdopen(fd, "w") as output:
+			output.write(render(**labels))
+		os.chmod(tmpname, 0o644)
+		os.replace(tmpname, filename)
+	except BaseException:
+		os.unlink(tmpname)
+		raise
+	return filename
@@ -1,13 +1,60 @@
 import argparse
 import re
+import sys
 
 from modules import pswrite
+from modules.globals import SEARCH_DEEP_PAGES, WATCHLIST_MAX_AGE, DEAL_LIST_MAX_AGE, DEAL_MAX_AGE, DEAL_REFRESH
+from modules.globals import DEAL_RETENTION, DB_MAX_SIZE
 from modules.psconfig import getPrefConf
 from modules.version import __version__
 
 
+def splitCodes(argv, commands=()):
+	"""Return a copy of argv where each code passed to -s/--store and -l/--lang is a separate '--opt=xx'.
+
+	Options taking more than one value would otherwise also take a command following them,
+	e.g. 'watchlist' in '-s us gb watchlist --check'. Any other value is kept for argparse to check (see code),
+	and an option without values is kept as it is, for argparse to report.
+
+	Parameters:
+	argv (list): command-line arguments without the program's name
+	commands (list): names of commands, which end an option's values
+	"""
+	options = {"-s": "--store", "--store": "--store", "-l": "--lang", "--lang": "--lang"}
+	splitArgv = []
+	option = None
+	values = 0
+	for arg in argv:
+		if option and not arg.startswith("-") and arg not in commands:
+			splitArgv.append("{}={}".format(option, arg))
+			values += 1
+			continue
+		if option and not values:
+			splitArgv.append(option)
+		option = options.get(arg)
+		values = 0
+		if not option:
+			splitArgv.append(arg)
+	if option and not values:
+		splitArgv.append(option)
+	return splitArgv
+
+
+def code(value):
+	"""Return a 2-letter language or country code passed to -s/--store or -l/--lang.
+
+	Raise argparse.ArgumentTypeError if it's not 2 letters, so a typo isn't dropped in favour of a default.
+
+	Parameters:
+	value (str): code passed on the command line
+	"""
+	if not re.match(r"^[A-Za-z]{2}$", value):
+		raise argparse.ArgumentTypeError("'{}' is not a 2-letter code".format(value))
+	return value
+
+
 def getVars():
-	"""Return all parsed variables from argparse.
+	"""Return all parsed variables from argparse, as attributes of an argparse.Namespace.
 
 	Sets default values according to a user-set configuration from getPrefConf, if it's present.
 	"""
@@ -32,8 +79,11 @@ def getVars():
 					default = action.dest.upper()
 					args_string = self._format_args(action, default)
 					if "{" in args_string:
+						# choices of an option taking more than one value are listed once
 						dup_remove_reg = re.compile(r"\{[A-Za-z, ]+\}\s")
-						args_string = dup_remove_reg.search(args_string).group()
+						match = dup_remove_reg.search(args_string)
+						if match:
+							args_string = match.group()
 					for option_string in action.option_strings:
 						parts.append(option_string)
 					parts[-1] += " " + args_string
@@ -49,13 +99,13 @@ def getVars():
 	optionalArg = parser.add_argument_group("optional arguments")
 	flagsArg = parser.add_argument_group("options")
 	requiredArg.add_argument(
-		"-s", "--store", metavar="xx", default=prefconf["country"],
-		type=str, help="2-letter country code"
+		"-s", "--store", metavar="xx", action="extend",
+		type=code, nargs="+", help="2-letter country code(s)"
 	)
 	requiredArg.add_argument(
-		"-l", "--lang", metavar="xx",
-		type=str, default=prefconf["language"],
-		help="2-letter language code"
+		"-l", "--lang", metavar="xx", action="extend",
+		type=code, nargs="+",
+		help="2-letter language code(s), one for all stores or one per store"
 	)
 	optionalArg.add_argument(
 		"-f", "--from", dest="min", metavar="N",
@@ -81,18 +131,40 @@ def getVars():
 	)
 	optionalArg.add_argument(
 		"-q", "--query", metavar=("title", "title2"), type=str, nargs="+",
-		help="search for a title (page 1 results only)"
+		help="search for a title (page 1 results only, see --pages)"
+	)
+	optionalArg.add_argument(
+		"--pages", metavar="N", default=1,
+		type=int, help="search through up to N results pages"
 	)
 	flagsArg.add_argument(
 		"-a", "--alldeals", action="store_true",
 		default=prefconf["getAllDeals"],
 		help="select all available deals"
 	)
+	flagsArg.add_argument(
+		"--deep", action="store_true",
+		help="search through up to {} results pages".format(SEARCH_DEEP_PAGES)
+	)
+	flagsArg.add_argument(
+		"--local", action="store_true",
+		help="search titles of fetched deals, and PS Store only if nothing is found"
+	)
 	flagsArg.add_argument(
 		"-i", "--ignore", action="store_true",
 		default=prefconf["ignorePreviousFetch"],
 		help="ignore results from the previous run"
 	)
+	optionalArg.add_argument(
+		"--refresh", choices=["wait", "background"],
+		default=prefconf.get("dealRefresh", DEAL_REFRESH),
+		help="fetch outdated deals before showing results, or show them and fetch in the background"
+	)
+	# a background refresh started by another run: deals' names and URLs, fetched without any output
+	optionalArg.add_argument(
+		"--stage-deal", nargs=2, action="append", dest="stageDeals",
+		help=argparse.SUPPRESS
+	)
 	flagsArg.add_argument(
 		"-t", "--txt", action="store_true", dest="writetext",
 		default=prefconf["saveTXT"], help="save results as a text file"
@@ -114,6 +186,14 @@ def getVars():
 		default=prefconf["dontPrint"],
 		help="don't print the results"
 	)
+	flagsArg.add_argument(
+		"--changes", action="store_true",
+		help="show only deals' new, changed and removed titles since their previous fetch"
+	)
+	flagsArg.add_argument(
+		"--stream", action="store_true",
+		help="print and save deals' titles page by page while they're fetched, unsorted"
+	)
 	flagsArg.add_argument(
 		"--table", action="store_true",
 		default=prefconf["tablePrint"],
@@ -124,6 +204,39 @@ def getVars():
 		default=prefconf["sortReverse"],
 		help="reversed --sort results"
 	)
+	flagsArg.add_argument(
+		"--archive", action="store_true", dest="archivePages",
+		default=prefconf.get("archivePages", False),
+		help="keep fetched deal pages for the 'reparse' command"
+	)
+	flagsArg.add_argument(
+		"--stats", action="store_true",
+		help="print download, parse and store statistics of fetched deals"
+	)
+	optionalArg.add_argument(
+		"--metrics", metavar="FILE", dest="metricsFile",
+		help="write the run's metrics to a Prometheus textfile (.prom)"
+	)
+	optionalArg.add_argument(
+		"--record", metavar="DIR", dest="recordDir",
+		help="save every fetched page to DIR, to be replayed with --replay"
+	)
+	optionalArg.add_argument(
+		"--replay", metavar="DIR", dest="replayDir",
+		help="serve pages recorded with --record from DIR instead of PS Store"
+	)
+	optionalArg.add_argument(
+		"--latency", metavar="S", dest="replayLatency", default=0,
+		type=float, help="delay each replayed page by S seconds"
+	)
+	flagsArg.add_argument(
+		"--profile", action="store_true",
+		help="save a timing trace of the run and print per-stage percentiles"
+	)
+	flagsArg.add_argument(
+		"--cprofile", action="store_true",
+		help="--profile, and save cProfile statistics of all processes"
+	)
 	flagsArg.add_argument(
 		"-v", "--version", action="version",
 		version="%(prog)s {}".format(__version__),
@@ -134,6 +247,14 @@ def getVars():
 		default=argparse.SUPPRESS,
 		help="show this help message and exit"
 	)
+	watchlistMaxAge = prefconf.get("watchlistMaxAge", WATCHLIST_MAX_AGE)
+	dealListMaxAge = prefconf.get("dealListMaxAge", DEAL_LIST_MAX_AGE)
+	dealMaxAge = prefconf.get("dealMaxAge", DEAL_MAX_AGE)
+	dealRetention = prefconf.get("dealRetention", DEAL_RETENTION)
+	dbMaxSize = prefconf.get("dbMaxSize", DB_MAX_SIZE)
+	prefMetricsFile = prefconf.get("metricsFile")
+	prefCountry = prefconf["country"]
+	prefLang = prefconf["language"]
 	del prefconf
 
 	subparsers = parser.add_subparsers(title="commands", dest="command")
@@ -142,10 +263,11 @@ def getVars():
 	watchlistHelpGeneral = "options:\n"
 	watchlistHelpGeneral += "  --show\t\tshow titles\n"
 	watchlistHelpGeneral += "  --check\t\tcheck prices\n"
+	watchlistHelpGeneral += "  --all-stores\t\tcheck prices in all stores\n"
 	watchlistHelpGeneral += "  --add [title]\t\tsearch and add a title\n"
 	watchlistHelpGeneral += "  --remove\t\tremove a title\n\n"
 	watchlistEpilog = "--show and --remove are store-independent.\n"
-	watchlistEpilog += "--check and --add are tied to the current store.\n"
+	watchlistEpilog += "--check and --add are tied to the current store, unless --all-stores is passed.\n"
 	watchlistEpilog += "Main arguments and options must precede 'watchlist' in the command.\n"
 	watchlistArg = subparsers.add_parser(
 		"watchlist", usage="%(prog)s -h", help="custom list of picked titles", description=watchlistHelpGeneral,
@@ -160,6 +282,10 @@ def getVars():
 		"--check", dest="subCommand", const="check",
 		action="store_const", help=argparse.SUPPRESS
 	)
+	watchlistArg.add_argument(
+		"--all-stores", dest="allStores",
+		action="store_true", help=argparse.SUPPRESS
+	)
 	watchlistArg.add_argument(
 		"--add", dest="subCommand",
 		nargs="*", help=argparse.SUPPRESS
@@ -173,6 +299,11 @@ def getVars():
 		default=argparse.SUPPRESS, help=argparse.SUPPRESS
 	)
 
+	shellArg = subparsers.add_parser(
+		"shell", help="filter, sort and save fetched deals interactively", add_help=False
+	)
+	shellArg.add_argument(const="shell", action='store_const', dest="command")
+
 	listArg = subparsers.add_parser("list", help="list all language and country codes", add_help=False)
 	listArg.add_argument(const="list", action='store_const', dest="command")
 
@@ -182,15 +313,46 @@ def getVars():
 	flushAllArg = subparsers.add_parser("flushall", help="remove everything from db", add_help=False)
 	flushAllArg.add_argument(const="flushall", action='store_const', dest="command")
 
+	reparseArg = subparsers.add_parser(
+		"reparse", help="rebuild deals' results from pages kept with --archive", add_help=False
+	)
+	reparseArg.add_argument(const="reparse", action='store_const', dest="command")
+
+	maintainArg = subparsers.add_parser(
+		"maintain", help="evict old and least recently used deals, then compact db"
+	)
+	maintainArg.add_argument(const="maintain", action='store_const', dest="command")
+	maintainArg.add_argument(
+		"--max-age", type=int, metavar="DAYS", dest="maxAge", default=dealRetention,
+		help="remove deals fetched more than DAYS ago, 0 keeps them (default: %(default)s)"
+	)
+	maintainArg.add_argument(
+		"--max-size", type=int, metavar="MB", dest="maxSize", default=dbMaxSize,
+		help="remove least recently used deals until db takes at most MB, 0 for no limit (default: %(default)s)"
+	)
+
 	preferencesArg = subparsers.add_parser("preferences", help="show current preferences", add_help=False)
 	preferencesArg.add_argument(const="preferences", action='store_const', dest="command")
 
 	examplesArg = subparsers.add_parser("examples", help="show some examples", add_help=False)
 	examplesArg.add_argument(const="examples", action='store_const', dest="command")
 
-	args = parser.parse_args()
-	country = args.store
-	lang = args.lang
+	args = parser.parse_args(splitCodes(sys.argv[1:], commands=subparsers.choices))
+	# a single code may come from preferences, a list from the command line
+	countries = args.store or [prefCountry]
+	langs = args.lang or [prefLang]
+	countries = [c for c in countries if c]
+	langs = [lang for lang in langs if lang]
+	if len(countries) > 1 and len(langs) not in (1, len(countries)):
+		parser.error("pass either 1 language code for all stores or 1 per store")
+	country = lang = None
+	if countries:
+		country = countries[0]
+	if langs:
+		lang = langs[0]
+	if len(langs) == 1:
+		langs = langs * len(countries)
+	stores = list(zip(langs, countries))
 	argCommand = args.command
 	argQuery = args.query
 	argSortingList = args.sort
@@ -201,7 +363,33 @@ def getVars():
 	dontPrintResults = args.noprint
 	ignorePreviousFetch = args.ignore
 	reverseResults = args.reverse
+	printPipelineStats = args.stats
+	metricsFile = args.metricsFile or prefMetricsFile
+	recordDir = args.recordDir
+	replayDir = args.replayDir
+	replayLatency = args.replayLatency
+	archivePages = args.archivePages
+	localSearch = args.local
+	showChanges = args.changes
+	streamResults = args.stream
+	dealRefresh = args.refresh
+	stageDeals = args.stageDeals
+	if argCommand == "maintain":
+		dealRetention = args.maxAge
+		dbMaxSize = args.maxSize
+	if recordDir and replayDir:
+		parser.error("pass either --record or --replay")
+	if streamResults and showChanges:
+		parser.error("pass either --stream or --changes")
+	profileRun = None
+	if args.profile:
+		profileRun = "trace"
+	if args.cprofile:
+		profileRun = "cprofile"
 	getAllDeals = args.alldeals
+	searchPages = args.pages
+	if args.deep:
+		searchPages = max(searchPages, SEARCH_DEEP_PAGES)
 
 	writetext = args.writetext
 	if writetext:
@@ -215,13 +403,20 @@ def getVars():
 	writexlsx = args.writexlsx
 	if writexlsx:
 		writexlsx = pswrite.writexlsx
+	# a background refresh only updates the database
+	if stageDeals:
+		dontPrintResults = True
+		metricsFile = profileRun = None
+		writetext = writereddit = writehtml = writexlsx = False
 
 	operation = "FETCHDEAL"
 	if argQuery:
 		operation = "FETCHITEM"
 
 	subCommand = addTitle = None
+	watchAllStores = False
 	if argCommand == "watchlist":
+		watchAllStores = args.allStores
 		if not args.subCommand:
 			watchlistArg.print_usage()
 		else:
@@ -231,9 +426,20 @@ def getVars():
 			else:
 				subCommand = args.subCommand
 		operation = "WATCHDOG"
+	elif argCommand == "shell":
+		operation = "SHELL"
 
-	return country, lang, argCommand, subCommand, addTitle, \
-		argQuery, argSortingList, argContentTypes, minprice, maxprice, \
-		printTableResults, dontPrintResults, ignorePreviousFetch, \
-		reverseResults, getAllDeals, \
-		writetext, writereddit, writehtml, writexlsx, operation
+	return argparse.Namespace(
+		country=country, lang=lang, stores=stores, argCommand=argCommand, subCommand=subCommand,
+		addTitle=addTitle, argQuery=argQuery, argSortingList=argSortingList, argContentTypes=argContentTypes,
+		minprice=minprice, maxprice=maxprice, printTableResults=printTableResults,
+		dontPrintResults=dontPrintResults, ignorePreviousFetch=ignorePreviousFetch,
+		reverseResults=reverseResults, getAllDeals=getAllDeals, searchPages=searchPages,
+		watchlistMaxAge=watchlistMaxAge, watchAllStores=watchAllStores, dealListMaxAge=dealListMaxAge,
+		printPipelineStats=printPipelineStats, profileRun=profileRun, metricsFile=metricsFile,
+		recordDir=recordDir, replayDir=replayDir, replayLatency=replayLatency, archivePages=archivePages,
+		localSearch=localSearch, showChanges=showChanges, streamResults=streamResults, dealMaxAge=dealMaxAge,
+		dealRefresh=dealRefresh, stageDeals=stageDeals, dealRetention=dealRetention, dbMaxSize=dbMaxSize,
+		writetext=writetext, writereddit=writereddit, writehtml=writehtml, writexlsx=writexlsx,
+		operation=operation
+	)
@@ -0,0 +1,170 @@
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+
+from modules import pstrace
+from modules.globals import PIPELINE_THREADS, PIPELINE_DEPTH
+
+# marks the end of a stage's input
+DONE = None
+
+
+def newstats():
+	"""Return an empty dict of per-stage statistics for pipeline."""
+	stats = {}
+	for stage in ("download", "parse", "store"):
+		stats[stage] = {"items": 0, "busy": 0.0, "depthMax": 0, "depthSum": 0, "depthSamples": 0}
+	stats["wall"] = 0.0
+	return stats
+
+
+def sampledepth(stageStats, depth):
+	"""Return None. Record depth of the queue feeding a stage."""
+	stageStats["depthMax"] = max(stageStats["depthMax"], depth)
+	stageStats["depthSum"] += depth
+	stageStats["depthSamples"] += 1
+
+
+def timedcall(func, args):
+	"""Return func's result, its duration in seconds and its trace (see pstrace.tracedcall). Run in parse workers."""
+	start = time.perf_counter()
+	result, trace = pstrace.tracedcall(func, *args)
+	return result, time.perf_counter() - start, trace
+
+
+def pipeline(jobs, download=None, parse=None, threads=PIPELINE_THREADS, processes=None, depth=PIPELINE_DEPTH, stats=None):
+	"""Return a generator of (key, result) pairs, in the order pages are parsed.
+
+	Pages are downloaded by threads, parsed by a pool of processes,
+	and stored by the caller while it consumes the generator.
+	Stages are joined by queues of at most depth items: a slow stage holds the ones before it back.
+	The first error of a download or parse is raised by the generator.
+
+	Parameters:
+	jobs (list): tuples of a job's key, URL and extra arguments for parse
+	download (func): func(url) returns a page's text, called in threads
+	parse (func): func(text, *args) returns a result, called in processes; must be picklable
+	threads (int): number of download threads
+	processes (int): number of parse processes, CPU count by default
+	depth (int): maximum number of items waiting for each stage
+	stats (dict): per-stage statistics filled in while running (see newstats)
+	"""
+	if stats is None:
+		stats = newstats()
+	jobQueue = queue.Queue()
+	pageQueue = queue.Queue(maxsize=depth)
+	resultQueue = queue.Queue()
+	# parses in flight or waiting to be stored: released when the caller takes a result
+	parseSlots = threading.BoundedSemaphore(depth)
+	stop = threading.Event()
+	lock = threading.Lock()
+	# items waiting for the download and parse stages, without end markers
+	waiting = {"download": len(jobs), "parse": 0}
+	for job in jobs:
+		jobQueue.put(job)
+	threads = max(1, min(threads, len(jobs)))
+	for _ in range(threads):
+		jobQueue.put(DONE)
+
+	def downloader():
+		while not stop.is_set():
+			job = jobQueue.get()
+			if job is DONE:
+				break
+			with lock:
+				waiting["download"] -= 1
+				sampledepth(stats["download"], waiting["download"])
+			key, url, args = job
+			start = time.perf_counter()
+			try:
+				text = download(url)
+			except Exception as err:
+				resultQueue.put((key, err, True))
+				break
+			with lock:
+				stats["download"]["items"] += 1
+				stats["download"]["busy"] += time.perf_counter() - start
+				waiting["parse"] += 1
+			while not stop.is_set():
+				try:
+					pageQueue.put((key, text, args), timeout=0.1)
+					break
+				except queue.Full:
+					continue
+		pageQueue.put(DONE)
+
+	# a single thread hands pages over to the pool, so at most depth parses are queued there
+	def dispatcher(p):
+		finished = 0
+		while finished < threads:
+			item = pageQueue.get()
+			if item is DONE:
+				finished += 1
+				continue
+			with lock:
+				waiting["parse"] -= 1
+				sampledepth(stats["parse"], waiting["parse"])
+			key, text, args = item
+			while not parseSlots.acquire(timeout=0.1):
+				if stop.is_set():
+					return
+			if stop.is_set():
+				return
+			p.apply_async(
+				timedcall, (parse, (text,) + tuple(args)),
+				callback=lambda result, key=key: resultQueue.put((key, result, False)),
+				error_callback=lambda err, key=key: resultQueue.put((key, err, True))
+			)
+
+	p = multiprocessing.Pool(processes=processes or multiprocessing.cpu_count())
+	workers = [threading.Thread(target=downloader, daemon=True) for _ in range(threads)]
+	workers.append(threading.Thread(target=dispatcher, args=(p,), daemon=True))
+	wallStart = time.perf_counter()
+	for worker in workers:
+		worker.start()
+	try:
+		remaining = len(jobs)
+		while remaining:
+			key, result, failed = resultQueue.get()
+			if failed:
+				raise result
+			result, duration, trace = result
+			pstrace.merge(trace)
+			sampledepth(stats["store"], resultQueue.qsize())
+			stats["parse"]["items"] += 1
+			stats["parse"]["busy"] += duration
+			remaining -= 1
+			start = time.perf_counter()
+			yield key, result
+			stats["store"]["items"] += 1
+			stats["store"]["busy"] += time.perf_counter() - start
+			parseSlots.release()
+		p.close()
+	finally:
+		stop.set()
+		p.terminate()
+		p.join()
+		stats["wall"] += time.perf_counter() - wallStart
+
+
+def printstats(stats, file=sys.stderr):
+	"""Return None. Print per-stage items, throughput, busy time and queue depth.
+
+	Parameters:
+	stats (dict): statistics filled in by pipeline
+	file (file): stream to print to
+	"""
+	wall = stats["wall"] or 1e-9
+	print("stage    | items | items/s | busy s | queue max | queue avg", file=file)
+	for stage in ("download", "parse", "store"):
+		stageStats = stats[stage]
+		depthAvg = 0
+		if stageStats["depthSamples"]:
+			depthAvg = stageStats["depthSum"] / stageStats["depthSamples"]
+		print("{:<8} | {:>5} | {:>7.1f} | {:>6.2f} | {:>9} | {:>9.1f}".format(
+			stage, stageStats["items"], stageStats["items"] / wall,
+			stageStats["busy"], stageStats["depthMax"], depthAvg
+		), file=file)
+	print("wall time: {:.2f} s".format(stats["wall"]), file=file)
@@ -0,0 +1,65 @@
+import re
+
+# rounded price of titles without a numeric price, e.g. free or not for sale
+UNPRICED = 0.1
+
+# a price's number: digits with thousands and decimal separators (commas, dots or spaces of any kind)
+numberReg = re.compile(r"\d(?:[\d,.\s]*\d)?")
+# a decimal separator is the last separator followed by 1 or 2 digits;
+# 3 digits after a separator always mean thousands (no store shows fractions of a cent)
+decimalReg = re.compile(r"[,.](\d{1,2})$")
+nonDigitReg = re.compile(r"\D")
+
+
+def minorunits(prices):
+	"""Return a list of integer prices in minor units (hundredths) for a list of price strings.
+
+	The separator and currency rules are the same for every store:
+	currency symbols and codes are dropped, and the decimal separator is told apart
+	from thousands separators by its position, so '1.299,00 zł', '$1,299.00' and '1 299,00 Kč'
+	are all 129900. None is returned for a price without digits (e.g. 'Free') or for a non-string.
+
+	Parameters:
+	prices (list): price strings as shown in PS Store
+	"""
+	search = numberReg.search
+	decimalSearch = decimalReg.search
+	strip = nonDigitReg.sub
+	units = []
+	for price in prices:
+		match = None
+		if isinstance(price, str):
+			match = search(price)
+		if not match:
+			units.append(None)
+			continue
+		number = match.group()
+		decimals = decimalSearch(number)
+		fraction = "00"
+		if decimals:
+			fraction = decimals.group(1).ljust(2, "0")
+			number = number[:decimals.start()]
+		units.append(int(strip("", number) + fraction))
+	return units
+
+
+def currency(price):
+	"""Return a price string's currency: its symbol or code without the number, e.g. '$', 'zł' or 'US$'.
+
+	None is returned for a price without digits (e.g. 'Free') or for a non-string.
+
+	Parameters:
+	price (str): price string as shown in PS Store
+	"""
+	if not isinstance(price, str) or not numberReg.search(price):
+		return None
+	return numberReg.sub("", price).strip()
+
+
+def roundprices(prices):
+	"""Return a list of float prices for a list of price strings, UNPRICED for prices without digits.
+
+	Parameters:
+	prices (list): price strings as shown in PS Store
+	"""
+	return [UNPRICED if unit is None else unit / 100 for unit in minorunits(prices)]
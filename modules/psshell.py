@@ -0,0 +1,304 @@
+from array import array
+import cmd
+import sys
+import time
+
+from modules import pssql
+from modules.globals import MINPRICE, MAXPRICE
+
+SORTING = ["price", "title", "discount"]
+CONTENT = ["game", "addon", "currency"]
+FORMATS = ["txt", "reddit", "html", "xlsx"]
+
+
+class DealColumns:
+	"""A deal's fetched items held in memory column by column.
+
+	Prices rounded for filtering and IDs are arrays of numbers, content types are codes into a list of types,
+	and repeated strings (discounts, platforms, types) are interned, so a deal of many items stays compact.
+	"""
+
+	def __init__(self, items):
+		"""Parameters:
+		items (list): items returned from pssql.dealitems
+		"""
+		self.ids = array("q")
+		self.roundprices = array("d")
+		self.typeCodes = array("H")
+		self.types = []
+		self.titles = []
+		self.prices = []
+		self.discounts = []
+		self.titleIDs = []
+		self.platforms = []
+		typeIndex = {}
+		for ind, title, price, roundprice, discount, ctype, titleID, platform in items:
+			self.ids.append(ind)
+			# a missing price never matches a price range, like NULL in SQL
+			self.roundprices.append(float("nan") if roundprice is None else roundprice)
+			if ctype not in typeIndex:
+				typeIndex[ctype] = len(self.types)
+				self.types.append(ctype)
+			self.typeCodes.append(typeIndex[ctype])
+			self.titles.append(title)
+			self.prices.append(price)
+			self.discounts.append(sys.intern(discount))
+			self.titleIDs.append(titleID)
+			self.platforms.append(sys.intern(platform))
+		self.typeIndex = typeIndex
+		# justification is based on all of the deal's items, like in mainselect
+		self.tlen = max([len(title) for title in self.titles] or [0])
+		self.plen = max([len(price) for price in self.prices] or [0])
+
+	def __len__(self):
+		return len(self.ids)
+
+	def select(self, minprice=0, maxprice=0, ctypes=None, sortingList=None, reverseResults=False):
+		"""Return indexes of items in the same order pssql.mainselect returns them.
+
+		Parameters:
+		minpirce (int): title's minimum price
+		maxprice (int): title's maximum price
+		ctypes (list): content types' names in the deal's language, all types if None
+		sortingList (list): a list of sorting levels
+		reverseResults (bool): if True, will reverse the order of sorting
+		"""
+		roundprices = self.roundprices
+		indexes = range(len(self.ids))
+		if ctypes is not None:
+			codes = set(self.typeIndex[ctype] for ctype in ctypes if ctype in self.typeIndex)
+			typeCodes = self.typeCodes
+			indexes = [i for i in indexes if typeCodes[i] in codes]
+		indexes = [i for i in indexes if minprice <= roundprices[i] <= maxprice]
+		if sortingList:
+			columns = {"price": self.roundprices, "title": self.titles, "discount": self.discounts}
+			keys = [columns[level] for level in sortingList]
+			if len(keys) == 1:
+				key = keys[0].__getitem__
+			else:
+				def key(i):
+					return tuple(column[i] for column in keys)
+			# a stable sort keeps ties in the order of IDs
+			indexes = sorted(indexes, key=key, reverse=reverseResults)
+		return indexes
+
+	def items(self, indexes):
+		"""Return a list of items (dicts) like the ones returned from pssql.mainselect."""
+		itemlist = []
+		for i in indexes:
+			rawdata = {}
+			rawdata["title"] = self.titles[i]
+			rawdata["price"] = self.prices[i]
+			rawdata["discount"] = self.discounts[i]
+			rawdata["titleID"] = self.titleIDs[i]
+			rawdata["id"] = self.ids[i]
+			rawdata["platform"] = self.platforms[i]
+			itemlist.append(rawdata)
+		return itemlist
+
+
+class Shell(cmd.Cmd):
+	"""An interactive shell filtering, sorting and saving a fetched deal loaded once into memory."""
+
+	intro = "type 'deals' to list fetched deals, 'load N' to load one, 'help' for all commands"
+	prompt = "psfetcher> "
+
+	def __init__(
+		self, dbfile=None, lang=None, country=None, allcontent=None, minprice=MINPRICE, maxprice=MAXPRICE,
+		sortingList=None, contentTypes=None, reverseResults=False, table=False, printer=None, saver=None
+	):
+		"""Parameters:
+		dbfile (str): full path to a database file
+		lang (str): 2-letter language code
+		country (str): 2-letter country code
+		allcontent (dict): second dict, allcontent, returned from psconfig.getConf
+		minprice, maxprice, sortingList, contentTypes, reverseResults: filters the shell starts with
+		table (bool): if True, will print table-like results
+		printer (func): func(itemlist, tlen, plen, table) prints items
+		saver (func): func(itemlist, tlen, plen, filterMessage, deal, formats) saves items and returns messages
+		"""
+		super().__init__()
+		self.dbfile = dbfile
+		self.lang = lang
+		self.country = country
+		self.locale = "{}-{}".format(lang, country)
+		self.allcontent = allcontent
+		self.defaults = dict(
+			minprice=minprice, maxprice=maxprice, sortingList=list(sortingList or []),
+			contentTypes=list(contentTypes or []), reverseResults=reverseResults
+		)
+		self.filters = dict(self.defaults)
+		self.table = table
+		self.printer = printer
+		self.saver = saver
+		self.deals = []
+		self.deal = None
+		self.columns = None
+
+	def selection(self):
+		"""Return itemlist, maximum title length, maximum price length, and a message of applied filters."""
+		indexes, filterMessage = self.selected()
+		return self.columns.items(indexes), self.columns.tlen, self.columns.plen, filterMessage
+
+	def selected(self):
+		"""Return indexes of the selected items and a message of applied filters."""
+		filters = self.filters
+		ctypes = None
+		if filters["contentTypes"]:
+			ctypes = []
+			for ctype in filters["contentTypes"]:
+				ctypes += self.allcontent[self.lang][ctype]
+		sortingList = list(dict.fromkeys(filters["sortingList"]))
+		indexes = self.columns.select(
+			minprice=filters["minprice"], maxprice=filters["maxprice"], ctypes=ctypes,
+			sortingList=sortingList, reverseResults=filters["reverseResults"]
+		)
+		filterMessage = "{} titles".format(len(indexes))
+		for message in pssql.filtermessages(**filters):
+			filterMessage += " | {}".format(message)
+		return indexes, filterMessage
+
+	def summary(self):
+		"""Return None. Print the number of selected titles, applied filters and how long selecting took."""
+		if self.columns is None:
+			return None
+		started = time.perf_counter()
+		indexes, filterMessage = self.selected()
+		print("{} ({:.1f} ms)".format(filterMessage, (time.perf_counter() - started) * 1000))
+
+	def loaded(self):
+		"""Return True if a deal is loaded, print a hint otherwise."""
+		if self.columns is None:
+			print("no deal is loaded. type 'deals' to list fetched deals, 'load N' to load one")
+			return False
+		return True
+
+	def emptyline(self):
+		pass
+
+	def default(self, line):
+		print("unknown command '{}'. type 'help' for all commands".format(line.split()[0]))
+
+	def do_deals(self, arg):
+		"""deals: list fetched deals of the current store"""
+		self.deals = pssql.fetcheddeals(dbfile=self.dbfile, locale=self.locale)
+		if not self.deals:
+			print("no fetched deals in the {} store".format(self.locale))
+			return None
+		for ind, (deal, dealID, count) in enumerate(self.deals, start=1):
+			print(ind, "{} ({} items)".format(deal, count))
+
+	def do_load(self, arg):
+		"""load N: load the deal N from the list of fetched deals"""
+		if not self.deals:
+			self.deals = pssql.fetcheddeals(dbfile=self.dbfile, locale=self.locale)
+		if not arg.isdigit() or not 0 < int(arg) <= len(self.deals):
+			print("enter a deal's index from 'deals'")
+			return None
+		deal, dealID, count = self.deals[int(arg) - 1]
+		started = time.perf_counter()
+		self.columns = DealColumns(pssql.dealitems(dbfile=self.dbfile, deal=deal, dealID=dealID, locale=self.locale))
+		pssql.touchdeal(dbfile=self.dbfile, deal=deal, dealID=dealID, locale=self.locale)
+		self.deal = deal
+		print("loaded {} items of the '{}' deal ({:.1f} ms)".format(
+			len(self.columns), deal, (time.perf_counter() - started) * 1000
+		))
+		self.summary()
+
+	def do_show(self, arg):
+		"""show [N]: print the selected titles, or the first N of them"""
+		if not self.loaded():
+			return None
+		itemlist, tlen, plen, filterMessage = self.selection()
+		if arg.isdigit():
+			itemlist = itemlist[:int(arg)]
+		if itemlist:
+			self.printer(itemlist, tlen=tlen, plen=plen, table=self.table)
+		print(filterMessage)
+
+	def do_sort(self, arg):
+		"""sort [price|title|discount ...]: sort by one or more levels, or don't sort if none are given"""
+		levels = arg.split()
+		if any(level not in SORTING for level in levels):
+			print("sort by {}".format(", ".join(SORTING)))
+			return None
+		self.filters["sortingList"] = levels
+		self.summary()
+
+	def do_reverse(self, arg):
+		"""reverse: reverse the order of sorting, or restore it"""
+		self.filters["reverseResults"] = not self.filters["reverseResults"]
+		self.summary()
+
+	def do_type(self, arg):
+		"""type [game|addon|currency ...]: show only specific content types, or all of them if none are given"""
+		ctypes = arg.split()
+		if any(ctype not in CONTENT for ctype in ctypes):
+			print("content types are {}".format(", ".join(CONTENT)))
+			return None
+		self.filters["contentTypes"] = ctypes
+		self.summary()
+
+	def price(self, arg, key):
+		"""Return None. Set a price limit from an argument, or reset it if there's none."""
+		value = self.defaults[key]
+		if arg:
+			if not arg.isdigit():
+				print("enter a natural number")
+				return None
+			value = int(arg)
+		limits = dict(self.filters, **{key: value})
+		if limits["minprice"] > limits["maxprice"]:
+			print("there there now, be a dear and fix those prices")
+			return None
+		self.filters[key] = value
+		self.summary()
+
+	def do_from(self, arg):
+		"""from [N]: show titles starting from the price N, or reset the minimum price"""
+		self.price(arg, "minprice")
+
+	def do_under(self, arg):
+		"""under [N]: show titles under the price N, or reset the maximum price"""
+		self.price(arg, "maxprice")
+
+	def do_reset(self, arg):
+		"""reset: restore the filters and sorting the shell started with"""
+		self.filters = dict(self.defaults, sortingList=list(self.defaults["sortingList"]))
+		self.summary()
+
+	def do_table(self, arg):
+		"""table: switch between table-like and plain printed and saved results"""
+		self.table = not self.table
+		print("table-like results: {}".format(str(self.table).lower()))
+
+	def do_filters(self, arg):
+		"""filters: show the loaded deal, the number of selected titles and applied filters"""
+		if self.loaded():
+			print("deal: {}".format(self.deal))
+			self.summary()
+
+	def do_save(self, arg):
+		"""save txt|reddit|html|xlsx ...: save the selected titles in one or more formats"""
+		formats = arg.split()
+		if not formats or any(output not in FORMATS for output in formats):
+			print("save as {}".format(", ".join(FORMATS)))
+			return None
+		if not self.loaded():
+			return None
+		itemlist, tlen, plen, filterMessage = self.selection()
+		if not itemlist:
+			print("nothing to save")
+			return None
+		for message in self.saver(itemlist, tlen, plen, filterMessage, self.deal, formats, table=self.table):
+			print("saved", message)
+
+	def do_quit(self, arg):
+		"""quit: leave the shell"""
+		return True
+
+	do_exit = do_quit
+
+	def do_EOF(self, arg):
+		print()
+		return True
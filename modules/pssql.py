@@ -1,14 +1,121 @@
 from more_itertools import unique_everseen
+import os
+import re
+import atexit
+import socket
 import sqlite3
+import threading
+import time
 
-from modules.globals import MINPRICE, MAXPRICE
+from modules import psprice, pstrace
+from modules.globals import MINPRICE, MAXPRICE, MEMORYDB, LEASE_TTL, LEASE_POLL, CURRENCIES
+from modules.globals import DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_TIMEOUT, DB_READERS
+
+# one in-memory database per process, keyed by process ID
+memorydb = {}
+# database files' connections kept open, keyed by database file, process ID and thread ID:
+# a single writing connection each, and idle read-only connections returned by close
+writers = {}
+readers = {}
+
+
+class PooledConnection(sqlite3.Connection):
+	"""A database file's connection kept open by connect and close."""
+
+	key = None
+	readonly = False
+
+
+def connect(dbfile=None, readonly=False):
+	"""Return a connection to a storage backend.
+
+	A full path to a database file opens the persistent, on-disk backend, in WAL mode:
+	readers don't block the writer and the writer doesn't block readers, within a process or across processes.
+	Each process and thread reuses a single writing connection, and read-only connections handed back to close.
+	MEMORYDB opens the in-memory backend: a single connection per process whose tables
+	live until the process exits. It's meant for results that are thrown away after a run.
+
+	Parameters:
+	dbfile (str): full path to a database file or MEMORYDB
+	readonly (bool): if True, a read-only connection is returned, for functions that don't write
+	"""
+	if dbfile != MEMORYDB:
+		key = (dbfile, os.getpid(), threading.get_ident())
+		if readonly and readers.get(key):
+			return readers[key].pop()
+		if not readonly and key in writers:
+			return writers[key]
+		if readonly:
+			c = sqlite3.connect(
+				"file:{}?mode=ro".format(dbfile), uri=True, timeout=DB_TIMEOUT, factory=PooledConnection
+			)
+		else:
+			c = sqlite3.connect(dbfile, timeout=DB_TIMEOUT, factory=PooledConnection)
+			# both are kept in the database file; auto-vacuum only takes effect on a new, empty one (see compact)
+			c.execute("pragma auto_vacuum = incremental")
+			c.execute("pragma journal_mode = wal").fetchone()
+			c.execute("pragma synchronous = {}".format(DB_SYNCHRONOUS))
+			writers[key] = c
+		c.execute("pragma mmap_size = {}".format(DB_MMAP_SIZE)).fetchone()
+		c.execute("pragma cache_size = -{}".format(DB_CACHE_SIZE))
+		c.key = key
+		c.readonly = readonly
+		return c
+	pid = os.getpid()
+	if pid not in memorydb:
+		memorydb[pid] = sqlite3.connect(MEMORYDB)
+		maketables(dbfile=MEMORYDB)
+	return memorydb[pid]
+
+
+def close(connection=None):
+	"""Return None. Hand a connection returned from connect back.
+
+	Uncommitted changes are rolled back. The writing connection stays open, and up to DB_READERS
+	read-only connections per process and thread are kept for reuse; the in-memory backend is never closed.
+
+	Parameters:
+	connection (sqlite3.Connection): connection returned from connect
+	"""
+	if connection is memorydb.get(os.getpid()):
+		return None
+	if connection.in_transaction:
+		connection.rollback()
+	if not connection.readonly:
+		return None
+	idle = readers.setdefault(connection.key, [])
+	if len(idle) < DB_READERS:
+		idle.append(connection)
+	else:
+		connection.close()
+
+
+@atexit.register
+def closeall():
+	"""Return None. Close all of this process' database file connections, e.g. before it exits.
+
+	Writers are closed last: only a writing connection checkpoints the write-ahead log and removes it.
+	"""
+	pid = os.getpid()
+	for key in [key for key in readers if key[1] == pid]:
+		for connection in readers.pop(key):
+			connection.close()
+	for key in [key for key in writers if key[1] == pid]:
+		writers.pop(key).close()
 
 
 def maketables(dbfile=None):
-	"""Return None. Create psfetcher's 2 main tables.
+	"""Return None. Create psfetcher's tables.
 
 	First table, 'psfetcher', stores all fetched information.
 	Second table, 'watchlist', stores all added titles from the 'watchlist' command.
+	Third table, 'fetchlease', stores which run is currently fetching a deal.
+	Fourth table, 'productcache', stores recently fetched product pages of single titles.
+	Fifth table, 'dealcache', stores each store's recently listed deals and their page counts.
+	Sixth table, 'snapshot', stores each deal's items from its previous fetch, compared by changeselect.
+	Seventh table, 'staging', stores items of deals being refreshed in the background until they replace the old ones.
+	Eighth table, 'dealaccess', stores when each deal's results were last shown, for evictdeals.
+	A full-text index of titles, 'titleindex', is kept up to date with 'psfetcher' by triggers (see maketitleindex).
 
 	Parameters:
 	dbfile (str): full path to a database file
@@ -19,33 +126,708 @@ def maketables(dbfile=None):
 	titleID blob, title blob, price blob,
 	discount blob, roundprice real, type blob,
 	deal blob, pagenumber integer, dealID blob,
-	locale text, platform blob)
+	locale text, platform blob, fetched real)
 	"""
 	watchdb = """
 	create table if not exists watchlist
 	(id integer primary key autoincrement,
 	title blob, titleID, locale blob)
 	"""
-	c = sqlite3.connect(dbfile)
-	[c.cursor().execute(statement) for statement in (maindb, watchdb)]
+	leasedb = """
+	create table if not exists fetchlease
+	(dealID blob, locale text, deal blob,
+	owner text, expires real,
+	primary key (dealID, locale, deal))
+	"""
+	productdb = """
+	create table if not exists productcache
+	(titleID blob, locale text, title blob, price blob,
+	roundprice real, discount blob, type blob, platform blob,
+	fetched real, primary key (titleID, locale))
+	"""
+	dealdb = """
+	create table if not exists dealcache
+	(locale text, position integer, deal blob, url blob, dealID blob,
+	totalcount integer, pages integer, pagesize integer, fetched real,
+	primary key (locale, position))
+	"""
+	snapshotdb = """
+	create table if not exists snapshot
+	(titleID blob, title blob, price blob,
+	discount blob, roundprice real, type blob,
+	deal blob, pagenumber integer, dealID blob,
+	locale text, platform blob, fetched real)
+	"""
+	stagingdb = """
+	create table if not exists staging
+	(titleID blob, title blob, price blob,
+	discount blob, roundprice real, type blob,
+	deal blob, pagenumber integer, dealID blob,
+	locale text, platform blob, fetched real)
+	"""
+	accessdb = """
+	create table if not exists dealaccess
+	(dealID blob, locale text, deal blob, accessed real,
+	primary key (dealID, locale, deal))
+	"""
+	# every query of a deal's items looks them up by deal
+	dealindex = "create index if not exists psfetcher_deal on psfetcher (dealID, locale, deal)"
+	c = connect(dbfile)
+	[
+		c.cursor().execute(statement)
+		for statement in (maindb, watchdb, leasedb, productdb, dealdb, snapshotdb, stagingdb, accessdb)
+	]
+	# databases created before 'fetched' was added
+	columns = [column[1] for column in c.execute("pragma table_info(psfetcher)").fetchall()]
+	if "fetched" not in columns:
+		c.cursor().execute("alter table psfetcher add column fetched real")
+	c.cursor().execute(dealindex)
+	# results in the in-memory backend are thrown away, so they're not indexed
+	if dbfile != MEMORYDB:
+		maketitleindex(c)
 	c.commit()
-	c.close()
+	close(c)
+
+
+def maketitleindex(c=None):
+	"""Return None. Create the full-text index of fetched titles, 'titleindex', and its triggers.
+
+	The index is an FTS5 table over the titles in 'psfetcher', updated by triggers on every insert and delete.
+	An index created for an existing database is built from its rows.
+	Nothing is created if SQLite is built without FTS5; localsearch finds nothing then.
+
+	Parameters:
+	c (sqlite3.Connection): connection to a database file
+	"""
+	indexdb = """
+	create virtual table titleindex using fts5
+	(title, content='psfetcher', content_rowid='id', tokenize='unicode61 remove_diacritics 2')
+	"""
+	triggers = (
+		"""
+		create trigger if not exists titleindex_insert after insert on psfetcher begin
+		insert into titleindex (rowid, title) values (new.id, new.title);
+		end
+		""",
+		"""
+		create trigger if not exists titleindex_delete after delete on psfetcher begin
+		insert into titleindex (titleindex, rowid, title) values ('delete', old.id, old.title);
+		end
+		""",
+		"""
+		create trigger if not exists titleindex_update after update of title on psfetcher begin
+		insert into titleindex (titleindex, rowid, title) values ('delete', old.id, old.title);
+		insert into titleindex (rowid, title) values (new.id, new.title);
+		end
+		""",
+	)
+	statement = "select name from sqlite_master where type = 'table' and name = 'titleindex'"
+	if c.execute(statement).fetchone():
+		return None
+	try:
+		c.cursor().execute(indexdb)
+	except sqlite3.OperationalError:
+		return None
+	[c.cursor().execute(statement) for statement in triggers]
+	c.cursor().execute("insert into titleindex (titleindex) values ('rebuild')")
+
+
+def insertitems(dbfile=None, rows=None, fetched=None, staged=False):
+	"""Return None. Write fetched items to the table 'psfetcher'.
+
+	Parameters:
+	dbfile (str): full path to a database file or MEMORYDB
+	rows (list): tuples of titleID, title, price, roundprice, discount,
+	type, deal, pagenumber, dealID, locale, platform
+	fetched (float): time the items were fetched at, now by default
+	staged (bool): if True, items are written to the table 'staging' instead (see swapstaged)
+	"""
+	statement = """
+	insert into {}
+	(titleID, title, price, roundprice, discount,
+	type, deal, pagenumber, dealID, locale, platform, fetched)
+	values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+	""".format("staging" if staged else "psfetcher")
+	if fetched is None:
+		fetched = time.time()
+	with pstrace.span("insert", rows=len(rows)):
+		c = connect(dbfile)
+		c.cursor().executemany(statement, [row + (fetched,) for row in rows])
+		c.commit()
+		close(c)
+	# counted once per deal and locale rather than per row, since counters take a lock
+	ingested = {}
+	for row in rows:
+		# deal and locale
+		key = row[6], row[9]
+		ingested[key] = ingested.get(key, 0) + 1
+	for (deal, locale), count in ingested.items():
+		pstrace.count("rows_ingested", count, deal=deal, locale=locale)
+
+
+def replaceitems(dbfile=None, deals=None, pages=None):
+	"""Return None. Replace deals' fetched items with rebuilt ones in a single transaction (see psfetcher.reparse).
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deals (list): tuples of deal's name, deal's ID and locale
+	pages (list): tuples of rows for insertitems and the time they were fetched at
+	"""
+	statement = """
+	insert into psfetcher
+	(titleID, title, price, roundprice, discount,
+	type, deal, pagenumber, dealID, locale, platform, fetched)
+	values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+	"""
+	c = connect(dbfile)
+	try:
+		for deal, dealID, locale in deals:
+			c.execute("delete from psfetcher where dealID = ? and locale = ? and deal = ?", (dealID, locale, deal))
+		for rows, fetched in pages:
+			c.executemany(statement, [row + (fetched,) for row in rows])
+		c.commit()
+	finally:
+		close(c)
+
+
+def cacheproducts(dbfile=None, rows=None):
+	"""Return None. Save single titles' information fetched from their product pages.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	rows (list): rows returned from itemPrice
+	"""
+	statement = """
+	insert or replace into productcache
+	(titleID, title, price, roundprice, discount, type, locale, platform, fetched)
+	values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+	"""
+	now = time.time()
+	c = connect(dbfile)
+	c.cursor().executemany(statement, [
+		(row[0], row[1], row[2], row[3], row[4], row[5], row[9], row[10], now)
+		for row in rows
+	])
+	c.commit()
+	close(c)
+
+
+def cachedprices(dbfile=None, locale=None, productMaxAge=0, dealMaxAge=0):
+	"""Return rows for insertitems of a store's watchlist titles with a fresh price in the database.
+
+	A price is taken from the latest fetched deal or product page that includes the title.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locale (str): language and country codes joined with a hyphen
+	productMaxAge (int): maximum age of a cached product page in seconds
+	dealMaxAge (int): maximum age of a fetched deal's item in seconds
+	"""
+	statement = """
+	select titleID, title, price, roundprice, discount,
+	type, 'watchlist', 1, 'watchlist', locale, platform, max(fetched)
+	from (
+		select psfetcher.titleID, psfetcher.title, price, roundprice, discount,
+		type, psfetcher.locale, platform, fetched
+		from watchlist join psfetcher
+		on psfetcher.titleID = watchlist.titleID and psfetcher.locale = watchlist.locale
+		where watchlist.locale = ? and fetched >= ? and deal != 'watchlist'
+		union all
+		select productcache.titleID, productcache.title, price, roundprice, discount,
+		type, productcache.locale, platform, fetched
+		from watchlist join productcache
+		on productcache.titleID = watchlist.titleID and productcache.locale = watchlist.locale
+		where watchlist.locale = ? and fetched >= ?
+	)
+	group by titleID
+	"""
+	now = time.time()
+	c = connect(dbfile, readonly=True)
+	rows = c.execute(statement, (locale, now - dealMaxAge, locale, now - productMaxAge)).fetchall()
+	close(c)
+	return [row[:-1] for row in rows]
+
+
+def localsearch(dbfile=None, query=None, locale=None):
+	"""Return rows for insertitems of a store's fetched titles matching a query, and the oldest row's fetch time.
+
+	Every word of the query must start a word of a title, e.g. 'gow rag' matches nothing,
+	while 'god war rag' matches 'God of War Ragnarök'. Titles are ranked by relevance (bm25)
+	and each is taken from the latest fetched deal that includes it.
+	If nothing matches, an empty list and None are returned.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	query (str): search phrase; it's also the rows' deal name and ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	words = re.findall(r"\w+", query)
+	if not words:
+		return [], None
+	# each word is quoted, so none of them is read as an FTS5 operator
+	match = " ".join("\"{}\"*".format(word) for word in words)
+	# a title's latest row is picked explicitly: bare columns next to aggregates may come from any of its rows
+	statement = """
+	select titleID, title, price, roundprice, discount,
+	type, ?, 1, ?, locale, platform, fetched
+	from (
+		select psfetcher.*, titleindex.rank as rank,
+		row_number() over (partition by titleID order by fetched desc, id desc) as latest
+		from titleindex join psfetcher on psfetcher.id = titleindex.rowid
+		where titleindex match ? and locale = ? and deal != 'watchlist'
+	)
+	where latest = 1
+	order by rank
+	"""
+	c = connect(dbfile, readonly=True)
+	try:
+		rows = c.execute(statement, (query, query, match, locale)).fetchall()
+	except sqlite3.OperationalError:
+		rows = []
+	finally:
+		close(c)
+	if not rows:
+		return [], None
+	# items stored before 'fetched' was added have no fetch time
+	fetched = [row[-1] for row in rows if row[-1] is not None]
+	return [row[:-1] for row in rows], min(fetched, default=None)
+
+
+def cachedeals(dbfile=None, locale=None, deals=None):
+	"""Return None. Save a store's list of deals, replacing the previous one.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locale (str): language and country codes joined with a hyphen
+	deals (list): tuples of deal's name and its local URL
+	"""
+	statement = """
+	insert into dealcache
+	(locale, position, deal, url, dealID, fetched)
+	values (?, ?, ?, ?, ?, ?)
+	"""
+	now = time.time()
+	c = connect(dbfile)
+	c.cursor().execute("delete from dealcache where locale = ?", (locale,))
+	c.cursor().executemany(statement, [
+		(locale, position, deal, url, url.split("/")[-2], now)
+		for position, (deal, url) in enumerate(deals)
+	])
+	c.commit()
+	close(c)
+
+
+def cacheddeals(dbfile=None, locale=None, maxage=0):
+	"""Return a store's cached list of deals (tuples of deal's name and its local URL).
+
+	An empty list is returned if the list is older than maxage.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locale (str): language and country codes joined with a hyphen
+	maxage (int): maximum age of the list in seconds
+	"""
+	statement = """
+	select deal, url from dealcache
+	where locale = ? and fetched >= ?
+	order by position
+	"""
+	c = connect(dbfile, readonly=True)
+	deals = c.execute(statement, (locale, time.time() - maxage)).fetchall()
+	close(c)
+	return deals
+
+
+def cachecounts(dbfile=None, locale=None, dealID=None, counts=None):
+	"""Return None. Save a listed deal's total number of items, pages and items per page.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locale (str): language and country codes joined with a hyphen
+	dealID (str): deal's ID
+	counts (tuple): values returned from itercount
+	"""
+	statement = """
+	update dealcache set totalcount = ?, pages = ?, pagesize = ?
+	where locale = ? and dealID = ?
+	"""
+	c = connect(dbfile)
+	c.cursor().execute(statement, tuple(counts) + (locale, dealID))
+	c.commit()
+	close(c)
+
+
+def cachedcounts(dbfile=None, maxage=0):
+	"""Return a dict of cached page counts of listed deals in all stores.
+
+	Keys are tuples of locale and deal's ID, values are tuples like the ones returned from itercount.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	maxage (int): maximum age of a store's list of deals in seconds
+	"""
+	statement = """
+	select locale, dealID, totalcount, pages, pagesize from dealcache
+	where pages is not null and fetched >= ?
+	"""
+	c = connect(dbfile, readonly=True)
+	counts = {}
+	for locale, dealID, totalCount, pages, pageSize in c.execute(statement, (time.time() - maxage,)).fetchall():
+		counts[(locale, dealID)] = (totalCount, pages, pageSize)
+	close(c)
+	return counts
+
+
+def savesnapshot(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Keep a deal's fetched items as its snapshot, replacing the previous one, before they're removed.
+
+	Nothing is replaced if the deal has no fetched items.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	c = connect(dbfile)
+	snapshotitems(c, deal=deal, dealID=dealID, locale=locale)
+	c.commit()
+	close(c)
+
+
+def snapshotitems(c=None, deal=None, dealID=None, locale=None):
+	"""Return None. Copy a deal's fetched items to its snapshot within a connection's transaction (see savesnapshot).
+
+	Parameters:
+	c (sqlite3.Connection): connection to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	where = "where dealID = ? and locale = ? and deal = ?"
+	if c.execute("select 1 from psfetcher {} limit 1".format(where), (dealID, locale, deal)).fetchone():
+		c.cursor().execute("delete from snapshot {}".format(where), (dealID, locale, deal))
+		statement = """
+		insert into snapshot
+		(titleID, title, price, discount, roundprice, type,
+		deal, pagenumber, dealID, locale, platform, fetched)
+		select titleID, title, price, discount, roundprice, type,
+		deal, pagenumber, dealID, locale, platform, fetched
+		from psfetcher {}
+		""".format(where)
+		c.cursor().execute(statement, (dealID, locale, deal))
+
+
+def clearstaged(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Remove a deal's staged items, e.g. left by a refresh that didn't finish.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	c = connect(dbfile)
+	statement = "delete from staging where dealID = ? and locale = ? and deal = ?"
+	c.cursor().execute(statement, (dealID, locale, deal))
+	c.commit()
+	close(c)
+
+
+def swapstaged(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Replace a deal's fetched items with its staged ones in a single transaction.
+
+	Other runs see either all of the old items or all of the new ones, never a part of them.
+	The old items are kept as the deal's snapshot (see savesnapshot).
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	where = "where dealID = ? and locale = ? and deal = ?"
+	columns = "titleID, title, price, roundprice, discount, type, deal, pagenumber, dealID, locale, platform, fetched"
+	c = connect(dbfile)
+	snapshotitems(c, deal=deal, dealID=dealID, locale=locale)
+	c.cursor().execute("delete from psfetcher {}".format(where), (dealID, locale, deal))
+	statement = "insert into psfetcher ({0}) select {0} from staging {1} order by rowid".format(columns, where)
+	c.cursor().execute(statement, (dealID, locale, deal))
+	c.cursor().execute("delete from staging {}".format(where), (dealID, locale, deal))
+	c.commit()
+	close(c)
+
+
+def dealfetched(dbfile=None, deal=None, dealID=None, locale=None, latest=False):
+	"""Return the time a deal's fetched items were fetched at, or None if it's unknown.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	latest (bool): if True, return the time its newest item was fetched at instead of the oldest one
+	"""
+	statement = "select {}(fetched) from psfetcher where dealID = ? and locale = ? and deal = ?".format(
+		"max" if latest else "min"
+	)
+	c = connect(dbfile, readonly=True)
+	fetched, = c.execute(statement, (dealID, locale, deal)).fetchone()
+	close(c)
+	return fetched
+
+
+def touchdeal(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Record that a deal's results were shown now, so evictdeals removes it last.
+
+	Parameters:
+	dbfile (str): full path to a database file or MEMORYDB
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	statement = "insert or replace into dealaccess (dealID, locale, deal, accessed) values (?, ?, ?, ?)"
+	c = connect(dbfile)
+	c.cursor().execute(statement, (dealID, locale, deal, time.time()))
+	c.commit()
+	close(c)
+
+
+def usedsize(c=None):
+	"""Return the bytes taken by a database's data, without its free pages.
+
+	Parameters:
+	c (sqlite3.Connection): connection to a database file
+	"""
+	pagesize, = c.execute("pragma page_size").fetchone()
+	pagecount, = c.execute("pragma page_count").fetchone()
+	freecount, = c.execute("pragma freelist_count").fetchone()
+	return (pagecount - freecount) * pagesize
+
+
+def evictdeals(dbfile=None, maxage=0, maxsize=0):
+	"""Return a list of evicted deals: tuples of deal's name, deal's ID, locale and number of items.
+
+	Deals fetched more than maxage seconds ago are removed. Then, if the database's data take more than maxsize bytes,
+	the least recently used deals are removed, i.e. the ones shown (see touchdeal) or fetched longest ago,
+	until the space taken by their share of all items covers the excess. Space is estimated rather than measured,
+	since removed titles leave entries in the full-text index until it's merged (see compact).
+	A deal's snapshot, staged items and access time go along with its items,
+	and product pages cached before maxage are removed as well.
+	Items stored before 'fetched' was added have no fetch time; they count as the oldest ones.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	maxage (int): seconds after a deal's latest fetch it's kept for, 0 for no limit
+	maxsize (int): bytes the database's data may take, 0 for no limit
+	"""
+	statement = """
+	select psfetcher.deal, psfetcher.dealID, psfetcher.locale, count(id),
+	max(coalesce(max(fetched), 0), coalesce(accessed, 0)), coalesce(max(fetched), 0)
+	from psfetcher left join dealaccess using (dealID, locale, deal)
+	group by psfetcher.dealID, psfetcher.locale, psfetcher.deal
+	order by 5
+	"""
+	where = "where dealID = ? and locale = ? and deal = ?"
+	c = connect(dbfile)
+	deals = c.execute(statement).fetchall()
+	now = time.time()
+	used = usedsize(c)
+	total = sum(deal[3] for deal in deals) or 1
+	excess = used - maxsize if maxsize else 0
+	freed = 0
+	evicted = []
+	for deal, dealID, locale, count, accessed, fetched in deals:
+		expired = maxage and now - fetched > maxage
+		if not expired and freed >= excess:
+			continue
+		freed += used * count / total
+		for table in ("psfetcher", "snapshot", "staging", "dealaccess"):
+			c.cursor().execute("delete from {} {}".format(table, where), (dealID, locale, deal))
+		c.commit()
+		evicted.append((deal, dealID, locale, count))
+	if maxage:
+		c.cursor().execute("delete from productcache where fetched < ?", (now - maxage,))
+		c.commit()
+	close(c)
+	return evicted
+
+
+def compact(dbfile=None):
+	"""Return None. Update the query planner's statistics and give the database's free space back to the system.
+
+	ANALYZE runs, the full-text index is merged, free pages are released by an incremental vacuum
+	and the write-ahead log, if there's one, is checkpointed and truncated.
+	A database created without incremental auto-vacuum is rebuilt once with a full VACUUM to switch it on.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	"""
+	c = connect(dbfile)
+	c.cursor().execute("analyze")
+	statement = "select name from sqlite_master where type = 'table' and name = 'titleindex'"
+	if c.execute(statement).fetchone():
+		c.cursor().execute("insert into titleindex (titleindex) values ('optimize')")
+	c.commit()
+	# 2: incremental
+	autovacuum, = c.execute("pragma auto_vacuum").fetchone()
+	if autovacuum != 2:
+		c.cursor().execute("pragma auto_vacuum = incremental")
+		c.cursor().execute("vacuum")
+	else:
+		# run as a script: a single step of the pragma releases a single page
+		c.executescript("pragma incremental_vacuum")
+	c.execute("pragma wal_checkpoint(truncate)").fetchall()
+	close(c)
 
 
 def cleanup(dbfile=None, deal=None, dealID=None, locale=None):
 	"""Return None. Remove all fetched items of a deal.
 
 	Parameters:
-	dbfile (str): full path to a database file
+	dbfile (str): full path to a database file or MEMORYDB
 	deal (str): deal's name
 	dealID (str): deal's ID
 	locale (str): language and country codes joined with a hyphen
 	"""
-	c = sqlite3.connect(dbfile)
+	c = connect(dbfile)
 	statement = "delete from psfetcher where dealID = ? and locale = ? and deal = ?"
 	c.cursor().execute(statement, (dealID, locale, deal))
 	c.commit()
+	close(c)
+
+
+def leaseowner():
+	"""Return this run's lease owner string: hostname and process ID joined with a colon."""
+	return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def leasealive(owner=None):
+	"""Return False if a lease owner is a process on this host that no longer exists.
+
+	Owners from other hosts are assumed to be alive until their lease expires.
+
+	Parameters:
+	owner (str): owner string returned from leaseowner
+	"""
+	host, _, pid = owner.rpartition(":")
+	if host != socket.gethostname() or not pid.isdigit():
+		return True
+	try:
+		os.kill(int(pid), 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+def acquirelease(dbfile=None, deal=None, dealID=None, locale=None, ttl=LEASE_TTL):
+	"""Return True if this run holds the fetch lease of a deal, False if another run does.
+
+	Expired leases and leases of dead local processes are taken over.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	ttl (int): seconds until the lease expires
+	"""
+	owner = leaseowner()
+	now = time.time()
+	c = sqlite3.connect(dbfile, isolation_level=None, timeout=DB_TIMEOUT)
+	try:
+		# 'begin immediate' serialises competing runs on the write lock
+		c.execute("begin immediate")
+		statement = "select owner, expires from fetchlease where dealID = ? and locale = ? and deal = ?"
+		lease = c.execute(statement, (dealID, locale, deal)).fetchone()
+		if lease and lease[0] != owner and lease[1] > now and leasealive(lease[0]):
+			c.execute("commit")
+			return False
+		statement = """
+		insert or replace into fetchlease
+		(dealID, locale, deal, owner, expires)
+		values (?, ?, ?, ?, ?)
+		"""
+		c.execute(statement, (dealID, locale, deal, owner, now + ttl))
+		c.execute("commit")
+		return True
+	finally:
+		c.close()
+
+
+def renewleases(dbfile=None, leases=None, ttl=LEASE_TTL):
+	"""Return None. Extend this run's fetch leases of deals, so no other run takes over deals still being fetched.
+
+	Leases this run no longer holds are left alone.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	leases (list): tuples of deal's name, deal's ID and locale
+	ttl (int): seconds from now until the leases expire
+	"""
+	if not leases:
+		return None
+	owner = leaseowner()
+	expires = time.time() + ttl
+	c = sqlite3.connect(dbfile, timeout=DB_TIMEOUT)
+	statement = "update fetchlease set expires = ? where dealID = ? and locale = ? and deal = ? and owner = ?"
+	c.cursor().executemany(statement, [(expires, dealID, locale, deal, owner) for deal, dealID, locale in leases])
+	c.commit()
+	c.close()
+
+
+def releaselease(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return None. Remove this run's fetch lease of a deal.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	c = sqlite3.connect(dbfile, timeout=DB_TIMEOUT)
+	statement = "delete from fetchlease where dealID = ? and locale = ? and deal = ? and owner = ?"
+	c.cursor().execute(statement, (dealID, locale, deal, leaseowner()))
+	c.commit()
+	c.close()
+
+
+def leaseheld(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return True if another live run holds an unexpired fetch lease of a deal.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	statement = "select owner, expires from fetchlease where dealID = ? and locale = ? and deal = ?"
+	c = sqlite3.connect(dbfile, timeout=DB_TIMEOUT)
+	lease = c.execute(statement, (dealID, locale, deal)).fetchone()
 	c.close()
+	if not lease or lease[0] == leaseowner():
+		return False
+	return lease[1] > time.time() and leasealive(lease[0])
+
+
+def waitlease(dbfile=None, deal=None, dealID=None, locale=None, poll=LEASE_POLL, timeout=0):
+	"""Return None once no other live run holds an unexpired fetch lease of a deal, or after timeout seconds.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	poll (int): seconds between lease checks
+	timeout (int): seconds to wait at most, e.g. to renew this run's own leases meanwhile; 0 for no limit
+	"""
+	started = time.time()
+	while leaseheld(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale):
+		if timeout and time.time() - started >= timeout:
+			return None
+		time.sleep(poll)
 
 
 def flush(dbfile=None, everything=False):
@@ -55,15 +837,21 @@ def flush(dbfile=None, everything=False):
 	dbfile (str): full path to a database file
 	everything (bool): if True, will also remove all items from the 'watchlist' table.
 	"""
-	c = sqlite3.connect(dbfile)
+	c = connect(dbfile)
 	try:
 		c.cursor().execute("delete from psfetcher")
+		c.cursor().execute("delete from fetchlease")
+		c.cursor().execute("delete from productcache")
+		c.cursor().execute("delete from dealcache")
+		c.cursor().execute("delete from snapshot")
+		c.cursor().execute("delete from staging")
+		c.cursor().execute("delete from dealaccess")
 		if everything:
 			c.cursor().execute("delete from watchlist")
 		c.commit()
 	except sqlite3.OperationalError:
 		pass
-	c.close()
+	close(c)
 
 
 def oldcount(dbfile=None, deal=None, dealID=None, locale=None):
@@ -77,7 +865,7 @@ def oldcount(dbfile=None, deal=None, dealID=None, locale=None):
 	dealID (str): deal's ID
 	locale (str): language and country codes joined with a hyphen
 	"""
-	c = sqlite3.connect(dbfile)
+	c = connect(dbfile, readonly=True)
 	try:
 		statement = "select count(title) from psfetcher where dealID = ? and locale = ? and deal = ?"
 		oldcount, = c.execute(statement, (dealID, locale, deal)).fetchone()
@@ -88,7 +876,75 @@ def oldcount(dbfile=None, deal=None, dealID=None, locale=None):
 		return 0, 0
 	except sqlite3.OperationalError:
 		return 0, 0
-	c.close()
+	finally:
+		close(c)
+
+
+def fetcheddeals(dbfile=None, locale=None):
+	"""Return a list of a store's fetched deals: tuples of deal's name, deal's ID and number of items.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locale (str): language and country codes joined with a hyphen
+	"""
+	statement = """
+	select deal, dealID, count(id) from psfetcher
+	where locale = ? and deal != 'watchlist'
+	group by deal, dealID order by min(id)
+	"""
+	c = connect(dbfile, readonly=True)
+	deals = c.execute(statement, (locale,)).fetchall()
+	close(c)
+	return deals
+
+
+def dealitems(dbfile=None, deal=None, dealID=None, locale=None):
+	"""Return all fetched items of a deal, in the order mainselect returns them unsorted.
+
+	Each item is a tuple of id, title, price, roundprice, discount, type, titleID and platform.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deal (str): deal's name
+	dealID (str): deal's ID
+	locale (str): language and country codes joined with a hyphen
+	"""
+	statement = """
+	select id, title, price, roundprice, discount, type, titleID, platform from psfetcher
+	where dealID = ? and locale = ? and deal = ?
+	order by id
+	"""
+	c = connect(dbfile, readonly=True)
+	items = c.execute(statement, (dealID, locale, deal)).fetchall()
+	close(c)
+	return items
+
+
+def filtermessages(minprice=0, maxprice=0, sortingList=None, reverseResults=False, contentTypes=None):
+	"""Return a list of messages of applied sorting, price range and content filters, in that order.
+
+	Parameters:
+	minpirce (int): title's minimum price
+	maxprice (int): title's maximum price
+	sortingList (list): a list of user-applied sorting
+	reverseResults (bool): if True, the order of user-applied sorting is reversed
+	contentTypes (list): a list of user-picked content types
+	"""
+	contentMes = priceRangeMes = sortMes = ""
+
+	if minprice != MINPRICE:
+		priceRangeMes += "from {} ".format(minprice)
+	if maxprice != MAXPRICE:
+		priceRangeMes += "under {}".format(maxprice)
+	if priceRangeMes:
+		priceRangeMes = "price range: " + priceRangeMes
+	if contentTypes:
+		contentMes = "content: {}".format(", ".join(contentTypes))
+	if sortingList:
+		sortMes = "sorted by {}".format(" then by ".join(unique_everseen(sortingList)))
+		if reverseResults:
+			sortMes += " in reverse"
+	return [m for m in (sortMes, priceRangeMes, contentMes) if m]
 
 
 def mainselect(
@@ -101,7 +957,7 @@ def mainselect(
 	In case of a TypeError, return None, 0, 0, None.
 
 	Parameters:
-	dbfile (str): full path to a database file
+	dbfile (str): full path to a database file or MEMORYDB
 	deal (str): deal's name
 	dealID (str): deal's ID
 	locale (str): language and country codes joined with a hyphen
@@ -114,21 +970,12 @@ def mainselect(
 	allcontent (dict): second dict, allcontent, returned from psconfig.getConf
 	contentTypes (list): a list of user-picked content types
 	"""
-	# messages for applied filters
-	contentMes = priceRangeMes = sortMes = ""
-
-	if minprice != MINPRICE:
-		priceRangeMes += "from {} ".format(minprice)
-	if maxprice != MAXPRICE:
-		priceRangeMes += "under {}".format(maxprice)
-	if priceRangeMes:
-		priceRangeMes = "price range: " + priceRangeMes
-
 	select = """
 	select title, price, discount, titleID, id, platform from psfetcher
-	where roundprice between {} and {}
-	and dealID = '{}' and locale = '{}' and deal = '{}'
-	""".format(minprice, maxprice, dealID, locale, deal)
+	where roundprice between ? and ?
+	and dealID = ? and locale = ? and deal = ?
+	"""
+	parameters = [minprice, maxprice, dealID, locale, deal]
 
 	if contentTypes:
 		ctypes = []
@@ -137,7 +984,7 @@ def mainselect(
 		placeholders = "?" * len(ctypes)
 		placeholders = ",".join(placeholders)
 		select += " and psfetcher.type in ({})".format(placeholders)
-		contentMes = "content: {}".format(", ".join(contentTypes))
+		parameters += ctypes
 
 	if sortingList:
 		sortingList = list(unique_everseen(sortingList))
@@ -145,12 +992,9 @@ def mainselect(
 		order = {False: " asc", True: " desc"}
 		order = order[reverseResults]
 		select += " order by " + "{}, ".format(order).join(sortingListSQL) + order
-		sortMes = "sorted by {}".format(" then by ".join(sortingList))
-		if reverseResults:
-			sortMes += " in reverse"
 
+	c = connect(dbfile, readonly=True)
 	try:
-		c = sqlite3.connect(dbfile)
 		titleSelect = """
 		select length(title) from psfetcher
 		where dealID = ? and locale = ? and deal = ?
@@ -166,11 +1010,7 @@ def mainselect(
 		maxPriceLen, = c.execute(priceSelect, (dealID, locale, deal)).fetchone()
 
 		itemlist = []
-		if contentTypes:
-			select = c.cursor().execute(select, ctypes)
-		else:
-			select = c.cursor().execute(select)
-		for title, price, discount, titleID, ind, platform in select.fetchall():
+		for title, price, discount, titleID, ind, platform in c.execute(select, parameters).fetchall():
 			rawdata = {}
 			rawdata["title"] = title
 			rawdata["price"] = price
@@ -179,13 +1019,180 @@ def mainselect(
 			rawdata["id"] = ind
 			rawdata["platform"] = platform
 			itemlist.append(rawdata)
-		c.close()
 
 		filterMessage = "{} titles".format(len(itemlist))
-		messages = [m for m in (sortMes, priceRangeMes, contentMes) if m]
+		messages = filtermessages(
+			minprice=minprice, maxprice=maxprice, sortingList=sortingList,
+			reverseResults=reverseResults, contentTypes=contentTypes
+		)
 		for message in messages:
 			filterMessage += " | {}".format(message)
 		return itemlist, maxTitleLen, maxPriceLen, filterMessage
 
 	except TypeError:
 		return None, 0, 0, None
+	finally:
+		# the read-only connection goes back to the pool on every path
+		close(c)
+
+
+def comparestores(
+	dbfile=None, deals=None, minprice=0, maxprice=0,
+	allcontent=None, contentTypes=None
+):
+	"""Return a list of titles (dicts) found in more than one store with the same currency, each with its cheapest store.
+
+	Titles are matched by their ID, so only stores sharing title IDs (usually a region) are compared.
+	Prices are only compared between stores of the same currency (see CURRENCIES) showing the same symbol
+	(see psprice.currency), so a title is listed once per currency, sorted by currency and then by title.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	deals (list): tuples of deal's name, deal's ID and locale
+	minpirce (int): title's minimum price
+	maxprice (int): title's maximum price
+	allcontent (dict): second dict, allcontent, returned from psconfig.getConf
+	contentTypes (list): a list of user-picked content types
+	"""
+	values = ", ".join(["(?, ?, ?)"] * len(deals))
+	parameters = [value for deal in deals for value in deal]
+	parameters += [minprice, maxprice]
+	where = """
+	where (deal, dealID, locale) in (values {})
+	and roundprice between ? and ?
+	""".format(values)
+
+	if contentTypes:
+		ctypes = set()
+		for lang in set(deal[2].split("-")[0] for deal in deals):
+			for ctype in contentTypes:
+				ctypes.update(allcontent[lang][ctype])
+		where += " and type in ({})".format(",".join("?" * len(ctypes)))
+		parameters += list(ctypes)
+
+	# a title can be a part of more than one deal of the same store
+	select = """
+	select distinct titleID, title, price, roundprice, locale from psfetcher {}
+	order by locale
+	""".format(where)
+
+	c = connect(dbfile, readonly=True)
+	rows = c.execute(select, parameters).fetchall()
+	close(c)
+	titles = {}
+	for titleID, title, price, roundprice, locale in rows:
+		symbol = psprice.currency(price)
+		if symbol is None:
+			continue
+		currency = CURRENCIES.get(locale.split("-")[1], symbol)
+		titles.setdefault((titleID, currency, symbol), []).append((roundprice, locale, title, price))
+
+	itemlist = []
+	for (titleID, currency, symbol), prices in titles.items():
+		if len(set(locale for roundprice, locale, title, price in prices)) < 2:
+			continue
+		roundprice, locale, title, price = min(prices)
+		rawdata = {}
+		rawdata["titleID"] = titleID
+		rawdata["title"] = title
+		rawdata["price"] = price
+		rawdata["store"] = locale
+		rawdata["currency"] = "{} ({})".format(currency, symbol)
+		if currency == symbol:
+			rawdata["currency"] = currency
+		rawdata["prices"] = ", ".join("{} {}".format(price[1], price[3]) for price in prices)
+		itemlist.append(rawdata)
+	itemlist.sort(key=lambda item: (item["currency"], item["title"]))
+	return itemlist
+
+
+def changeselect(
+	dbfile=None, deal=None, dealID=None, locale=None,
+	lang=None, country=None, minprice=0, maxprice=0,
+	sortingList=None, reverseResults=False, allcontent=None, contentTypes=None
+):
+	"""Return a deal's changes since its snapshot like mainselect returns items, and the snapshot's fetch time.
+
+	Items are compared by their title ID. A new title is marked with '+', a removed one with '-',
+	and a title whose price or discount changed with '~', along with its previous value.
+	Filters apply to the current values of new and changed titles, and to the last values of removed ones.
+	Without sorting, new titles come first, then changed ones, then removed ones.
+	If the deal has no snapshot, return None, 0, 0, None, None.
+
+	Parameters:
+	the same as mainselect's
+	"""
+	where = "where dealID = ? and locale = ? and deal = ?"
+	c = connect(dbfile, readonly=True)
+	previous, = c.execute("select max(fetched) from snapshot {}".format(where), (dealID, locale, deal)).fetchone()
+	if previous is None:
+		close(c)
+		return None, 0, 0, None, None
+
+	# one row per title of both fetches, compared as sets
+	items = "select titleID, title, price, discount, roundprice, type, platform from {} " + where + " group by titleID"
+	select = """
+	with current as ({current}), previous as ({previous})
+	select * from (
+		select 'new' as change, current.*, null as oldprice, null as olddiscount from current
+		where titleID not in (select titleID from previous)
+		union all
+		select 'changed', current.*, previous.price, previous.discount
+		from current join previous using (titleID)
+		where current.price != previous.price or current.discount != previous.discount
+		union all
+		select 'removed', previous.*, null, null from previous
+		where titleID not in (select titleID from current)
+	)
+	where roundprice between ? and ?
+	""".format(current=items.format("psfetcher"), previous=items.format("snapshot"))
+	parameters = [dealID, locale, deal, dealID, locale, deal, minprice, maxprice]
+
+	if contentTypes:
+		ctypes = []
+		for ctype in contentTypes:
+			ctypes += allcontent[lang][ctype]
+		select += " and type in ({})".format(",".join("?" * len(ctypes)))
+		parameters += ctypes
+
+	if sortingList:
+		sortingList = list(unique_everseen(sortingList))
+		sortingListSQL = ["roundprice" if i == "price" else i for i in sortingList]
+		order = {False: " asc", True: " desc"}
+		order = order[reverseResults]
+		select += " order by " + "{}, ".format(order).join(sortingListSQL) + order
+	else:
+		select += " order by case change when 'new' then 0 when 'changed' then 1 else 2 end, title"
+
+	marks = {"new": "+", "changed": "~", "removed": "-"}
+	itemlist = []
+	changes = {"new": 0, "changed": 0, "removed": 0}
+	rows = c.execute(select, parameters).fetchall()
+	close(c)
+	for change, titleID, title, price, discount, roundprice, ctype, platform, oldprice, olddiscount in rows:
+		changes[change] += 1
+		if oldprice is not None and oldprice != price:
+			price = "{} (was {})".format(price, oldprice)
+		if olddiscount is not None and olddiscount != discount:
+			discount = "{} (was {})".format(discount, olddiscount)
+		rawdata = {}
+		rawdata["title"] = "{} {}".format(marks[change], title)
+		rawdata["price"] = price
+		rawdata["discount"] = discount
+		rawdata["titleID"] = titleID
+		rawdata["platform"] = platform
+		rawdata["change"] = change
+		itemlist.append(rawdata)
+
+	maxTitleLen = max([len(item["title"]) for item in itemlist] or [0])
+	maxPriceLen = max([len(item["price"]) for item in itemlist] or [0])
+	filterMessage = "{} changes: {} new, {} changed, {} removed".format(
+		len(itemlist), changes["new"], changes["changed"], changes["removed"]
+	)
+	messages = filtermessages(
+		minprice=minprice, maxprice=maxprice, sortingList=sortingList,
+		reverseResults=reverseResults, contentTypes=contentTypes
+	)
+	for message in messages:
+		filterMessage += " | {}".format(message)
+	return itemlist, maxTitleLen, maxPriceLen, filterMessage, previous
@@ -0,0 +1,151 @@
+import sys
+import time
+
+from modules.globals import STREAM_TITLE_WIDTH
+
+
+class Stream:
+	"""Items of deals being fetched, printed and saved page by page, as soon as each page is stored (--stream).
+
+	Items are filtered by price and content like in pssql.mainselect, but shown in the order pages arrive.
+	Columns start STREAM_TITLE_WIDTH and len("Price") wide and grow with longer titles and prices,
+	so lines already shown are never reprinted. A progress line with pages/s and ETA is kept on stderr.
+	"""
+
+	def __init__(self, pages=0, minprice=0, maxprice=0, table=False, printing=True, dealWidth=0):
+		"""Parameters:
+		pages (int): number of pages to be fetched
+		minpirce (int): title's minimum price
+		maxprice (int): title's maximum price
+		table (bool): if True, will print and save table-like results
+		printing (bool): if False, items are only saved
+		dealWidth (int): width of a leading column of deals' names in printed results, none if 0
+		"""
+		self.pages = pages
+		self.minprice = minprice
+		self.maxprice = maxprice
+		self.table = table
+		self.printing = printing
+		self.dealWidth = dealWidth
+		self.tlen = STREAM_TITLE_WIDTH
+		self.plen = len("Price")
+		self.dlen = len("Discount")
+		self.done = 0
+		self.started = time.time()
+		self.headerShown = False
+		self.files = {}
+
+	def header(self, dealColumn=False):
+		"""Return a header line of the current column widths."""
+		header = "{} | {} | {} | {}".format(
+			"Title".ljust(self.tlen), "Price".ljust(self.plen), "Discount", "Platform"
+		)
+		if dealColumn:
+			header = "{} | {}".format("Deal".ljust(self.dealWidth), header)
+		return header
+
+	def line(self, row, dealColumn=False):
+		"""Return a row for pssql.insertitems as a line of results."""
+		titleID, title, price, roundprice, discount, ctype, deal, pagenumber, dealID, locale, platform = row
+		line = "{} | {} | {} | {}".format(
+			title.ljust(self.tlen), price.ljust(self.plen), str(discount).ljust(self.dlen), str(platform)
+		)
+		if dealColumn:
+			line = "{} | {}".format(deal.ljust(self.dealWidth), line)
+		return line
+
+	def openfile(self, key=None, filename=None, message=None):
+		"""Return None. Save a deal's streamed items to a text file, like pswrite.writetext.
+
+		Lines are written as pages arrive; closefile rewrites the file with the final column widths.
+
+		Parameters:
+		key: deal's key passed to add
+		filename (str): save output to 'filename'
+		message (str): first line of the file
+		"""
+		output = open(filename, "w")
+		output.write("{}\n".format(message))
+		output.write(self.header() + "\n")
+		self.files[key] = (filename, message, output, [])
+
+	def writelines(self, output=None, rows=None):
+		"""Return None. Write rows as lines of results to an open text file."""
+		for row in rows:
+			if self.table:
+				output.write("-" * len(self.header()) + "\n")
+			output.write(self.line(row) + "\n")
+
+	def closefile(self, key=None):
+		"""Return filename of a deal's text file, or None if it isn't saved.
+
+		Columns widened by later pages would leave earlier lines and the header misaligned,
+		so the file is written anew with the final widths.
+		"""
+		if key not in self.files:
+			return None
+		filename, message, output, rows = self.files.pop(key)
+		output.close()
+		with open(filename, "w") as output:
+			output.write("{}\n".format(message))
+			output.write(self.header() + "\n")
+			self.writelines(output=output, rows=rows)
+		return filename
+
+	def add(self, key=None, rows=None, ctypes=None):
+		"""Return None. Print and save a stored page's items, then update the progress line.
+
+		Parameters:
+		key: deal's key, the same one passed to openfile
+		rows (list): rows for pssql.insertitems
+		ctypes (set): content types' names in the deal's language, all types if None
+		"""
+		rows = [
+			row for row in rows
+			if row[3] is not None and self.minprice <= row[3] <= self.maxprice
+			and (ctypes is None or row[5] in ctypes)
+		]
+		for row in rows:
+			self.tlen = max(self.tlen, len(row[1]))
+			self.plen = max(self.plen, len(row[2]))
+		if rows and self.printing:
+			self.clearprogress()
+			dealColumn = self.dealWidth > 0
+			if not self.headerShown:
+				print(self.header(dealColumn))
+				self.headerShown = True
+			for row in rows:
+				if self.table:
+					print("-" * len(self.header(dealColumn)))
+				print(self.line(row, dealColumn))
+			sys.stdout.flush()
+		if rows and key in self.files:
+			output, saved = self.files[key][2:]
+			saved.extend(rows)
+			self.writelines(output=output, rows=rows)
+			output.flush()
+		self.done += 1
+		self.progress()
+
+	def progress(self):
+		"""Return None. Write the number of stored pages, pages/s and the time left to stderr."""
+		elapsed = time.time() - self.started
+		rate = self.done / elapsed if elapsed else 0
+		eta = "?"
+		if rate:
+			eta = "{:.0f} s".format((self.pages - self.done) / rate)
+		sys.stderr.write("\033[K" + "pages {}/{} | {:.1f} pages/s | ETA {}".format(
+			self.done, self.pages, rate, eta
+		) + "\r")
+		sys.stderr.flush()
+
+	def clearprogress(self):
+		"""Return None. Clear the progress line, e.g. before results are printed over it."""
+		sys.stderr.write("\033[K")
+		sys.stderr.flush()
+
+	def close(self):
+		"""Return None. Close all text files and clear the progress line."""
+		for key in list(self.files):
+			self.closefile(key)
+		self.clearprogress()
@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import types
+
+# set by enable before any worker process is started, so workers inherit it
+enabled = False
+profiling = False
+events = []
+profiles = []
+# counters are recorded even if spans aren't: {(name, ((label, value), ...)): value}
+counts = {}
+gauges = {}
+# counters are added to by download threads concurrently
+countsLock = threading.Lock()
+# process that recorded the above; a forked worker starts over instead of sending its parent's records back
+owner = os.getpid()
+
+
+def enable(profile=False):
+	"""Return None. Start recording spans and, if profile is True, cProfile statistics.
+
+	Parameters:
+	profile (bool): if True, parse workers and the main thread are profiled with cProfile
+	"""
+	global enabled, profiling
+	enabled = True
+	profiling = profile
+
+
+def ownprocess():
+	"""Return None. Forget records inherited from a parent process, once per process."""
+	global owner
+	if owner != os.getpid():
+		owner = os.getpid()
+		del events[:]
+		del profiles[:]
+		counts.clear()
+		gauges.clear()
+
+
+def count(name, value=1, **labels):
+	"""Return None. Add value to a counter.
+
+	Parameters:
+	name (str): counter's name, e.g. "requests"
+	value (int): number added to the counter
+	labels: counter's labels, e.g. status="200"
+	"""
+	ownprocess()
+	key = (name, tuple(sorted(labels.items())))
+	with countsLock:
+		counts[key] = counts.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+	"""Return None. Set a gauge's value; recorded in the main process only.
+
+	Parameters:
+	name (str): gauge's name, e.g. "deal_duration_seconds"
+	value (float): gauge's value
+	labels: gauge's labels
+	"""
+	gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+@contextmanager
+def span(stage, **fields):
+	"""Record a span of a stage with its start, duration, process and thread.
+
+	Yields a dict of the span's fields; values added to it are recorded with the span,
+	e.g. trace["bytes"] = len(content).
+
+	Parameters:
+	stage (str): stage's name, e.g. "download"
+	fields: extra fields recorded with the span
+	"""
+	if not enabled:
+		yield fields
+		return
+	ownprocess()
+	start = time.time()
+	clock = time.perf_counter()
+	try:
+		yield fields
+	finally:
+		fields.update({
+			"stage": stage, "start": start, "duration": time.perf_counter() - clock,
+			"pid": os.getpid(), "tid": threading.get_ident()
+		})
+		events.append(fields)
+
+
+def traced(stage):
+	"""Return a decorator recording a span of stage for each call; a returned list's length is recorded as rows."""
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with span(stage) as trace:
+				result = func(*args, **kwargs)
+				if isinstance(result, list):
+					trace["rows"] = len(result)
+			return result
+		return wrapper
+	return decorator
+
+
+@contextmanager
+def profiler():
+	"""Profile the block with cProfile if profiling is enabled; its statistics are kept until drain."""
+	if not profiling:
+		yield
+		return
+	prof = cProfile.Profile()
+	prof.enable()
+	try:
+		yield
+	finally:
+		prof.disable()
+		ownprocess()
+		prof.create_stats()
+		profiles.append(prof.stats)
+
+
+def drain():
+	"""Return a dict of spans and cProfile statistics recorded so far in this process, and forget them.
+
+	Used by worker processes to send their trace along with their results (see merge).
+	"""
+	ownprocess()
+	with countsLock:
+		trace = {"events": events[:], "profiles": profiles[:], "counts": dict(counts)}
+		counts.clear()
+	del events[:]
+	del profiles[:]
+	return trace
+
+
+def merge(trace):
+	"""Return None. Add a worker's trace returned by drain to this process' trace."""
+	events.extend(trace["events"])
+	profiles.extend(trace["profiles"])
+	with countsLock:
+		for key, value in trace["counts"].items():
+			counts[key] = counts.get(key, 0) + value
+
+
+def tracedcall(func, *args, **kwargs):
+	"""Return func's result and the trace recorded meanwhile (see drain). Run in worker processes.
+
+	Pool functions are wrapped with it, e.g. p.imap(partial(tracedcall, func), jobs),
+	and their results unwrapped with collect.
+	"""
+	with profiler():
+		result = func(*args, **kwargs)
+	return result, drain()
+
+
+def collect(item):
+	"""Return the result of a tracedcall and merge its trace into this process' trace."""
+	result, trace = item
+	merge(trace)
+	return result
+
+
+def percentile(values, p):
+	"""Return the nearest-rank p-th percentile of sorted values."""
+	if not values:
+		return 0
+	rank = max(1, -(-len(values) * p // 100))
+	return values[int(rank) - 1]
+
+
+def summary():
+	"""Return a dict of per-stage count, total, p50, p95, p99 durations (s), bytes and rows."""
+	stages = {}
+	for event in events:
+		stages.setdefault(event["stage"], []).append(event)
+	result = {}
+	for stage, stageEvents in stages.items():
+		durations = sorted(event["duration"] for event in stageEvents)
+		result[stage] = {
+			"count": len(durations), "total": sum(durations),
+			"p50": percentile(durations, 50), "p95": percentile(durations, 95), "p99": percentile(durations, 99),
+			"bytes": sum(event.get("bytes", 0) for event in stageEvents),
+			"rows": sum(event.get("rows", 0) for event in stageEvents),
+		}
+	return result
+
+
+def report(filename=None, file=sys.stderr, top=10):
+	"""Return a list of saved files' names. Save the trace and print a per-stage summary.
+
+	The trace is saved in Chrome's trace event format (chrome://tracing, Perfetto) with the summary added.
+	If profiling is enabled, merged cProfile statistics of all processes are saved as well
+	and their top functions are printed.
+
+	Parameters:
+	filename (str): trace file's name, without an extension
+	file (file): stream to print the summary to
+	top (int): number of profiled functions printed
+	"""
+	stages = summary()
+	traceEvents = []
+	for event in events:
+		args = {key: value for key, value in event.items() if key not in ("stage", "start", "duration", "pid", "tid")}
+		traceEvents.append({
+			"name": event["stage"], "ph": "X", "ts": event["start"] * 1e6, "dur": event["duration"] * 1e6,
+			"pid": event["pid"], "tid": event["tid"], "args": args
+		})
+	saved = [filename + ".trace.json"]
+	with open(saved[0], "w") as output:
+		json.dump({"traceEvents": traceEvents, "summary": stages}, output)
+
+	print("stage      | count | total s |  p50 ms |  p95 ms |  p99 ms |    bytes |  rows", file=file)
+	ranked = sorted(stages.items(), key=lambda stage: stage[1]["total"], reverse=True)
+	for stage, stats in ranked:
+		print("{:<10} | {:>5} | {:>7.2f} | {:>7.1f} | {:>7.1f} | {:>7.1f} | {:>8} | {:>5}".format(
+			stage, stats["count"], stats["total"], stats["p50"] * 1000,
+			stats["p95"] * 1000, stats["p99"] * 1000, stats["bytes"], stats["rows"]
+		), file=file)
+	if ranked:
+		print("hottest stage: {}".format(ranked[0][0]), file=file)
+
+	if profiling and profiles:
+		merged = None
+		for stats in profiles:
+			# pstats takes anything with stats and create_stats, like a cProfile.Profile
+			profile = types.SimpleNamespace(stats=stats, create_stats=lambda: None)
+			if merged is None:
+				merged = pstats.Stats(profile, stream=file)
+			else:
+				merged.add(profile)
+		saved.append(filename + ".prof")
+		merged.dump_stats(saved[1])
+		merged.sort_stats("tottime").print_stats(top)
+	return saved
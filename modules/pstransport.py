@@ -0,0 +1,120 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+# set by enable (--record, --replay), inherited by worker processes through the environment
+RECORD_DIR = "PSFETCHER_RECORD"
+REPLAY_DIR = "PSFETCHER_REPLAY"
+REPLAY_LATENCY = "PSFETCHER_REPLAY_LATENCY"
+MANIFEST = "manifest.jsonl"
+
+# replayed manifests by directory: {url: entry}
+manifests = {}
+
+
+class NotRecordedError(LookupError):
+	"""A replayed URL that isn't in the recording."""
+
+
+def enable(record=None, replay=None, latency=0):
+	"""Return None. Record responses to a directory, or replay them from one.
+
+	Parameters:
+	record (str): directory responses are recorded to
+	replay (str): directory responses are replayed from
+	latency (float): seconds each replayed response is delayed by
+	"""
+	if record:
+		os.environ[RECORD_DIR] = os.path.abspath(record)
+	if replay:
+		os.environ[REPLAY_DIR] = os.path.abspath(replay)
+		os.environ[REPLAY_LATENCY] = str(latency or 0)
+
+
+def objectpath(directory, digest):
+	"""Return the path of a recorded response body by its SHA-256 digest."""
+	return os.path.join(directory, "objects", digest[:2], digest + ".gz")
+
+
+def record(directory, url, res):
+	"""Return None. Save a response's body, compressed and named by its digest, and add it to the manifest.
+
+	Bodies are stored once no matter how many URLs returned them.
+
+	Parameters:
+	directory (str): recording's directory
+	url (str): requested URL
+	res (requests.Response): response
+	"""
+	digest = hashlib.sha256(res.content).hexdigest()
+	path = objectpath(directory, digest)
+	if not os.path.isfile(path):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		# written under a process' own name first, so a concurrent writer never leaves a partial object
+		tmppath = "{}.{}.tmp".format(path, os.getpid())
+		with gzip.open(tmppath, "wb") as body:
+			body.write(res.content)
+		os.replace(tmppath, path)
+	entry = {
+		"url": url, "status": res.status_code, "sha256": digest, "bytes": len(res.content),
+		"encoding": res.encoding, "elapsed": res.elapsed.total_seconds(), "time": time.time()
+	}
+	# a single short append is atomic, so processes can share the manifest
+	with open(os.path.join(directory, MANIFEST), "a") as manifest:
+		manifest.write(json.dumps(entry) + "\n")
+
+
+def manifest(directory):
+	"""Return a dict of a recording's latest entry per URL."""
+	if directory not in manifests:
+		entries = {}
+		with open(os.path.join(directory, MANIFEST)) as lines:
+			for line in lines:
+				if line.strip():
+					entry = json.loads(line)
+					entries[entry["url"]] = entry
+		manifests[directory] = entries
+	return manifests[directory]
+
+
+def replay(directory, url, latency=0):
+	"""Return a recorded response for a URL.
+
+	Raise NotRecordedError if the URL isn't recorded.
+
+	Parameters:
+	directory (str): recording's directory
+	url (str): requested URL
+	latency (float): seconds the response is delayed by
+	"""
+	entry = manifest(directory).get(url)
+	if not entry:
+		raise NotRecordedError("{} is not recorded in {}".format(url, directory))
+	if latency:
+		time.sleep(latency)
+	with gzip.open(objectpath(directory, entry["sha256"]), "rb") as body:
+		content = body.read()
+	res = requests.Response()
+	res._content = content
+	res.status_code = entry["status"]
+	res.encoding = entry["encoding"]
+	res.url = url
+	res.elapsed = datetime.timedelta(seconds=latency)
+	return res
+
+
+def get(url):
+	"""Return a response for a URL: fetched, fetched and recorded, or replayed (see enable)."""
+	replayDir = os.environ.get(REPLAY_DIR)
+	if replayDir:
+		return replay(replayDir, url, latency=float(os.environ.get(REPLAY_LATENCY) or 0))
+	res = requests.get(url)
+	recordDir = os.environ.get(RECORD_DIR)
+	if recordDir:
+		record(recordDir, url, res)
+	return res
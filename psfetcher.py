@@ -1,26 +1,55 @@
+from functools import partial
 from itertools import repeat
+from multiprocessing.pool import ThreadPool
 import bs4
-import json
 import multiprocessing
+import os
 import re
 import requests
-import sqlite3
+import subprocess
 import sys
+import time
 
-from modules import psconfig, psinfo, psparse, pssql
-from modules.globals import DBFILE
+from modules import psarchive, psconfig, psextract, psinfo, psmetrics, psparse, psprice, pspipeline, psshell, pssql
+from modules import psstream, pstrace, pstransport, pswrite
+from modules.globals import ARCHIVEFILE, DBFILE, MEMORYDB, SEARCH_PROCESSES, PRODUCT_CACHE_TTL, SELECTIVE_JSON, PIPELINE_THREADS
+from modules.globals import FETCH_RETRIES, FETCH_RETRY_DELAY, STORE_URL, CURRENCIES, LEASE_RENEW
 
 
-def webparser(url):
-	"""Return a BeautifulSoup soup object for a given URL.
+def webtext(url):
+	"""Return the text of a page for a given URL.
 
-	A Playstation Store base URL is added to the passed URL if it's local.
+	A Playstation Store base URL (STORE_URL) is added to the passed URL if it's local.
 	"""
-	if not url.startswith("https"):
-		url = "https://store.playstation.com" + url
-	res = requests.get(url)
+	if not url.startswith("http"):
+		url = STORE_URL + url
+	# connection errors, throttling and server errors are retried after a growing delay
+	for attempt in range(FETCH_RETRIES + 1):
+		if attempt:
+			pstrace.count("retries")
+			time.sleep(FETCH_RETRY_DELAY * attempt)
+		try:
+			with pstrace.span("download", url=url) as trace:
+				res = pstransport.get(url)
+				# time until the response's headers: connection, TLS and the server's response time
+				trace["headers"] = res.elapsed.total_seconds()
+				trace["status"] = res.status_code
+				trace["bytes"] = len(res.content)
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+			pstrace.count("requests", status="error")
+			if attempt == FETCH_RETRIES:
+				raise
+			continue
+		pstrace.count("requests", status=str(res.status_code))
+		if res.status_code != 429 and res.status_code < 500:
+			break
 	assert res.status_code == 200, "can't reach {}".format(url)
-	soup = bs4.BeautifulSoup(res.text, "lxml")
+	return res.text
+
+
+def webparser(url):
+	"""Return a BeautifulSoup soup object for a given URL (see webtext)."""
+	soup = bs4.BeautifulSoup(webtext(url), "lxml")
 	return soup
 
 
@@ -47,13 +76,14 @@ def choiceCheck(maxval, attempt=1, inputMessage="enter deal's index: "):
 	return choices
 
 
-def getdeals(lang, country, fetchall=False):
+def finddeals(lang, country):
 	"""Return a list of tuples. Each tuple consists of a deal name and its local URL.
 
+	Lists all current deals of a store. Pages of deals placed within other deals are fetched concurrently.
+
 	Parameters:
 	lang (str): 2-letter language code
 	country (str): 2-letter country code
-	fetchall (bool): if True, will get all current deals instead of chosen ones
 	"""
 
 	def footerDeal(name=None, soup=None):
@@ -77,7 +107,7 @@ def getdeals(lang, country, fetchall=False):
 
 		return name, None
 
-	mainpage = "https://store.playstation.com/{}-{}/deals".format(lang, country)
+	mainpage = "{}/{}-{}/deals".format(STORE_URL, lang, country)
 	soup = webparser(mainpage)
 	storeDeals = soup.select("div .ems-sdk-collection")[0]
 	deals = []
@@ -86,16 +116,52 @@ def getdeals(lang, country, fetchall=False):
 			name = deal.img.get("alt").replace("[PROMO] ", "").lower()
 			url = deal.a.get("href").strip("1")
 			name, placement = sanitiseDeal(name=name, url=url)
-			if placement == "footer":
-				name, url = footerDeal(name=name, soup=webparser(url))
 			if name:
-				deals.extend([(name, url)])
+				deals.append([name, url, placement])
+
+	nestedDeals = [deal for deal in deals if deal[2] == "footer"]
+	if nestedDeals:
+		p = ThreadPool(processes=len(nestedDeals))
+		soups = p.map(webparser, [deal[1] for deal in nestedDeals])
+		p.close()
+		p.join()
+		for deal, nestedSoup in zip(nestedDeals, soups):
+			deal[0], deal[1] = footerDeal(name=deal[0], soup=nestedSoup)
+	deals = [(name, url) for name, url, placement in deals]
 
 	# "all deals" deal
 	name, url = footerDeal(soup=soup)
 	deals.extend([(name, url)])
+	return deals
+
+
+def getdeals(lang, country, fetchall=False, pick=None, dbfile=None, maxage=0):
+	"""Return a list of tuples. Each tuple consists of a deal name and its local URL.
+
+	Parameters:
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	fetchall (bool): if True, will get all current deals instead of chosen ones
+	pick (list): deals chosen in another store, matched by their ID or name, without a prompt
+	dbfile (str): full path to a database file caching the list of deals
+	maxage (int): maximum age of the cached list of deals in minutes, 0 to list deals anew
+	"""
+	locale = "{}-{}".format(lang, country)
+	deals = []
+	if dbfile and maxage:
+		deals = pssql.cacheddeals(dbfile=dbfile, locale=locale, maxage=maxage * 60)
+		pstrace.count("cache_requests", cache="deallist", result="hit" if deals else "miss")
+	if not deals:
+		deals = finddeals(lang, country)
+		if dbfile:
+			pssql.cachedeals(dbfile=dbfile, locale=locale, deals=deals)
 
 	if deals:
+		if pick:
+			pickIDs = [url.split("/")[-2] for name, url in pick]
+			pickNames = [name for name, url in pick]
+			deals = [d for d in deals if d[1].split("/")[-2] in pickIDs or d[0] in pickNames]
+			return deals
 		if fetchall:
 			print("fetching all deals:")
 			[print(" *", i[0]) for i in deals]
@@ -115,9 +181,8 @@ def itercount(dealurl):
 	dealurl (str): deal's local URL
 	"""
 	try:
-		soup = webparser(dealurl + str(1))
 		totalCountReg = re.compile(r"(\"totalCount\"):(\d+),(\"offset\"):(\d+),(\"size\"):(\d+)")
-		regResults = totalCountReg.search(soup.prettify())
+		regResults = totalCountReg.search(webtext(dealurl + str(1)))
 		totalCount = int(regResults.group(2))
 		pageSize = int(regResults.group(6))
 		if totalCount <= pageSize:
@@ -130,63 +195,34 @@ def itercount(dealurl):
 		return None, None, None
 
 
-def itemPrice(dbfile=None, titleID=None, locale=None, deal=None, dealID=None):
-	"""Return None. Fetch and write results to a SQL database.
+def itemPrice(titleID=None, locale=None, deal=None, dealID=None):
+	"""Return a row for pssql.insertitems.
 
 	Fetches a single item's information by its ID.
 
 	Parameters:
-	dbfile (str): full path to a database file
 	titleID (str): title's ID from PS Store
 	locale (str): language and country codes joined with a hyphen
 	deal (str): deal's name
 	dealID (str): deal's ID
 	"""
-	url = "https://store.playstation.com/{}/product/{}".format(locale, titleID)
-	soup = webparser(url)
-	rawdata = soup.select("script", id="mfe-jsonld-tags", type="application/ld+json")
-	jsonData = json.loads(rawdata[11].string)["cache"]
-	jsonKeys = list(jsonData.keys())
-	matchIDReg = re.compile(r"GameCTA\S+{}".format(titleID))
-	matchID = matchIDReg.search(" ".join(jsonKeys)).group(0)
-	titleStoreID = [k for k in jsonKeys if matchID in k][0]
-	priceJson = jsonData[titleStoreID]["price"]
-	try:
-		noCurrencyReg = re.compile(r"[0-9,.\s]+")
-		price = noCurrencyReg.search(priceJson["discountedPrice"]).group()
-		price = price.translate(str.maketrans({" ": None, ",": "."}))
-		decSepPosition = price.find(".") + 1
-		if len(price[decSepPosition:]) >= 3:
-			price = price.replace(".", "")
-	except (AttributeError, TypeError):
-		price = 0.1
-
-	platformKey = "Product:{}".format(titleID)
-	platform = json.loads(rawdata[10].string)["cache"][platformKey]["platforms"]
+	url = "{}/{}/product/{}".format(STORE_URL, locale, titleID)
+	html = webtext(url)
+	with pstrace.span("product"):
+		title, category, platform, priceJson = psextract.productinfo(html=html, titleID=titleID)
+	roundPrice, = psprice.roundprices([priceJson["discountedPrice"]])
+
 	platform = ", ".join(platform)
 	if "PS" not in platform:
 		platform = "PS*"
 
-	roundPrice = round(float(price), 2)
 	price = str(priceJson["discountedPrice"])
 	discount = priceJson["discountText"]
-	category = json.loads(rawdata[8].string)["category"]
-	title = json.loads(rawdata[8].string)["name"]
-
-	connection = sqlite3.connect(dbfile)
-	statement = """
-	insert into psfetcher
-	(titleID, title, price, roundprice, discount,
-	type, deal, pagenumber, dealID, locale, platform)
-	values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-	"""
-	connection.cursor().execute(statement, (
+
+	return (
 		titleID, title, price, roundPrice, str(discount),
 		category, deal, 1, dealID, locale, platform
-		)
 	)
-	connection.commit()
-	connection.close()
 
 
 def getitems(
@@ -205,21 +241,90 @@ def getitems(
 	query (str): search phrase
 	lang (str): 2-letter language code
 	country (str): 2-letter country code
-	dbfile (str): full path to a database file
+	dbfile (str): full path to a database file or MEMORYDB
 	"""
+	rows = pageitems(
+		dealurl=dealurl, deal=deal, pagenumber=pagenumber, pagesize=pagesize,
+		query=query, lang=lang, country=country
+	)
+	pssql.insertitems(dbfile=dbfile, rows=rows)
 
-	sys.stderr.write("\033[K" + "page {}".format(pagenumber) + "\r")
-	sys.stderr.flush()
 
+def pageurl(dealurl=None, pagenumber=None, query=None, lang=None, country=None):
+	"""Return the URL of a deal's or a search's page.
+
+	Parameters:
+	dealurl (str): deal's local URL
+	pagenumber (int): deal's page number
+	query (str): search phrase
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	"""
 	if dealurl:
-		soup = webparser(dealurl + str(pagenumber))
-	elif query:
-		url = "https://store.playstation.com/{}-{}/search/{}"
-		url = url.format(lang, country, query.replace(" ", "%20"))
-		soup = webparser(url)
+		return dealurl + str(pagenumber)
+	url = "{}/{}-{}/search/{}"
+	url = url.format(STORE_URL, lang, country, query.replace(" ", "%20"))
+	if pagenumber > 1:
+		url += "/" + str(pagenumber)
+	return url
 
-	dataDump = json.loads(soup.find("script", id="__NEXT_DATA__").string)
-	productIDTree = dataDump["props"]["apolloState"]
+
+def pagetext(url):
+	"""Return the __NEXT_DATA__ JSON text of a page for a given URL (see webtext)."""
+	return psextract.nextdata(webtext(url))
+
+
+def pageitems(
+	dealurl=None, deal=None, pagenumber=None,
+	pagesize=0, query=None, lang=None, country=None
+):
+	"""Return a list of rows for pssql.insertitems.
+
+	Fetches information for all items per 1 page.
+
+	Parameters:
+	dealurl (str): deal's local URL
+	deal (str): deal's name
+	pagenumber (int): deal's page number
+	pagesize (int): number of items per page
+	query (str): search phrase
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	"""
+	text = pagetext(pageurl(dealurl=dealurl, pagenumber=pagenumber, query=query, lang=lang, country=country))
+	return parseitems(text, dealurl, deal, pagenumber, pagesize, query, lang, country)
+
+
+@pstrace.traced("parse")
+def parseitems(
+	text, dealurl=None, deal=None, pagenumber=None,
+	pagesize=0, query=None, lang=None, country=None, quiet=False
+):
+	"""Return a list of rows for pssql.insertitems from a page's __NEXT_DATA__ JSON text (see pagetext).
+
+	Parameters:
+	text (str): page's __NEXT_DATA__ JSON text
+	dealurl (str): deal's local URL
+	deal (str): deal's name
+	pagenumber (int): deal's page number
+	pagesize (int): number of items per page
+	query (str): search phrase
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	quiet (bool): if True, the page's number isn't written to stderr, e.g. under a progress line (see psstream)
+	"""
+
+	if not quiet:
+		sys.stderr.write("\033[K" + "page {}".format(pagenumber) + "\r")
+		sys.stderr.flush()
+	pstrace.count("pages", deal=deal, locale="{}-{}".format(lang, country))
+
+	with pstrace.span("decode", bytes=len(text)):
+		if SELECTIVE_JSON:
+			# prices are decoded below, once it's known which of them are needed
+			productIDTree = psextract.apolloentries(text, prefixes=["CategoryGrid:", "Product:"])
+		else:
+			productIDTree = psextract.apollostate(text)
 
 	productIDs = []
 	if dealurl:
@@ -243,47 +348,192 @@ def getitems(
 				productIDs.append(productID)
 
 	locale = lang + "-" + country
-	noCurrencyReg = re.compile(r"[0-9,.\s]+")
-	connection = sqlite3.connect(dbfile)
-	c = connection.cursor()
+	itemInfos = []
 	for productID in productIDs:
-		itemInfo = dataDump["props"]["apolloState"][productID]
+		itemInfo = productIDTree[productID]
 		if query:
 			if not query.lower() in itemInfo["name"].lower():
 				continue
-
-		priceID = itemInfo["price"]["id"]
-		priceJson = dataDump["props"]["apolloState"][priceID]
-		try:
-			price = noCurrencyReg.search(priceJson["discountedPrice"]).group()
-			price = price.translate(str.maketrans({" ": None, ",": "."}))
-			# fix decimal separator rounding issue: if len after dec. sep. position is >= 3
-			decSepPosition = price.find(".") + 1
-			if len(price[decSepPosition:]) >= 3:
-				price = price.replace(".", "")
-			roundPrice = round(float(price), 2)
-		except (KeyError, AttributeError, ValueError):
-			roundPrice = 0.1
-
+		itemInfos.append(itemInfo)
+	if SELECTIVE_JSON:
+		with pstrace.span("decode"):
+			productIDTree.update(psextract.apolloentries(text, keys=[i["price"]["id"] for i in itemInfos]))
+	items = [(itemInfo, productIDTree[itemInfo["price"]["id"]]) for itemInfo in itemInfos]
+
+	# all prices of a page are normalised in one batch
+	with pstrace.span("prices", rows=len(items)):
+		roundPrices = psprice.roundprices([priceJson.get("discountedPrice") for itemInfo, priceJson in items])
+	rows = []
+	for (itemInfo, priceJson), roundPrice in zip(items, roundPrices):
 		platform = ", ".join(itemInfo["platforms"]["json"])
 		if "PS" not in platform:
 			platform = "PS*"
 
-		statement = """
-		insert into psfetcher
-		(titleID, title, price, roundprice, discount,
-		type, deal, pagenumber, dealID, locale, platform)
-		values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-		"""
-		c.execute(statement, (
+		rows.append((
 			itemInfo["id"], itemInfo["name"].strip(),
 			priceJson["discountedPrice"], roundPrice,
 			str(priceJson["discountText"]),
 			itemInfo["localizedStoreDisplayClassification"], deal, pagenumber, dealID, locale, platform
-			)
-		)
-	connection.commit()
-	connection.close()
+		))
+	return rows
+
+
+def archiveitems(
+	text, dealurl=None, deal=None, pagenumber=None,
+	pagesize=0, query=None, lang=None, country=None, quiet=False
+):
+	"""Return rows from parseitems and the page compressed for the archive (see psarchive.compress).
+
+	Pages are compressed by parse processes, so that the main process only writes them.
+	Takes the same parameters as parseitems.
+	"""
+	rows = parseitems(text, dealurl, deal, pagenumber, pagesize, query, lang, country, quiet)
+	return rows, psarchive.compress(text)
+
+
+def reparsepage(page):
+	"""Return an archived page's metadata, its rows for pssql.insertitems and an error message.
+
+	Any error is caught and returned as a message with no rows, like in tryItemPrice.
+
+	Parameters:
+	page (tuple): a page returned from psarchive.archivedpages
+	"""
+	dealID, locale, deal, pagenumber, dealurl, pagesize, fetched, compressed = page
+	lang, country = locale.split("-")
+	try:
+		text = psarchive.decompress(compressed)
+		rows = parseitems(text, dealurl, deal, pagenumber, pagesize, None, lang, country)
+		return page[:7], rows, None
+	except Exception as err:
+		return page[:7], None, "{}: {}".format(type(err).__name__, err)
+
+
+def reparse(dbfile=None, archivefile=None):
+	"""Return None. Rebuild fetched items of all archived deals from their archived pages.
+
+	Pages are parsed by one process per CPU, with no requests to PS Store.
+	Rebuilt items keep the time their pages were fetched at.
+	Deals fetched again since they were archived are skipped, so newer items aren't replaced with older ones,
+	and so are deals another run is fetching (see pssql.acquirelease).
+	Items of all reparsed deals are replaced in a single transaction.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	archivefile (str): full path to an archive file
+	"""
+	archived = []
+	if os.path.isfile(archivefile):
+		archived = psarchive.archiveddeals(archivefile=archivefile)
+	if not archived:
+		print("nothing to reparse: no pages are archived. fetch deals with --archive first")
+		return None
+
+	pssql.maketables(dbfile=dbfile)
+	deals = []
+	busy = []
+	skipped = []
+	failures = []
+	rowcount = 0
+	try:
+		# leases are taken in the same order as by fetchdeal
+		for deal, dealID, locale, pagecount, archivedtime in sorted(archived, key=lambda d: (d[2], d[1], d[0])):
+			if not pssql.acquirelease(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale):
+				busy.append((deal, locale))
+				continue
+			deals.append((deal, dealID, locale))
+			fetched = pssql.dealfetched(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale, latest=True)
+			if fetched is not None and fetched > archivedtime:
+				skipped.append((deal, locale))
+		reparsed = [d for d in deals if (d[0], d[2]) not in skipped]
+
+		pages = psarchive.archivedpages(archivefile=archivefile, deals=reparsed)
+		parsed = []
+		renewed = time.time()
+		p = multiprocessing.Pool(processes=multiprocessing.cpu_count())
+		try:
+			for page, rows, error in p.imap_unordered(reparsepage, pages, chunksize=4):
+				if error:
+					failures.append((page, error))
+				else:
+					parsed.append((rows, page[6]))
+					rowcount += len(rows)
+				# leases are renewed while pages are parsed, like in fetchdeal
+				if time.time() - renewed >= LEASE_RENEW:
+					pssql.renewleases(dbfile=dbfile, leases=reparsed)
+					renewed = time.time()
+		finally:
+			p.terminate()
+			p.join()
+		pssql.replaceitems(dbfile=dbfile, deals=reparsed, pages=parsed)
+	finally:
+		for deal, dealID, locale in deals:
+			pssql.releaselease(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+
+	print("reparsed {} pages of {} deals: {} items".format(len(pages) - len(failures), len(reparsed), rowcount))
+	if skipped:
+		print("skipped {} deals fetched again since they were archived:".format(len(skipped)))
+		for deal, locale in skipped:
+			print(" * '{}' ({})".format(deal, locale))
+	if busy:
+		print("skipped {} deals another run is fetching:".format(len(busy)))
+		for deal, locale in busy:
+			print(" * '{}' ({})".format(deal, locale))
+	if failures:
+		print("failed to reparse {} pages:".format(len(failures)))
+		for (dealID, locale, deal, pagenumber, dealurl, pagesize, fetched), error in failures:
+			print(" * '{}' ({}), page {}: {}".format(deal, locale, pagenumber, error))
+
+
+def maintain(dbfile=None, archivefile=None, maxage=0, maxsize=0):
+	"""Return None. Evict old and least recently used deals, compact the database and print the space reclaimed.
+
+	Archived pages of evicted deals are removed as well.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	archivefile (str): full path to an archive file
+	maxage (int): days after a deal's latest fetch it's kept for, 0 for no limit
+	maxsize (int): megabytes the database may take, 0 for no limit
+	"""
+	def filesize(filename):
+		return sum(os.path.getsize(name) for name in (filename, filename + "-wal") if os.path.isfile(name))
+
+	pssql.maketables(dbfile=dbfile)
+	sizes = [(dbfile, filesize(dbfile))]
+	evicted = pssql.evictdeals(dbfile=dbfile, maxage=maxage * 86400, maxsize=maxsize * 1024 * 1024)
+	pssql.compact(dbfile=dbfile)
+	if os.path.isfile(archivefile):
+		sizes.append((archivefile, filesize(archivefile)))
+		for deal, dealID, locale, count in evicted:
+			psarchive.cleardeal(archivefile=archivefile, deal=deal, dealID=dealID, locale=locale)
+		psarchive.compact(archivefile=archivefile)
+
+	if evicted:
+		print("evicted {} deals, {} items:".format(len(evicted), sum(deal[3] for deal in evicted)))
+		for deal, dealID, locale, count in evicted:
+			print(" * '{}' ({}): {} items".format(deal, locale, count))
+	else:
+		print("no deals to evict")
+	for filename, before in sizes:
+		after = filesize(filename)
+		print("{}: {} -> {}, reclaimed {}".format(
+			os.path.basename(filename), sizetext(before), sizetext(after), sizetext(max(before - after, 0))
+		))
+
+
+def searchitems(query, lang=None, country=None, pagenumber=1):
+	"""Return a list of rows for pssql.insertitems from a search results page.
+
+	A single-argument wrapper of pageitems for Pool.imap.
+
+	Parameters:
+	query (str): search phrase
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	pagenumber (int): search results page number
+	"""
+	return pageitems(query=query, deal=query, lang=lang, country=country, pagenumber=pagenumber)
 
 
 def printitems(itemlist, tlen=0, plen=0, table=False):
@@ -312,17 +562,102 @@ def printitems(itemlist, tlen=0, plen=0, table=False):
 		print(itemline)
 
 
+def tryItemPrice(job):
+	"""Return titleID, locale, a row from itemPrice and an error message.
+
+	Any error is caught and returned as a message with no row,
+	so a single delisted or changed title can't stop other titles from being checked.
+
+	Parameters:
+	job (tuple): titleID, locale and title's name
+	"""
+	titleID, locale, title = job
+	try:
+		return titleID, locale, itemPrice(titleID, locale, "watchlist", "watchlist"), None
+	except Exception as err:
+		return titleID, locale, None, "{}: {}".format(type(err).__name__, err)
+
+
+def checkwatchlist(dbfile=None, locales=None, maxage=0):
+	"""Yield a locale and its failed titles as soon as all of the store's watchlist titles are checked.
+
+	Checked prices are written to MEMORYDB under the 'watchlist' deal.
+	Titles with a fresh price in the database are checked without fetching their product pages.
+	Each failed title is a tuple of its name and an error message.
+
+	Parameters:
+	dbfile (str): full path to a database file
+	locales (list): stores to check, every store in the watchlist if None
+	maxage (int): maximum age of deals' prices reused by checks in minutes
+	"""
+	c = pssql.connect(dbfile, readonly=True)
+	if locales is None:
+		statement = "select distinct locale from watchlist order by locale"
+		locales = [locale for locale, in c.execute(statement).fetchall()]
+	jobs = []
+	pending = {}
+	for locale in locales:
+		# prices from recently fetched deals and product pages are reused
+		rows = pssql.cachedprices(
+			dbfile=dbfile, locale=locale,
+			productMaxAge=PRODUCT_CACHE_TTL, dealMaxAge=maxage * 60
+		)
+		pssql.insertitems(dbfile=MEMORYDB, rows=rows)
+		cachedIDs = [row[0] for row in rows]
+		statement = "select titleID, title from watchlist where locale = ?"
+		titles = [
+			(titleID, locale, title) for titleID, title in c.execute(statement, (locale,)).fetchall()
+			if titleID not in cachedIDs
+		]
+		pstrace.count("cache_requests", len(rows), cache="watchlist", result="hit")
+		pstrace.count("cache_requests", len(titles), cache="watchlist", result="miss")
+		jobs.extend(titles)
+		pending[locale] = len(titles)
+	pssql.close(c)
+
+	for locale in locales:
+		if pending[locale] == 0:
+			yield locale, []
+	if not jobs:
+		return None
+
+	newrows = dict((locale, []) for locale in locales)
+	failures = dict((locale, []) for locale in locales)
+	titles = dict(((titleID, locale), title) for titleID, locale, title in jobs)
+	p = multiprocessing.Pool(processes=multiprocessing.cpu_count())
+	results = map(pstrace.collect, p.imap_unordered(partial(pstrace.tracedcall, tryItemPrice), jobs))
+	for checked, result in enumerate(results, start=1):
+		sys.stderr.write("\033[K" + "checked {}/{}".format(checked, len(jobs)) + "\r")
+		sys.stderr.flush()
+		titleID, locale, row, error = result
+		if row:
+			newrows[locale].append(row)
+		else:
+			failures[locale].append((titles[(titleID, locale)], error))
+			pstrace.count("watchlist_failures", locale=locale)
+		pending[locale] -= 1
+		if pending[locale] == 0:
+			pssql.cacheproducts(dbfile=dbfile, rows=newrows[locale])
+			pssql.insertitems(dbfile=MEMORYDB, rows=newrows[locale])
+			yield locale, failures[locale]
+	p.close()
+	p.join()
+
+
 def watchlist(dbfile=None, locale=None, command=None, addtitle=None):
 	"""Return None.
 
-	Based on an option, either show titles, add a title, check prices or remove a title.
+	Based on an option, either show titles, add a title or remove a title.
+	Prices are checked by checkwatchlist.
+
+	Search results are written to the in-memory backend, MEMORYDB.
 
 	dbfile (str): full path to a database file
 	locale (str): language and country codes joined with a hyphen
-	command (str): command to execute (add, check, show, remove)
+	command (str): command to execute (add, show, remove)
 	addtitle (str): search and add a title to the watchlist db
 	"""
-	connection = sqlite3.connect(dbfile)
+	connection = pssql.connect(dbfile)
 	c = connection.cursor()
 	totalCount, = c.execute("select count(titleID) from watchlist").fetchone()
 	if command == "show" and totalCount != 0:
@@ -332,34 +667,15 @@ def watchlist(dbfile=None, locale=None, command=None, addtitle=None):
 		for title, locale in c.execute("select title, locale from watchlist").fetchall():
 			print(title.ljust(maxTitleLen), locale)
 
-	elif command == "check" and totalCount != 0:
-		titleIDs = []
-		locales = []
-		statement = "select titleID, locale from watchlist where locale = ?"
-		for titleID, locale in c.execute(statement, (locale,)).fetchall():
-			titleIDs.append(titleID)
-			locales.append(locale)
-		p = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-		p.starmap(itemPrice, zip(
-			repeat(dbfile), titleIDs, locales,
-			repeat("watchlist"), repeat("watchlist")
-			)
-		)
-		p.close()
-		p.join()
-
-	elif command == "add" and addtitle:
-		c.execute("delete from psfetcher where deal = 'watchlist'")
-		c.execute("update sqlite_sequence set seq=0 where name='psfetcher'")
-		connection.commit()
-
+	if command == "add" and addtitle:
 		lang, country = locale.split("-")
-		getitems(query=addtitle, deal="watchlist", lang=lang, country=country, pagenumber=1, dbfile=dbfile)
+		getitems(query=addtitle, deal="watchlist", lang=lang, country=country, pagenumber=1, dbfile=MEMORYDB)
 
 		indexConverter = {}
 		statement = "select id, title from psfetcher where deal = 'watchlist'"
-		watchQueryResults = c.execute(statement).fetchall()
+		watchQueryResults = pssql.connect(MEMORYDB).execute(statement).fetchall()
 		if not watchQueryResults:
+			pssql.close(connection)
 			return None
 		for ind, IDWithTitle in enumerate(watchQueryResults, start=1):
 			ID = IDWithTitle[0]
@@ -369,13 +685,14 @@ def watchlist(dbfile=None, locale=None, command=None, addtitle=None):
 		del watchQueryResults
 		choices = choiceCheck(maxval=len(indexConverter), attempt=1, inputMessage="enter title's index: ")
 		if not choices:
+			pssql.close(connection)
 			return None
 		# revert back from enumerated indexes to the real ids in the table
 		finalIDs = [str(indexConverter[ind]) for ind in choices]
 		placeholders = "?" * len(finalIDs)
 		placeholders = ",".join(finalIDs)
 		statement = "select title, titleID from psfetcher where deal = 'watchlist' and id in ({})"
-		for title, titleID in c.execute(statement.format(placeholders)).fetchall():
+		for title, titleID in pssql.connect(MEMORYDB).execute(statement.format(placeholders)).fetchall():
 			statement = "select titleID from watchlist where titleID = ? and locale = ?"
 			if not c.execute(statement, (titleID, locale)).fetchone():
 				statement = "insert into watchlist (titleID, title, locale) values (?, ?, ?)"
@@ -400,7 +717,72 @@ def watchlist(dbfile=None, locale=None, command=None, addtitle=None):
 		c.execute("update sqlite_sequence set seq=0 where name='watchlist'")
 		connection.commit()
 
-	connection.close()
+	pssql.close(connection)
+
+
+def spawnrefresh(lang=None, country=None, deals=None):
+	"""Return None. Start a detached process fetching deals of a store anew in the background.
+
+	The process writes new results to staging and swaps them in once a deal is fetched (see pssql.swapstaged);
+	it prints and saves nothing, and keeps running after this run exits.
+
+	Parameters:
+	lang (str): 2-letter language code
+	country (str): 2-letter country code
+	deals (list): tuples of deal's name and its local URL
+	"""
+	args = [sys.executable, os.path.realpath(__file__), "-s", country, "-l", lang]
+	for deal, dealurl in deals:
+		args.extend(["--stage-deal", deal, dealurl])
+	subprocess.Popen(
+		args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+		start_new_session=True
+	)
+
+
+def sizetext(size):
+	"""Return a size in bytes as megabytes, e.g. '12.3 MB'."""
+	return "{:.1f} MB".format(size / 1024 / 1024)
+
+
+def agetext(seconds):
+	"""Return a rounded, human-readable age, e.g. '5 minutes ago'.
+
+	Parameters:
+	seconds (float): age in seconds
+	"""
+	units = [("day", 86400), ("hour", 3600), ("minute", 60)]
+	for unit, length in units:
+		if seconds >= length:
+			value = int(seconds // length)
+			return "{} {}{} ago".format(value, unit, "s" * (value != 1))
+	return "just now"
+
+
+def printcomparison(itemlist):
+	"""Return None. Print a cross-store comparison from itemlist, one table per currency.
+
+	Parameters:
+	itemlist (list): data list of items (dicts) returned from pssql.comparestores
+	"""
+	tlen = max(len(item["title"]) for item in itemlist)
+	plen = max(len(item["price"]) for item in itemlist)
+	slen = len("Store")
+	currency = None
+	for item in itemlist:
+		if item["currency"] != currency:
+			if currency is not None:
+				print()
+			currency = item["currency"]
+			print("prices in {}:".format(currency))
+			print("{} | {} | {} | {}".format(
+				"Title".ljust(tlen), "Price".ljust(plen),
+				"Store".ljust(slen), "All stores"
+			))
+		print("{} | {} | {} | {}".format(
+			item["title"].ljust(tlen), item["price"].ljust(plen),
+			item["store"].ljust(slen), item["prices"]
+		))
 
 
 def listStores(conf=None):
@@ -418,7 +800,8 @@ def listStores(conf=None):
 
 def prelimCheck(
 	country=None, lang=None, minprice=0, maxprice=0,
-	conf=None, sortingList=None, contentTypes=None
+	conf=None, sortingList=None, contentTypes=None, searchPages=1,
+	stores=None
 ):
 	"""Return 1 if basic sanity check of arguments fails.
 
@@ -430,19 +813,22 @@ def prelimCheck(
 	conf (dict): the first dict, allstores, returned from psconfig.getConf
 	sortingList (list): a list of user-applied sorting
 	contentTypes (list): a list of user-picked content types
+	searchPages (int): number of search results pages
+	stores (list): tuples of 2-letter language and country codes, when more than one store is used
 	"""
-	if not lang:
-		print("specify the language code")
-		return 1
-	if lang not in conf.keys():
-		print("wrong language code specified")
-		return 1
-	if not country:
-		print("specify the country code")
-		return 1
-	if country not in conf[lang]:
-		print("wrong country and language code combination")
-		return 1
+	for lang, country in stores or [(lang, country)]:
+		if not lang:
+			print("specify the language code")
+			return 1
+		if lang not in conf.keys():
+			print("wrong language code specified")
+			return 1
+		if not country:
+			print("specify the country code")
+			return 1
+		if country not in conf[lang]:
+			print("wrong country and language code combination")
+			return 1
 	if 0 > minprice or minprice > maxprice:
 		print("there there now, be a dear and fix those prices")
 		return 1
@@ -454,6 +840,9 @@ def prelimCheck(
 		if level not in (["game", "addon", "currency"]):
 			print("wrong content is specified")
 			return 1
+	if searchPages < 1:
+		print("at least 1 search results page is needed")
+		return 1
 
 
 def main():
@@ -464,19 +853,55 @@ def main():
 	if not allstores:
 		sys.exit()
 
-	# should a var be added/changed, copy the variable list from psparse
-	country, lang, argCommand, subCommand, addTitle, \
-		argQuery, argSortingList, argContentTypes, minprice, maxprice, \
-		printTableResults, dontPrintResults, ignorePreviousFetch, \
-		reverseResults, getAllDeals, \
-		writetext, writereddit, writehtml, writexlsx, operation = psparse.getVars()
-
-	# store-independent functions: list stores, print examples, show user-set preferences, flush db
-	if argCommand and argCommand != "watchlist":
+	# variables are read by name, so adding one to psparse doesn't shift the others
+	options = psparse.getVars()
+	country = options.country
+	lang = options.lang
+	stores = options.stores
+	argCommand = options.argCommand
+	subCommand = options.subCommand
+	addTitle = options.addTitle
+	argQuery = options.argQuery
+	argSortingList = options.argSortingList
+	argContentTypes = options.argContentTypes
+	minprice = options.minprice
+	maxprice = options.maxprice
+	printTableResults = options.printTableResults
+	dontPrintResults = options.dontPrintResults
+	ignorePreviousFetch = options.ignorePreviousFetch
+	reverseResults = options.reverseResults
+	getAllDeals = options.getAllDeals
+	searchPages = options.searchPages
+	watchlistMaxAge = options.watchlistMaxAge
+	watchAllStores = options.watchAllStores
+	dealListMaxAge = options.dealListMaxAge
+	printPipelineStats = options.printPipelineStats
+	profileRun = options.profileRun
+	metricsFile = options.metricsFile
+	recordDir = options.recordDir
+	replayDir = options.replayDir
+	replayLatency = options.replayLatency
+	archivePages = options.archivePages
+	localSearch = options.localSearch
+	showChanges = options.showChanges
+	streamResults = options.streamResults
+	dealMaxAge = options.dealMaxAge
+	dealRefresh = options.dealRefresh
+	stageDeals = options.stageDeals
+	dealRetention = options.dealRetention
+	dbMaxSize = options.dbMaxSize
+	writetext = options.writetext
+	writereddit = options.writereddit
+	writehtml = options.writehtml
+	writexlsx = options.writexlsx
+	operation = options.operation
+
+	# store-independent functions: list stores, print examples, show user-set preferences, flush and maintain db
+	if argCommand and argCommand not in ("watchlist", "shell"):
 		funcMap = {
 			"list": listStores, "examples": psinfo.printExamples,
 			"preferences": psconfig.checkPreferences,
-			"flush": pssql.flush, "flushall": pssql.flush
+			"flush": pssql.flush, "flushall": pssql.flush, "reparse": reparse, "maintain": maintain
 		}
 		func = funcMap[argCommand]
 		if argCommand == "list":
@@ -485,6 +910,10 @@ def main():
 			func(dbfile=DBFILE)
 		elif argCommand == "flushall":
 			func(dbfile=DBFILE, everything=True)
+		elif argCommand == "reparse":
+			func(dbfile=DBFILE, archivefile=ARCHIVEFILE)
+		elif argCommand == "maintain":
+			func(dbfile=DBFILE, archivefile=ARCHIVEFILE, maxage=dealRetention, maxsize=dbMaxSize)
 		else:
 			func()
 		sys.exit()
@@ -493,27 +922,54 @@ def main():
 	exitCode = prelimCheck(
 		country=country, lang=lang, minprice=minprice,
 		maxprice=maxprice, conf=allstores, sortingList=argSortingList,
-		contentTypes=argContentTypes
+		contentTypes=argContentTypes, searchPages=searchPages, stores=stores
 	)
 	del allstores
 	if exitCode == 1:
 		sys.exit(1)
+	if len(stores) > 1 and operation != "FETCHDEAL":
+		print("multiple stores are supported for deals only")
+		sys.exit(1)
 
 	locale = "{}-{}".format(lang, country)
 	pssql.maketables(dbfile=DBFILE)
 	savedMessages = []
 
-	def fullShebang(deal=None, dealID=None, itemcount=0, isQuery=False, isDeal=False, isWatch=False, pages=0):
-		itemlist, tlen, plen, filterMessage = pssql.mainselect(
-			dbfile=DBFILE, deal=deal, dealID=dealID, locale=locale,
-			sortingList=argSortingList, contentTypes=argContentTypes,
-			minprice=minprice, maxprice=maxprice, allcontent=allcontent,
-			lang=lang, country=country, reverseResults=reverseResults
-		)
+	def fullShebang(
+		deal=None, dealID=None, itemcount=0, isQuery=False,
+		isDeal=False, isWatch=False, pages=0, dbfile=DBFILE,
+		lang=lang, country=country, fetched=None, outdated=False, streamed=False
+	):
+		locale = "{}-{}".format(lang, country)
+		# shown deals are evicted last by 'maintain'
+		if isDeal:
+			pssql.touchdeal(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+		select = pssql.mainselect
+		# with --changes, a deal's changes since its previous fetch are shown instead of all of its items
+		if showChanges and isDeal:
+			select = pssql.changeselect
+		with pstrace.span("select") as trace:
+			selected = select(
+				dbfile=dbfile, deal=deal, dealID=dealID, locale=locale,
+				sortingList=argSortingList, contentTypes=argContentTypes,
+				minprice=minprice, maxprice=maxprice, allcontent=allcontent,
+				lang=lang, country=country, reverseResults=reverseResults
+			)
+			itemlist, tlen, plen, filterMessage = selected[:4]
+			trace["rows"] = len(itemlist or [])
+		if showChanges and isDeal:
+			previous = selected[4]
+			if previous is None:
+				print("no previous fetch of the '{}' deal to compare with. fetch it anew with -i".format(deal))
+				return None
+			if not itemlist:
+				print("no changes in the '{}' deal since its previous fetch ({})".format(deal, agetext(time.time() - previous)))
+				return None
 		if not itemlist:
 			return None
 
-		if not dontPrintResults:
+		# streamed items are already printed and saved as text (see psstream)
+		if not dontPrintResults and not streamed:
 			printitems(itemlist, tlen=tlen, plen=plen, table=printTableResults)
 
 		itemWord = "items"
@@ -522,95 +978,527 @@ def main():
 		if itemcount == 0:
 			itemcount = len(itemlist)
 
-		if isDeal:
+		if isDeal and showChanges:
+			printMessage = "{} in the '{}' deal since its previous fetch ({})"
+			printMessage = printMessage.format(filterMessage.split(" | ")[0], deal, agetext(time.time() - previous))
+		elif isDeal:
 			printMessage = "fetched {}/{} {} from the '{}' deal. pages: {}"
 			printMessage = printMessage.format(len(itemlist), itemcount, itemWord, deal, pages)
+			# outdated results shown while the deal is fetched anew in the background
+			if outdated:
+				age = "at an unknown time"
+				if fetched is not None:
+					age = agetext(time.time() - fetched)
+				printMessage += " (fetched {}, refreshing in the background)".format(age)
 		elif isQuery:
 			printMessage = "found {} {} for '{}' query"
 			printMessage = printMessage.format(itemcount, itemWord, deal)
+			# results found locally are as fresh as the oldest deal they come from
+			if fetched:
+				printMessage += " in fetched deals ({})".format(agetext(time.time() - fetched))
 		elif isWatch:
 			printMessage = "fetched {} watchlist {}"
 			printMessage = printMessage.format(itemcount, itemWord)
 		print(printMessage)
 
 		funcs = [func for func in (writereddit, writehtml, writexlsx, writetext) if func]
-		exts = {writereddit: "reddit.txt", writehtml: "html", writexlsx: "xlsx", writetext: "txt"}
+		if streamed:
+			funcs = [func for func in funcs if func != pswrite.writetext]
+		savedMessages.extend(saveitems(
+			itemlist=itemlist, tlen=tlen, plen=plen, filterMessage=filterMessage, deal=deal, funcs=funcs,
+			isQuery=isQuery, isChanges=isDeal and showChanges, lang=lang, country=country
+		))
+
+	exts = {
+		pswrite.writereddit: "reddit.txt", pswrite.writehtml: "html",
+		pswrite.writexlsx: "xlsx", pswrite.writetext: "txt"
+	}
+
+	def outputname(deal=None, func=None, isQuery=False, isChanges=False, lang=lang, country=country):
+		filename = deal.replace("- ", "").replace(" ", ".").lower()
+		if isQuery:
+			filename = "query." + filename
+		if isChanges:
+			filename += ".changes"
+		filename = "{}.{}.{}.{}".format(filename, lang, country, exts[func])
+		return filename.replace("..", ".").replace("...", ".")
+
+	def saveitems(
+		itemlist=None, tlen=0, plen=0, filterMessage=None, deal=None, funcs=None,
+		isQuery=False, isChanges=False, lang=lang, country=country, table=printTableResults
+	):
+		messages = []
 		for func in funcs:
-			filename = deal.replace("- ", "").replace(" ", ".").lower()
-			if isQuery:
-				filename = "query." + filename
-			filename = "{}.{}.{}.{}".format(filename, lang, country, exts[func])
-			filename = filename.replace("..", ".").replace("...", ".")
-			if func == writetext:
-				savedMessage = func(
-					itemlist=itemlist, tlen=tlen, plen=plen,
-					lang=lang, country=country, table=printTableResults,
-					filterMessage=filterMessage, filename=filename
-				)
-			elif func == writereddit:
-				savedMessage = func(
-					itemlist=itemlist, lang=lang, country=country,
-					filename=filename, filterMessage=filterMessage
-				)
-			else:
-				savedMessage = func(
-					itemlist=itemlist, lang=lang, country=country, deal=deal,
-					filename=filename, filterMessage=filterMessage
-				)
-			savedMessages.append(savedMessage)
+			filename = outputname(
+				deal=deal, func=func, isQuery=isQuery, isChanges=isChanges, lang=lang, country=country
+			)
+			with pstrace.span("write", output=exts[func], rows=len(itemlist)):
+				if func == pswrite.writetext:
+					savedMessage = func(
+						itemlist=itemlist, tlen=tlen, plen=plen,
+						lang=lang, country=country, table=table,
+						filterMessage=filterMessage, filename=filename
+					)
+				elif func == pswrite.writereddit:
+					savedMessage = func(
+						itemlist=itemlist, lang=lang, country=country,
+						filename=filename, filterMessage=filterMessage
+					)
+				else:
+					savedMessage = func(
+						itemlist=itemlist, lang=lang, country=country, deal=deal,
+						filename=filename, filterMessage=filterMessage
+					)
+			messages.append(savedMessage)
+		return messages
+
+	def shell(dbfile=None, lang=None, country=None):
+		formats = {
+			"txt": pswrite.writetext, "reddit": pswrite.writereddit,
+			"html": pswrite.writehtml, "xlsx": pswrite.writexlsx
+		}
+
+		def saver(itemlist, tlen, plen, filterMessage, deal, outputs, table=False):
+			return saveitems(
+				itemlist=itemlist, tlen=tlen, plen=plen, filterMessage=filterMessage, deal=deal,
+				funcs=[formats[output] for output in outputs], lang=lang, country=country, table=table
+			)
+
+		psshell.Shell(
+			dbfile=dbfile, lang=lang, country=country, allcontent=allcontent,
+			minprice=minprice, maxprice=maxprice, sortingList=argSortingList, contentTypes=argContentTypes,
+			reverseResults=reverseResults, table=printTableResults, printer=printitems, saver=saver
+		).cmdloop()
 
 	def watchdog(dbfile=None, locale=None, command=None, addtitle=None):
-		watchlist(dbfile=dbfile, locale=locale, command=command, addtitle=addtitle)
-		if command == "check":
-			fullShebang(deal="watchlist", dealID="watchlist", isWatch=True)
-			pssql.cleanup(dbfile=dbfile, deal="watchlist", dealID="watchlist", locale=locale)
+		if command != "check":
+			watchlist(dbfile=dbfile, locale=locale, command=command, addtitle=addtitle)
+			return None
+
+		locales = [locale]
+		if watchAllStores:
+			locales = None
+		allFailures = []
+		shown = False
+		started = time.time()
+		# stores are shown in the order their checks finish
+		for storeLocale, failures in checkwatchlist(dbfile=dbfile, locales=locales, maxage=watchlistMaxAge):
+			pstrace.gauge("duration_seconds", time.time() - started, deal="watchlist", locale=storeLocale)
+			storeLang, storeCountry = storeLocale.split("-")
+			if shown and not dontPrintResults:
+				print()
+			if watchAllStores:
+				print("{} store:".format(storeLocale))
+			fullShebang(
+				deal="watchlist", dealID="watchlist", isWatch=True,
+				dbfile=MEMORYDB, lang=storeLang, country=storeCountry
+			)
+			pssql.cleanup(dbfile=MEMORYDB, deal="watchlist", dealID="watchlist", locale=storeLocale)
+			allFailures.extend([(title, storeLocale, error) for title, error in failures])
+			shown = True
+
+		if allFailures:
+			titleWord = "titles"
+			if len(allFailures) == 1:
+				titleWord = "title"
+			print("failed to check {} {}:".format(len(allFailures), titleWord))
+			for title, storeLocale, error in allFailures:
+				print(" * {} ({}): {}".format(title, storeLocale, error))
+
+	def deepsearch(p, processes=1, query=None, rows=None, lang=None, country=None):
+		# fetch further results pages, a pool's worth at a time, until a page has no matches
+		titleIDs = set(row[0] for row in rows)
+		pagenumber = 2
+		while pagenumber <= searchPages:
+			lastpage = min(pagenumber + processes - 1, searchPages)
+			pages = p.starmap(partial(pstrace.tracedcall, searchitems), zip(
+				repeat(query), repeat(lang), repeat(country),
+				range(pagenumber, lastpage + 1)
+				)
+			)
+			pages = map(pstrace.collect, pages)
+			for pagerows in pages:
+				if not pagerows:
+					return rows
+				for row in pagerows:
+					if row[0] not in titleIDs:
+						titleIDs.add(row[0])
+						rows.append(row)
+			pagenumber = lastpage + 1
+		return rows
 
 	def fetchitem(dbfile=None, rawQuery=[], lang=None, country=None):
 		queries = " ".join(rawQuery).split(",")
 		queries = [q.strip() for q in queries if q.strip()]
-		for query in queries:
-			getitems(query=query, deal=query, lang=lang, country=country, pagenumber=1, dbfile=dbfile)
-			fullShebang(deal=query, dealID=query, isQuery=True)
-			if len(queries) > 1 and query != queries[-1] and not dontPrintResults:
-				print()
-			pssql.cleanup(dbfile=dbfile, deal=query, dealID=query, locale=locale)
-
-	def fetchdeal(dbfile=None, lang=None, country=None, fetchall=None):
-		deals = getdeals(lang, country, fetchall=fetchall)
-		if not deals:
+		if not queries:
 			return None
 
-		p = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-		for deal, dealurl in deals:
-			dealID = dealurl.split("/")[-2]
-			if ignorePreviousFetch:
-				pssql.cleanup(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
-			# if old results are ignored, fall back to default values 0, 0
-			itemcount, pages = pssql.oldcount(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
-			if itemcount == 0:
-				itemcount, pages, pageSize = itercount(dealurl)
-				try:
-					p.starmap(getitems, zip(
-						repeat(dealurl), repeat(deal), range(1, pages + 1),
-						repeat(pageSize), repeat(None),
-						repeat(lang), repeat(country), repeat(dbfile)
+		# with --local, titles of fetched deals are searched first; PS Store is searched for the rest
+		started = time.time()
+		localResults = {}
+		if localSearch:
+			for query in queries:
+				rows, fetched = pssql.localsearch(dbfile=DBFILE, query=query, locale=locale)
+				if rows:
+					localResults[query] = rows, fetched
+			pstrace.count("cache_requests", len(localResults), cache="titleindex", result="hit")
+			pstrace.count("cache_requests", len(queries) - len(localResults), cache="titleindex", result="miss")
+		remoteQueries = [query for query in queries if query not in localResults]
+
+		# all remote queries are fetched at once; results are shown in the queries' order
+		p = None
+		results = iter([])
+		if remoteQueries:
+			processes = min(len(remoteQueries) * searchPages, max(multiprocessing.cpu_count(), SEARCH_PROCESSES))
+			p = multiprocessing.Pool(processes=processes)
+			results = p.imap(partial(pstrace.tracedcall, searchitems, lang=lang, country=country), remoteQueries)
+			results = map(pstrace.collect, results)
+		try:
+			for query in queries:
+				fetched = None
+				if query in localResults:
+					rows, fetched = localResults[query]
+				else:
+					rows = next(results)
+					if searchPages > 1 and rows:
+						rows = deepsearch(p, processes=processes, query=query, rows=rows, lang=lang, country=country)
+				pssql.insertitems(dbfile=dbfile, rows=rows)
+				pstrace.gauge("duration_seconds", time.time() - started, deal=query, locale=locale)
+				fullShebang(deal=query, dealID=query, isQuery=True, dbfile=dbfile, fetched=fetched)
+				if len(queries) > 1 and query != queries[-1] and not dontPrintResults:
+					print()
+				pssql.cleanup(dbfile=dbfile, deal=query, dealID=query, locale=locale)
+		finally:
+			# all searches are done by now, unless one of them failed
+			if p:
+				p.terminate()
+				p.join()
+
+	def fetchdeal(dbfile=None, stores=None, fetchall=None, staged=None):
+		# a cached list of deals and their page counts are ignored along with old results
+		listMaxAge = dealListMaxAge
+		if ignorePreviousFetch or staged:
+			listMaxAge = 0
+		# deals of the first store are picked, the same deals are looked up in other stores
+		jobs = []
+		picked = None
+		# a background refresh (see spawnrefresh) gets its deals from the run that started it
+		if staged:
+			lang, country = stores[0]
+			jobs = [(lang, country, deal, dealurl) for deal, dealurl in staged]
+			stores = []
+		for storeLang, storeCountry in stores:
+			deals = getdeals(
+				storeLang, storeCountry, fetchall=fetchall, pick=picked,
+				dbfile=dbfile, maxage=listMaxAge
+			)
+			if not deals:
+				if not jobs:
+					return None
+				continue
+			if not fetchall:
+				picked = deals
+			jobs.extend([(storeLang, storeCountry, deal, dealurl) for deal, dealurl in deals])
+
+		# every page of every deal and store goes through one pipeline:
+		# download threads, parse processes, and this process storing rows;
+		# results are shown in order, as soon as a deal is fetched
+		crawls = []
+		stats = pspipeline.newstats()
+		stream = None
+		try:
+			pending = []
+			for order, (storeLang, storeCountry, deal, dealurl) in enumerate(jobs):
+				crawl = {}
+				crawl["order"] = order
+				crawl["lang"] = storeLang
+				crawl["country"] = storeCountry
+				crawl["locale"] = "{}-{}".format(storeLang, storeCountry)
+				crawl["deal"] = deal
+				crawl["dealurl"] = dealurl
+				crawl["dealID"] = dealurl.split("/")[-2]
+				crawl["remaining"] = 0
+				crawl["leaseDeal"] = deal
+				crawl["leased"] = False
+				crawl["staged"] = bool(staged)
+				crawl["fetched"] = None
+				crawl["outdated"] = False
+				crawl["streamed"] = False
+				crawl["waited"] = False
+				if staged:
+					# old results stay readable while staged ones are fetched, so only the staging copy is leased
+					crawl["leaseDeal"] = "staging:" + deal
+				pending.append(crawl)
+			renewed = time.time()
+
+			def renewleases():
+				# held leases are renewed while this run fetches, so no other run takes a deal over meanwhile
+				nonlocal renewed
+				if time.time() - renewed < LEASE_RENEW:
+					return None
+				renewed = time.time()
+				pssql.renewleases(dbfile=dbfile, leases=[
+					(crawl["leaseDeal"], crawl["dealID"], crawl["locale"]) for crawl in crawls if crawl["leased"]
+				])
+
+			def cached(crawl):
+				# a deal's results are reused unless they're ignored (-i), missing, or outdated and refreshed now;
+				# results another run has just fetched are always reused
+				deal, dealID, storeLocale = crawl["deal"], crawl["dealID"], crawl["locale"]
+				if ignorePreviousFetch and not crawl["waited"]:
+					return False
+				crawl["itemcount"], crawl["pages"] = pssql.oldcount(
+					dbfile=dbfile, deal=deal, dealID=dealID, locale=storeLocale
+				)
+				if not crawl["itemcount"]:
+					return False
+				if crawl["waited"] or not dealMaxAge:
+					return True
+				# results older than dealMaxAge are fetched anew now, or shown and fetched anew in the background
+				fetched = pssql.dealfetched(dbfile=dbfile, deal=deal, dealID=dealID, locale=storeLocale)
+				# items stored before fetch times were recorded are of an unknown age, so they're outdated too
+				if fetched is not None and time.time() - fetched <= dealMaxAge * 60:
+					return True
+				pstrace.count("cache_requests", cache="deals", result="stale")
+				if dealRefresh == "background":
+					crawl["outdated"] = True
+					crawl["fetched"] = fetched
+					return True
+				return False
+
+			# only deals that are fetched are leased, in the same order by every run,
+			# so two runs sharing deals never wait for each other
+			for crawl in sorted(pending, key=lambda crawl: (crawl["locale"], crawl["dealID"], crawl["leaseDeal"])):
+				lease = dict(dbfile=dbfile, deal=crawl["leaseDeal"], dealID=crawl["dealID"], locale=crawl["locale"])
+				if staged:
+					# a deal already being refreshed by another process is skipped
+					if pssql.acquirelease(**lease):
+						crawl["leased"] = True
+						crawls.append(crawl)
+					continue
+				while True:
+					# another run fetching the same deal: wait for it and reuse its results
+					if pssql.leaseheld(**lease):
+						if not crawl["waited"]:
+							print("waiting for another run to fetch the '{}' deal".format(crawl["deal"]))
+							crawl["waited"] = True
+						pssql.waitlease(timeout=LEASE_RENEW, **lease)
+						renewleases()
+						continue
+					if cached(crawl):
+						break
+					if pssql.acquirelease(**lease):
+						crawl["leased"] = True
+						break
+				crawls.append(crawl)
+			# results are shown in the order deals were picked
+			crawls.sort(key=lambda crawl: crawl["order"])
+
+			for crawl in crawls:
+				deal, dealID, storeLocale = crawl["deal"], crawl["dealID"], crawl["locale"]
+				if staged:
+					pssql.clearstaged(dbfile=dbfile, deal=deal, dealID=dealID, locale=storeLocale)
+					crawl["itemcount"], crawl["pages"] = 0, 0
+					crawl["stagedAt"] = time.time()
+				elif crawl["leased"]:
+					# old results are kept as the deal's snapshot, compared with the new ones by --changes
+					pssql.savesnapshot(dbfile=dbfile, deal=deal, dealID=dealID, locale=storeLocale)
+					pssql.cleanup(dbfile=dbfile, deal=deal, dealID=dealID, locale=storeLocale)
+					crawl["itemcount"], crawl["pages"] = 0, 0
+
+			newcrawls = [crawl for crawl in crawls if crawl["itemcount"] == 0]
+			pstrace.count("cache_requests", len(crawls) - len(newcrawls), cache="deals", result="hit")
+			pstrace.count("cache_requests", len(newcrawls), cache="deals", result="miss")
+			counts = {}
+			if listMaxAge:
+				counts = pssql.cachedcounts(dbfile=dbfile, maxage=listMaxAge * 60)
+			uncounted = [crawl for crawl in newcrawls if (crawl["locale"], crawl["dealID"]) not in counts]
+			pstrace.count("cache_requests", len(newcrawls) - len(uncounted), cache="dealcounts", result="hit")
+			pstrace.count("cache_requests", len(uncounted), cache="dealcounts", result="miss")
+			if uncounted:
+				with ThreadPool(processes=min(len(uncounted), PIPELINE_THREADS)) as p:
+					uncountedCounts = p.map(itercount, [crawl["dealurl"] for crawl in uncounted])
+				for crawl, count in zip(uncounted, uncountedCounts):
+					counts[(crawl["locale"], crawl["dealID"])] = count
+					if count[1]:
+						pssql.cachecounts(dbfile=dbfile, locale=crawl["locale"], dealID=crawl["dealID"], counts=count)
+			pageJobs = []
+			# with --stream, crawled deals' items are shown page by page under a progress line (see psstream)
+			streaming = streamResults and not staged
+			if archivePages:
+				psarchive.maketables(archivefile=ARCHIVEFILE)
+			for ind, crawl in enumerate(crawls):
+				if crawl["itemcount"]:
+					continue
+				itemcount, pages, pageSize = counts[(crawl["locale"], crawl["dealID"])]
+				if not pages:
+					continue
+				crawl["itemcount"], crawl["pages"] = itemcount, pages
+				crawl["remaining"] = pages
+				crawl["pagesize"] = pageSize
+				crawl["streamed"] = streaming
+				if archivePages:
+					psarchive.cleardeal(
+						archivefile=ARCHIVEFILE, deal=crawl["deal"], dealID=crawl["dealID"], locale=crawl["locale"]
+					)
+				for pagenumber in range(1, pages + 1):
+					args = (
+						crawl["dealurl"], crawl["deal"], pagenumber, pageSize,
+						None, crawl["lang"], crawl["country"], streaming
+					)
+					pageJobs.append(((ind, pagenumber), pageurl(dealurl=crawl["dealurl"], pagenumber=pagenumber), args))
+
+			streamed = [crawl for crawl in crawls if crawl["streamed"]]
+			if streamed:
+				dealWidth = 0
+				if len(streamed) > 1:
+					dealWidth = max(len(crawl["deal"]) for crawl in streamed)
+				stream = psstream.Stream(
+					pages=len(pageJobs), minprice=minprice, maxprice=maxprice,
+					table=printTableResults, printing=not dontPrintResults, dealWidth=dealWidth
+				)
+				message = " | ".join(["titles in the order they were fetched"] + pssql.filtermessages(
+					minprice=minprice, maxprice=maxprice, contentTypes=argContentTypes
+				))
+				for ind, crawl in enumerate(crawls):
+					if not crawl["streamed"]:
+						continue
+					crawl["ctypes"] = None
+					if argContentTypes:
+						crawl["ctypes"] = set()
+						for ctype in argContentTypes:
+							crawl["ctypes"].update(allcontent[crawl["lang"]][ctype])
+					if writetext:
+						filename = outputname(
+							deal=crawl["deal"], func=pswrite.writetext, lang=crawl["lang"], country=crawl["country"]
 						)
+						stream.openfile(key=ind, filename=filename, message=message)
+
+			def swapcrawl(crawl):
+				# the deal's own lease keeps a foreground crawl of it from running during the swap;
+				# if one has stored the deal since this refresh began, its results are newer and are kept
+				deal, dealID, locale = crawl["deal"], crawl["dealID"], crawl["locale"]
+				while not pssql.acquirelease(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale):
+					pssql.waitlease(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale, timeout=LEASE_RENEW)
+					renewleases()
+				try:
+					fetched = pssql.dealfetched(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+					if fetched is not None and fetched > crawl["stagedAt"]:
+						pssql.clearstaged(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+					else:
+						pssql.swapstaged(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+				finally:
+					pssql.releaselease(dbfile=dbfile, deal=deal, dealID=dealID, locale=locale)
+
+			shown = 0
+
+			def showcrawls():
+				nonlocal shown
+				while shown < len(crawls) and crawls[shown]["remaining"] == 0:
+					crawl = crawls[shown]
+					shown += 1
+					if crawl["leased"]:
+						pssql.releaselease(dbfile=dbfile, deal=crawl["leaseDeal"], dealID=crawl["dealID"], locale=crawl["locale"])
+						crawl["leased"] = False
+					if crawl["itemcount"] == 0 or crawl["staged"]:
+						continue
+					fullShebang(
+						deal=crawl["deal"], dealID=crawl["dealID"], isDeal=True,
+						itemcount=crawl["itemcount"], pages=crawl["pages"],
+						lang=crawl["lang"], country=crawl["country"], fetched=crawl["fetched"],
+						outdated=crawl["outdated"], streamed=crawl["streamed"]
 					)
-				except TypeError:
-					continue
-			fullShebang(deal=deal, dealID=dealID, isDeal=True, itemcount=itemcount, pages=pages)
-			if len(deals) > 1 and deal != deals[-1][0] and not dontPrintResults:
+					if len(crawls) > 1 and shown != len(crawls) and not dontPrintResults:
+						print()
+
+			showcrawls()
+			started = time.time()
+			# with --archive, parse processes also return each page compressed
+			parse = parseitems
+			if archivePages:
+				parse = archiveitems
+			if pageJobs:
+				for (ind, pagenumber), rows in pspipeline.pipeline(
+					pageJobs, download=pagetext, parse=parse, stats=stats
+				):
+					crawl = crawls[ind]
+					# archived pages and their items share a fetch time, so reparse can tell a newer fetch
+					fetched = time.time()
+					if archivePages:
+						rows, page = rows
+						psarchive.archivepages(archivefile=ARCHIVEFILE, pages=[(
+							crawl["dealID"], crawl["locale"], crawl["deal"], pagenumber,
+							crawl["dealurl"], crawl["pagesize"], page
+						)], fetched=fetched)
+					pssql.insertitems(dbfile=dbfile, rows=rows, fetched=fetched, staged=crawl["staged"])
+					renewleases()
+					if crawl["streamed"]:
+						stream.add(key=ind, rows=rows, ctypes=crawl["ctypes"])
+					crawl["remaining"] -= 1
+					if crawl["remaining"] == 0:
+						pstrace.gauge("duration_seconds", time.time() - started, deal=crawl["deal"], locale=crawl["locale"])
+						if crawl["staged"]:
+							swapcrawl(crawl)
+						if crawl["streamed"]:
+							filename = stream.closefile(key=ind)
+							if filename:
+								savedMessages.append(filename)
+							# the deal's summary is printed next, over the progress line
+							stream.clearprogress()
+					showcrawls()
+		finally:
+			if stream:
+				stream.close()
+			for crawl in crawls:
+				if crawl["leased"]:
+					pssql.releaselease(dbfile=dbfile, deal=crawl["leaseDeal"], dealID=crawl["dealID"], locale=crawl["locale"])
+
+		# outdated deals shown above are fetched anew by one background process per store
+		outdated = {}
+		for crawl in crawls:
+			if crawl["outdated"]:
+				outdated.setdefault((crawl["lang"], crawl["country"]), []).append((crawl["deal"], crawl["dealurl"]))
+		for (storeLang, storeCountry), deals in outdated.items():
+			spawnrefresh(lang=storeLang, country=storeCountry, deals=deals)
+
+		if printPipelineStats and stats["parse"]["items"]:
+			pspipeline.printstats(stats)
+
+		if len(stores) > 1 and not dontPrintResults:
+			fetched = [(crawl["deal"], crawl["dealID"], crawl["locale"]) for crawl in crawls]
+			itemlist = pssql.comparestores(
+				dbfile=dbfile, deals=fetched, minprice=minprice, maxprice=maxprice,
+				allcontent=allcontent, contentTypes=argContentTypes
+			)
+			if itemlist:
 				print()
-		p.close()
-		p.join()
+				printcomparison(itemlist)
+				print("{} titles found in more than one store with the same currency".format(len(itemlist)))
+			elif len(set(CURRENCIES.get(storeCountry) for storeLang, storeCountry in stores)) == len(stores):
+				print("\nprices aren't compared: every store has a different currency")
+
+	# enabled before any pool is started, so that worker processes record their spans too
+	if profileRun:
+		pstrace.enable(profile=profileRun == "cprofile")
+	pstransport.enable(record=recordDir, replay=replayDir, latency=replayLatency)
+	started = time.time()
+	succeeded = False
 	try:
-		if operation == "FETCHDEAL":
-			fetchdeal(dbfile=DBFILE, lang=lang, country=country, fetchall=getAllDeals)
-		elif operation == "FETCHITEM":
-			fetchitem(dbfile=DBFILE, lang=lang, country=country, rawQuery=argQuery)
-		elif operation == "WATCHDOG":
-			watchdog(dbfile=DBFILE, locale=locale, command=subCommand, addtitle=addTitle)
-
+		with pstrace.profiler():
+			if operation == "FETCHDEAL":
+				fetchdeal(dbfile=DBFILE, stores=stores, fetchall=getAllDeals, staged=stageDeals)
+			elif operation == "FETCHITEM":
+				fetchitem(dbfile=MEMORYDB, lang=lang, country=country, rawQuery=argQuery)
+			elif operation == "WATCHDOG":
+				watchdog(dbfile=DBFILE, locale=locale, command=subCommand, addtitle=addTitle)
+			elif operation == "SHELL":
+				shell(dbfile=DBFILE, lang=lang, country=country)
+
+		if profileRun:
+			filename = "psfetcher.{}".format(time.strftime("%Y%m%d-%H%M%S"))
+			savedMessages.extend(pstrace.report(filename=filename))
+
+		succeeded = True
 		if savedMessages:
 			print("saved output:")
 			for message in savedMessages:
@@ -626,6 +1514,18 @@ def main():
 	except IndexError:
 		print("can't fetch anything. likely there are some site code changes.")
 		sys.exit()
+	except pstransport.NotRecordedError as err:
+		# --replay of a page the recording doesn't have, e.g. of another store or query
+		print("error:", err)
+		sys.exit(1)
+	finally:
+		# scheduled runs are monitored through the metrics file, failed runs included
+		if metricsFile:
+			pstrace.gauge("run_duration_seconds", time.time() - started)
+			pstrace.gauge("run_success", int(succeeded))
+			pstrace.gauge("run_timestamp_seconds", time.time())
+			operations = {"FETCHDEAL": "deals", "FETCHITEM": "search", "WATCHDOG": "watchlist", "SHELL": "shell"}
+			psmetrics.writetextfile(filename=metricsFile, dbfile=DBFILE, operation=operations[operation])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from modules import pssql
+
+
+def itemrow(price, roundprice, deal, dealID):
+	return ("t1", "God of War", price, roundprice, "-50%", "Full Game", deal, 1, dealID, "en-us", "PS4")
+
+
+@pytest.mark.parametrize("newerFirst", [False, True])
+def test_localsearch_takes_latest_deal(tmp_path, newerFirst):
+	"""A title shared by two deals is taken from the latest fetched one, whichever was stored first."""
+	dbfile = os.path.join(str(tmp_path), "psfetcher.db")
+	pssql.maketables(dbfile=dbfile)
+	fetches = [
+		(itemrow("$1.00", 1.0, "old deal", "old"), 1000),
+		(itemrow("$9.00", 9.0, "new deal", "new"), 2000),
+	]
+	if newerFirst:
+		fetches.reverse()
+	for row, fetched in fetches:
+		pssql.insertitems(dbfile=dbfile, rows=[row], fetched=fetched)
+
+	rows, fetched = pssql.localsearch(dbfile=dbfile, query="god war", locale="en-us")
+	assert [row[2] for row in rows] == ["$9.00"]
+	assert fetched == 2000